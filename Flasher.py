@@ -1,17 +1,32 @@
 import sys
 import os
-import requests
-import serial.tools.list_ports
 import platform
 import threading
 import time
 import subprocess
-import esptool
+import multiprocessing
+import hashlib
+import contextlib
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QComboBox, QLabel, QProgressBar,
-                             QDialog, QTextEdit)
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QPropertyAnimation, QEasingCurve
-from PyQt5.QtGui import QPixmap, QFont, QFontDatabase
+                             QDialog, QTableWidget, QTableWidgetItem, QSpinBox,
+                             QHeaderView, QAbstractItemView, QCheckBox, QPlainTextEdit, QLineEdit)
+from PyQt5.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal, QPropertyAnimation, QEasingCurve
+from PyQt5.QtGui import QPixmap, QImage, QFont, QFontDatabase, QColor
+
+from catoshub.images import CACHE_DIR, FLASH_FILES, missing_files
+from catoshub.baud import DEFAULT_BAUD, remembered_baud
+from catoshub.bootcheck import BootCheckError, expected_version
+from catoshub.config import mirror_url
+from catoshub.console import MAX_LINES, LineWriter, LogBuffer, filter_lines
+from catoshub.hotplug import AutoFlashPolicy, HotplugWatcher
+from catoshub.jobs import INTERACTIVE, JOB_TIMEOUTS, Job, JobCancelled, default_scheduler
+from catoshub.partitions import PartitionError, load_partitions
+from catoshub.probe import ProbeCache, describe_probe
+from catoshub.progress import format_progress
+from catoshub.trace import NULL_TRACE, JobTrace, format_phases
+
+# esptool и requests грузятся лениво (см. AssetThread), окно не должно их ждать
 
 class CustomMessageBox(QDialog):
     def __init__(self, parent=None, title="", message="", message_type="info", buttons="ok"):
@@ -148,209 +163,645 @@ class CustomMessageBox(QDialog):
         self.animation.setEasingCurve(QEasingCurve.InOutQuad)
         self.animation.start()
 
-class DownloadThread(QThread):
+class JobWorker(QObject):
+    # не свой QThread на каждую кнопку, а задача в общей очереди catoshub.jobs:
+    # на одном порту задачи идут по одной, их можно отменить, у каждой есть таймаут
+    # итог задачи с фазами и временем (запись из traces.jsonl)
+    job_finished = pyqtSignal(dict)
+    kind = None
+    
+    def __init__(self, port=None):
+        super().__init__()
+        self.port = port
+        self.job = None
+        self.scheduler = None
+        self.trace = NULL_TRACE
+    
+    def start(self, scheduler=None, priority=INTERACTIVE):
+        self.scheduler = scheduler or default_scheduler()
+        self.job = Job(self.kind, self.run, self.port, priority, JOB_TIMEOUTS.get(self.kind))
+        self.scheduler.submit(self.job)
+    
+    def cancel(self):
+        if self.job is None:
+            return
+        self.scheduler.cancel(self.job)
+        # из очереди сняли до запуска: run не будет, итог сообщаем сами
+        if self.job.done and self.job.started is None:
+            self.finish(False, "Cancelled")
+    
+    def isRunning(self):
+        return self.job is not None and not self.job.done
+    
+    def check(self):
+        if self.job is not None:
+            self.job.check()
+    
+    def finish(self, success, message):
+        record = self.trace.finish(success, message)
+        if record is not None:
+            self.job_finished.emit(record)
+
+class DownloadThread(JobWorker):
     progress_updated = pyqtSignal(int)
     download_finished = pyqtSignal(bool, str)
+    kind = "download"
     
-    def __init__(self, repo_owner, repo_name, cache_dir):
+    def __init__(self, repo_owner, repo_name, cache_dir, mirror=None):
         super().__init__()
         self.repo_owner = repo_owner
         self.repo_name = repo_name
         self.cache_dir = cache_dir
+        self.mirror = mirror
         
-    def run(self):
+    def finish(self, success, message):
+        super().finish(success, message)
+        self.download_finished.emit(success, message)
+    
+    def on_progress(self, value):
+        self.check()
+        self.progress_updated.emit(value)
+        
+    def run(self, job=None):
+        self.job = job or self.job
+        self.trace = JobTrace("download")
         try:
-            # получаем инфу
-            latest_release_url = f"https://api.github.com/repos/{self.repo_owner}/{self.repo_name}/releases/latest"
-            response = requests.get(latest_release_url)
-            if response.status_code != 200:
-                self.download_finished.emit(False, f"Ошибка при получении информации о релизе: {response.status_code}")
-                return
-                
-            release_data = response.json()
-            release_tag = release_data['tag_name']
-
-            firmware_url = None
-            for asset in release_data.get('assets', []):
-                if asset['name'] == 'firmware.bin':
-                    firmware_url = asset['browser_download_url']
-                    break
+            self.download()
+        except JobCancelled as e:
+            self.finish(False, str(e))
+            raise
+    
+    def download(self):
+        try:
+            from catoshub.release import ReleaseError, update_firmware
             
-            if not firmware_url:
-                self.download_finished.emit(False, "Файл firmware.bin не найден в релизе")
+            try:
+                release_tag, status = update_firmware(self.repo_owner, self.repo_name, self.cache_dir,
+                                                      self.on_progress, mirror=self.mirror,
+                                                      trace=self.trace)
+            except ReleaseError as e:
+                self.finish(False, str(e))
                 return
             
-            os.makedirs(self.cache_dir, exist_ok=True)
-            
-            # сохраняем инфу
-            with open(os.path.join(self.cache_dir, 'current_release.txt'), 'w') as f:
-                f.write(release_tag)
-            
-            # ииии скачиваем
-            response = requests.get(firmware_url, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            
-            firmware_path = os.path.join(self.cache_dir, 'firmware.bin')
-            downloaded_size = 0
-            
-            with open(firmware_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        if total_size > 0:
-                            progress = int((downloaded_size / total_size) * 100)
-                            self.progress_updated.emit(progress)
-            
-            self.download_finished.emit(True, f"The firmware has been downloaded successfully: {release_tag}")
+            self.progress_updated.emit(100)
+            if status == "cached":
+                message = f"GitHub is unavailable, using cached firmware: {release_tag}"
+            elif status == "up-to-date":
+                message = f"The firmware is already up to date: {release_tag}"
+            elif status == "mirrored":
+                message = f"The firmware has been downloaded from the LAN mirror: {release_tag}"
+            elif status == "patched":
+                message = f"The firmware has been updated with a delta: {release_tag}"
+            else:
+                message = f"The firmware has been downloaded successfully: {release_tag}"
+            self.finish(True, message)
             
         except Exception as e:
-            self.download_finished.emit(False, f"Error: {str(e)}")
+            self.finish(False, f"Error: {str(e)}")
 
-class FlashThread(QThread):
+class FlashThread(JobWorker):
     progress_updated = pyqtSignal(int)
+    transfer_updated = pyqtSignal(dict)
     flash_finished = pyqtSignal(bool, str)
     console_message = pyqtSignal(str)
+    kind = "flash"
     
-    def __init__(self, port, flash_files):
-        super().__init__()
-        self.port = port
+    def __init__(self, session, flash_files, incremental=False, boot_check=False):
+        super().__init__(session.port)
+        self.session = session
         self.flash_files = flash_files
-        
-    def run(self):
+        self.incremental = incremental
+        self.boot_check = boot_check
+        
+    def finish(self, success, message):
+        # сессия переживает задачу: дальше ее фазы к этой прошивке не относятся
+        self.session.trace = NULL_TRACE
+        super().finish(success, message)
+        self.flash_finished.emit(success, message)
+        
+    def on_transfer(self, state):
+        # между блоками записи: отмена и таймаут срабатывают тут
+        self.check()
+        self.transfer_updated.emit(state)
+        
+    def run(self, job=None):
+        self.job = job or self.job
+        self.trace = JobTrace("flash", self.session.port)
+        self.session.trace = self.trace
+        try:
+            # esptool пишет в stdout: его строки тоже идут в консоль окна
+            with contextlib.redirect_stdout(LineWriter(self.console_message.emit)):
+                self.flash()
+        except JobCancelled as e:
+            # журнал записи остается: следующая прошивка продолжит с того же места
+            self.session.close()
+            self.console_message.emit(f"Flashing stopped: {str(e)}")
+            self.finish(False, str(e))
+            raise
+    
+    def flash(self):
         try:
+            from catoshub.imageset import board_payloads
+            from catoshub.journal import write_resumable
+            
             self.console_message.emit("The ESP32 firmware process begins...")
+            self.session.log = self.console_message.emit
             
             # чекаем файлы
             for file_info in self.flash_files:
                 if not os.path.exists(file_info["path"]):
                     error_msg = f"❌ File not found: {file_info['path']}"
                     self.console_message.emit(error_msg)
-                    self.flash_finished.emit(False, error_msg)
+                    self.finish(False, error_msg)
                     return
             
-            command = [
-                '--chip', 'esp32',
-                '--port', self.port,
-                '--baud', '460800',
-                '--before', 'default_reset',
-                '--after', 'hard_reset',
-                'write_flash',
-                '-z',
-                '--flash_mode', 'dio',
-                '--flash_freq', '80m',
-                '--flash_size', '4MB'
-            ]
-            
-            for file_info in self.flash_files:
-                command.extend([file_info["offset"], file_info["path"]])
+            if self.incremental:
+                self.run_incremental()
+                return
             
-            self.console_message.emit(f"The firmware command: esptool.py {' '.join(command)}")
+            # образы читаются и сжимаются один раз на релиз и размер флеша, дальше берутся из памяти;
+            # размер флеша платы берется из ее отпечатка при подключении
+            payloads = board_payloads(self.flash_files)
             
             self.console_message.emit("Connecting and upload fimware to ESP32...")
-            self.progress_updated.emit(10)
+            self.progress_updated.emit(0)
             
             try:
-                esptool.main(command)
+                # при обрыве дописывает с первого несовпавшего блока, а не с нуля
+                write_resumable(self.session, payloads, self.on_transfer)
+                message = "ESP32 has been successfully stitched!" + self.reset_board()
                 self.console_message.emit("The firmware is completed successfully!")
                 self.progress_updated.emit(100)
-                self.flash_finished.emit(True, "ESP32 has been successfully stitched!")
+                self.finish(True, message)
                 
-            except SystemExit as e:
-                if e.code == 0:
-                    self.console_message.emit("The firmware is completed successfully!")
-                    self.progress_updated.emit(100)
-                    self.flash_finished.emit(True, "ESP32 has been successfully stitched!")
-                else:
-                    error_msg = f"Firmware error ({e.code})"
-                    self.console_message.emit(error_msg)
-                    self.flash_finished.emit(False, error_msg)
-                    
+            except BootCheckError as e:
+                error_msg = f"Boot check failed: {str(e)}"
+                self.console_message.emit(error_msg)
+                self.finish(False, error_msg)
             except Exception as e:
+                self.session.close()
                 error_msg = f"Error when calling esptool: {str(e)}"
                 self.console_message.emit(error_msg)
-                self.flash_finished.emit(False, error_msg)
+                self.finish(False, error_msg)
             
         except Exception as e:
             error_msg = f"Critical error: {str(e)}"
             self.console_message.emit(error_msg)
-            self.flash_finished.emit(False, error_msg)
+            self.finish(False, error_msg)
+
+    def run_incremental(self):
+        from catoshub.diff import write_incremental
+        from catoshub.imageset import board_images
+        
+        self.progress_updated.emit(0)
+        try:
+            written, total = write_incremental(self.session, board_images(self.flash_files), self.on_transfer)
+            booted = self.reset_board()
+        except BootCheckError as e:
+            error_msg = f"Boot check failed: {str(e)}"
+            self.console_message.emit(error_msg)
+            self.finish(False, error_msg)
+            return
+        except Exception as e:
+            self.session.close()
+            error_msg = f"Incremental flash error: {str(e)}"
+            self.console_message.emit(error_msg)
+            self.finish(False, error_msg)
+            return
+        
+        self.progress_updated.emit(100)
+        if written:
+            message = f"ESP32 has been successfully stitched! ({written} of {total} bytes rewritten)"
+        else:
+            message = "ESP32 already has this firmware, nothing to write"
+        message += booted
+        self.console_message.emit(message)
+        self.finish(True, message)
+
+    def reset_board(self):
+        # без проверки просто сброс; с проверкой ждем баннер CatOs той версии, что прошили
+        self.check()
+        if not self.boot_check:
+            self.session.hard_reset()
+            return ""
+        version = self.session.boot_check(expected_version(self.flash_files))
+        return f" CatOs {version} booted."
 
-class EraseThread(QThread):
+class EraseThread(JobWorker):
     progress_updated = pyqtSignal(int)
     erase_finished = pyqtSignal(bool, str)
     console_message = pyqtSignal(str)
+    kind = "erase"
     
-    def __init__(self, port):
-        super().__init__()
-        self.port = port
+    def __init__(self, session, partition_names=None, partitions=None, backup=False):
+        super().__init__(session.port)
+        self.session = session
+        self.partition_names = partition_names
+        self.partitions = partitions
+        # backup: сначала сохранить то, что будет стерто (fimware/backups), и только потом стирать
+        self.backup = backup
+        self.backup_path = None
+        
+    def finish(self, success, message):
+        self.session.trace = NULL_TRACE
+        if success and self.backup_path:
+            message += f" (backup: {self.backup_path})"
+        super().finish(success, message)
+        self.erase_finished.emit(success, message)
+    
+    def on_backup_progress(self, state):
+        self.check()
+        # бэкап - первые 20% полосы, дальше идет само стирание
+        self.progress_updated.emit(state["percent"] // 5)
+        
+    def run(self, job=None):
+        self.job = job or self.job
+        self.trace = JobTrace("erase", self.session.port)
+        self.session.trace = self.trace
+        try:
+            # стирание чипа одной командой не прервать: отмена успеет только до его начала
+            self.check()
+            with contextlib.redirect_stdout(LineWriter(self.console_message.emit)):
+                if self.backup and not self.backup_flash():
+                    return
+                if self.partition_names:
+                    self.erase_partitions()
+                else:
+                    self.erase()
+        except JobCancelled as e:
+            self.session.close()
+            self.console_message.emit(f"Erase stopped: {str(e)}")
+            self.finish(False, str(e))
+            raise
+    
+    def backup_flash(self):
+        from catoshub.backup import backup_flash, partition_regions
         
-    def run(self):
+        self.console_message.emit("Backing up the flash before erasing...")
+        self.session.log = self.console_message.emit
+        try:
+            regions = None
+            if self.partition_names:
+                regions = partition_regions(self.session, self.partition_names, self.partitions)
+            self.backup_path, _ = backup_flash(self.session, regions, on_progress=self.on_backup_progress)
+        except Exception as e:
+            self.session.close()
+            error_msg = f"Backup failed, nothing was erased: {str(e)}"
+            self.console_message.emit(error_msg)
+            self.finish(False, error_msg)
+            return False
+        self.console_message.emit(f"Backup saved: {self.backup_path}")
+        return True
+    
+    def erase_partitions(self):
+        self.console_message.emit(f"Erasing partitions: {', '.join(self.partition_names)}...")
+        self.session.log = self.console_message.emit
+        self.progress_updated.emit(20)
+        try:
+            erased = self.session.erase_partitions(self.partition_names, self.partitions)
+        except Exception as e:
+            self.session.close()
+            error_msg = f"Error when erasing partitions: {str(e)}"
+            self.console_message.emit(error_msg)
+            self.finish(False, error_msg)
+            return
+        self.progress_updated.emit(100)
+        self.finish(True, f"Erased {sum(erased.values())} bytes in {', '.join(erased)}")
+    
+    def erase(self):
         try:
             self.console_message.emit("The cleaning of the ESP32 flash memory begins...")
-            
-            command = [
-                '--chip', 'esp32',
-                '--port', self.port,
-                '--baud', '460800',
-                'erase_flash'
-            ]
-            
-            self.console_message.emit(f"The cleaning command: esptool.py {' '.join(command)}")
+            self.session.log = self.console_message.emit
             self.progress_updated.emit(20)
             
             try:
-                esptool.main(command)
+                # сессию не закрываем: следующая прошивка пойдет без нового рукопожатия
+                self.session.erase_flash()
                 self.console_message.emit("The flash memory cleanup has been completed successfully!")
                 self.progress_updated.emit(100)
-                self.erase_finished.emit(True, "ESP32 flash memory has been successfully cleared!")
+                self.finish(True, "ESP32 flash memory has been successfully cleared!")
                 
-            except SystemExit as e:
-                if e.code == 0:
-                    self.console_message.emit("The flash memory cleanup has been completed successfully!")
-                    self.progress_updated.emit(100)
-                    self.erase_finished.emit(True, "The ESP32 flash memory has been successfully cleared!")
-                else:
-                    error_msg = f"Cleaning error (code {e.code})"
-                    self.console_message.emit(error_msg)
-                    self.erase_finished.emit(False, error_msg)
-                    
             except Exception as e:
+                self.session.close()
                 error_msg = f"Error when calling esptool: {str(e)}"
                 self.console_message.emit(error_msg)
-                self.erase_finished.emit(False, error_msg)
+                self.finish(False, error_msg)
             
         except Exception as e:
             error_msg = f"Critical error: {str(e)}"
             self.console_message.emit(error_msg)
-            self.erase_finished.emit(False, error_msg)
+            self.finish(False, error_msg)
+
+class StationThread(QThread):
+    port_started = pyqtSignal(str)
+    port_message = pyqtSignal(str, str)
+    port_progress = pyqtSignal(str, dict)
+    port_finished = pyqtSignal(str, bool, str)
+    station_finished = pyqtSignal()
+    
+    def __init__(self, ports, flash_files, max_parallel, incremental=False, baud=DEFAULT_BAUD,
+                 continuous=False, boot_check=False):
+        super().__init__()
+        from catoshub.station import FlashStation
+        
+        # общая очередь с окнами прошивки: один порт не шьется из двух мест сразу
+        self.station = FlashStation(ports, flash_files, max_parallel, incremental, baud, continuous, boot_check,
+                                    scheduler=default_scheduler())
+    
+    def add_port(self, port):
+        self.station.add_port(port)
+    
+    def finish(self):
+        self.station.finish()
+    
+    def stop(self):
+        self.station.stop()
+        
+    def run(self):
+        try:
+            self.station.run(self.handle_event)
+        except Exception as e:
+            for port in self.station.ports:
+                if port not in self.station.results:
+                    self.port_finished.emit(port, False, f"Critical error: {str(e)}")
+        self.station_finished.emit()
+    
+    def handle_event(self, port, kind, value):
+        if kind == "started":
+            self.port_started.emit(port)
+        elif kind == "log":
+            self.port_message.emit(port, value)
+        elif kind == "progress":
+            self.port_progress.emit(port, value)
+        elif kind == "trace":
+            self.port_message.emit(port, format_phases(value))
+        elif kind == "done":
+            self.port_finished.emit(port, value[0], value[1])
+
+PIXMAP_CACHE_DIR = os.path.join(CACHE_DIR, "pixmaps")
+
+# уже отмасштабированные картинки на время жизни процесса
+_image_cache = {}
+
+def load_scaled_image(path, width, height):
+    # QImage, а не QPixmap: можно работать вне GUI-потока
+    cache_key = (path, width, height)
+    if cache_key in _image_cache:
+        return _image_cache[cache_key]
+    
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return QImage()
+    
+    source_hash = hashlib.sha1(data).hexdigest()
+    cached_path = os.path.join(PIXMAP_CACHE_DIR, f"{source_hash}_{width}x{height}.bmp")
+    image = QImage(cached_path) if os.path.exists(cached_path) else QImage()
+    if image.isNull():
+        image = QImage.fromData(data)
+        if image.isNull():
+            return image
+        image = image.scaled(width, height, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        try:
+            os.makedirs(PIXMAP_CACHE_DIR, exist_ok=True)
+            # bmp читается почти без декодирования
+            image.save(cached_path, "BMP")
+        except OSError:
+            pass
+    
+    _image_cache[cache_key] = image
+    return image
+
+class AssetThread(QThread):
+    font_loaded = pyqtSignal(bytes)
+    image_loaded = pyqtSignal(str, QImage)
+    
+    def __init__(self, font_path, image_paths, prefetch_modules=False):
+        super().__init__()
+        self.font_path = font_path
+        self.image_paths = image_paths
+        self.prefetch_modules = prefetch_modules
+        
+    def run(self):
+        if self.font_path:
+            try:
+                with open(self.font_path, 'rb') as f:
+                    self.font_loaded.emit(f.read())
+            except OSError:
+                self.font_loaded.emit(b"")
+        
+        for path in self.image_paths:
+            self.image_loaded.emit(path, load_scaled_image(path, 600, 600))
+        
+        if self.prefetch_modules:
+            # прогреваем esptool и requests, пока пользователь выбирает порт
+            import catoshub.device
+            import catoshub.release
+            import catoshub.station
+
+class ConsoleView(QPlainTextEdit):
+    # строки копятся в LogBuffer (из любого потока), на экран уходят пачкой раз в кадр
+    FRAME_MS = 33
+    
+    def __init__(self, parent=None, buffer=None):
+        super().__init__(parent)
+        self.buffer = buffer if buffer is not None else LogBuffer()
+        self.filter_text = ""
+        self.setReadOnly(True)
+        self.setMaximumBlockCount(MAX_LINES)
+        self.setLineWrapMode(QPlainTextEdit.NoWrap)
+        
+        self.frame_timer = QTimer(self)
+        self.frame_timer.timeout.connect(self.flush)
+        self.frame_timer.start(self.FRAME_MS)
+    
+    def append(self, line):
+        self.buffer.append(str(line))
+    
+    def flush(self):
+        lines, overflowed = self.buffer.drain()
+        if overflowed:
+            self.redraw()
+            return
+        lines = filter_lines(lines, self.filter_text)
+        if lines:
+            self.appendPlainText("\n".join(lines))
+    
+    def redraw(self):
+        self.setPlainText("\n".join(self.buffer.redraw(self.filter_text)))
+        self.verticalScrollBar().setValue(self.verticalScrollBar().maximum())
+    
+    def set_filter(self, text):
+        self.filter_text = text
+        self.redraw()
+    
+    def set_buffer(self, buffer):
+        self.buffer = buffer
+        self.redraw()
+    
+    def clear(self):
+        self.buffer.clear()
+        super().clear()
+
+class HotplugThread(QThread):
+    ports_found = pyqtSignal(list)
+    port_attached = pyqtSignal(dict)
+    port_detached = pyqtSignal(dict)
+    
+    def __init__(self):
+        super().__init__()
+        self.watcher = HotplugWatcher(self.port_attached.emit, self.port_detached.emit, self.initial_scan_done)
+    
+    def initial_scan_done(self, ports):
+        self.ports_found.emit([ports[device] for device in sorted(ports)])
+    
+    def stop(self):
+        self.watcher.stop()
+        self.wait(2000)
+        
+    def run(self):
+        self.watcher.run()
+
+class ProbeThread(QThread):
+    port_probed = pyqtSignal(str, dict)
+    
+    def __init__(self, port_infos, cache):
+        super().__init__()
+        self.port_infos = port_infos
+        self.cache = cache
+        
+    def run(self):
+        from catoshub.probe import probe_ports
+        
+        # все порты сразу, у каждого своя короткая синхронизация
+        probe_ports(self.port_infos, self.port_probed.emit, self.cache)
 
 class MainWindow(QMainWindow):
+    startup_finished = pyqtSignal()
+    
     def __init__(self):
         super().__init__()
         
-        # шрифт
-        self.custom_font = self.load_font("VCROSDMonoRUSbyD.ttf")
+        # шрифт подгрузится в фоне, пока рисуем окно с запасным
+        self.custom_font = QFont("Arial", 11)
+        self.available_ports = []
+        self.port_infos = {}
+        self.probe_results = {}
+        self.probe_cache = ProbeCache()
+        self.probe_threads = []
+        self.pending_startup = {"font", "background", "ports"}
         
         self.initUI()
+        
+        self.asset_thread = AssetThread("VCROSDMonoRUSbyD.ttf", ["background.jpg", "main.jpg"], True)
+        self.asset_thread.font_loaded.connect(self.load_font)
+        self.asset_thread.image_loaded.connect(self.image_loaded)
+        self.asset_thread.start()
+        
+        self.hotplug_thread = HotplugThread()
+        self.hotplug_thread.ports_found.connect(self.ports_found)
+        self.hotplug_thread.port_attached.connect(self.port_attached)
+        self.hotplug_thread.port_detached.connect(self.port_detached)
+        self.hotplug_thread.start()
     
-    def load_font(self, font_path):
-        font_id = QFontDatabase.addApplicationFont(font_path)
+    def load_font(self, font_data):
+        font_id = QFontDatabase.addApplicationFontFromData(font_data) if font_data else -1
         if font_id != -1:
             font_families = QFontDatabase.applicationFontFamilies(font_id)
             if font_families:
                 font_name = font_families[0]
                 print(f"front loaded: {font_name}")
-                return QFont(font_name, 11)
-        print("font is not loaded")
-        return QFont("Arial", 11)
+                self.custom_font = QFont(font_name, 11)
+                for widget in (self.port_combo, self.station_button, self.ok_button):
+                    widget.setFont(self.custom_font)
+        else:
+            print("font is not loaded")
+        self.startup_step_done("font")
+    
+    def image_loaded(self, path, image):
+        if path != "background.jpg":
+            return
+        if not image.isNull():
+            self.image_label.setPixmap(QPixmap.fromImage(image))
+        else:
+            print("error with background.jpg")
+        self.startup_step_done("background")
+    
+    def ports_found(self, infos):
+        self.port_infos = {info["device"]: info for info in infos}
+        self.available_ports = [info["device"] for info in infos]
+        self.update_port_combo()
+        self.startup_step_done("ports")
+        self.probe(infos)
+    
+    def port_attached(self, info):
+        # до первого полного скана порты придут через ports_found
+        if "ports" not in self.pending_startup and info["device"] not in self.available_ports:
+            self.port_infos[info["device"]] = info
+            self.available_ports.append(info["device"])
+            self.update_port_combo()
+            self.probe([info])
+    
+    def port_detached(self, info):
+        self.probe_cache.invalidate(info["device"])
+        self.probe_results.pop(info["device"], None)
+        self.port_infos.pop(info["device"], None)
+        if info["device"] in self.available_ports:
+            self.available_ports.remove(info["device"])
+            self.update_port_combo()
+    
+    def probe(self, infos):
+        probe_thread = ProbeThread(infos, self.probe_cache)
+        probe_thread.port_probed.connect(self.port_probed)
+        probe_thread.finished.connect(lambda: self.probe_threads.remove(probe_thread))
+        self.probe_threads.append(probe_thread)
+        probe_thread.start()
+    
+    def port_probed(self, port, result):
+        if port in self.available_ports:
+            self.probe_results[port] = result
+            # меняем только текст пункта, чтобы не закрыть раскрытый список
+            index = self.port_combo.findData(port)
+            if index >= 0:
+                self.set_port_item(index, port)
+    
+    def set_port_item(self, index, port):
+        result = self.probe_results.get(port)
+        label = describe_probe(result)
+        self.port_combo.setItemText(index, f"{port}  {label}" if label else port)
+        if result:
+            tooltip = result.get("error") or f"{result['description']}\nMAC {result['mac']}"
+            self.port_combo.setItemData(index, tooltip, Qt.ToolTipRole)
+    
+    def update_port_combo(self):
+        selected_port = self.port_combo.currentData()
+        self.port_combo.clear()
+        if self.available_ports:
+            self.port_combo.addItem("Select port...")
+            for port in self.available_ports:
+                self.port_combo.addItem(port, port)
+                self.set_port_item(self.port_combo.count() - 1, port)
+            if selected_port in self.available_ports:
+                self.port_combo.setCurrentIndex(self.port_combo.findData(selected_port))
+        else:
+            self.port_combo.addItem("No ports found")
+    
+    def closeEvent(self, event):
+        self.hotplug_thread.stop()
+        # проба держит порт открытым, прошивка должна получить его свободным
+        for probe_thread in list(self.probe_threads):
+            probe_thread.wait()
+        super().closeEvent(event)
+    
+    def startup_step_done(self, step):
+        if step in self.pending_startup:
+            self.pending_startup.discard(step)
+            if not self.pending_startup:
+                self.startup_finished.emit()
     
     def get_available_ports(self):
-        ports = serial.tools.list_ports.comports()
-        port_list = []
-        for port in ports:
-            port_list.append(port.device)
-        return port_list
+        return self.available_ports
     
     def initUI(self):
         self.setWindowTitle("CatOs flasher")
@@ -367,13 +818,6 @@ class MainWindow(QMainWindow):
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.setStyleSheet("background-color: black;")
         
-        pixmap = QPixmap("background.jpg")
-        if not pixmap.isNull():
-            pixmap = pixmap.scaled(600, 600, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-            self.image_label.setPixmap(pixmap)
-        else:
-            print("error with background.jpg")
-        
         bottom_panel = QWidget()
         bottom_panel.setFixedHeight(50)
         bottom_panel.setStyleSheet("background-color: black;")
@@ -401,13 +845,8 @@ class MainWindow(QMainWindow):
             }
         """)
         
-        available_ports = self.get_available_ports()
-        if available_ports:
-            self.port_combo.addItem("Select port...")
-            for port in available_ports:
-                self.port_combo.addItem(port)
-        else:
-            self.port_combo.addItem("No ports found")
+        self.port_combo.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+        self.port_combo.addItem("Scanning ports...")
         
         self.ok_button = QPushButton("OK")
         self.ok_button.setFont(self.custom_font)
@@ -427,21 +866,46 @@ class MainWindow(QMainWindow):
             }
         """)
         
+        self.station_button = QPushButton("Station")
+        self.station_button.setFont(self.custom_font)
+        self.station_button.setFixedSize(100, 35)
+        self.station_button.setStyleSheet("""
+            QPushButton {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #333;
+            }
+            QPushButton:pressed {
+                background-color: #555;
+            }
+        """)
+        
         bottom_layout.addWidget(self.port_combo)
         bottom_layout.addStretch()
+        bottom_layout.addWidget(self.station_button)
         bottom_layout.addWidget(self.ok_button)
         
         layout.addWidget(self.image_label, 1)
         layout.addWidget(bottom_panel)
         
         self.ok_button.clicked.connect(self.open_flash_window)
+        self.station_button.clicked.connect(self.open_station_window)
     
     def open_flash_window(self):
-        selected_port = self.port_combo.currentText()
-        if selected_port != "Select port..." and selected_port != "No ports found":
+        selected_port = self.port_combo.currentData()
+        if selected_port in self.available_ports:
             self.flash_window = FlashWindow(self.custom_font, selected_port)
             self.flash_window.show()
             self.close()
+    
+    def open_station_window(self):
+        self.station_window = StationWindow(self.custom_font, self.get_available_ports())
+        self.station_window.show()
+        self.close()
 
 class FlashWindow(QMainWindow):
     def __init__(self, custom_font, selected_port):
@@ -451,11 +915,52 @@ class FlashWindow(QMainWindow):
         self.download_thread = None
         self.flash_thread = None
         self.erase_thread = None
+        self.session = None
         self.initUI()
+    
+    def image_loaded(self, path, image):
+        if not image.isNull():
+            self.image_label.setPixmap(QPixmap.fromImage(image))
+        else:
+            print("Error with main.jpg")
+    
+    def device_session(self):
+        # одна сессия на окно: стирание и прошивка подряд не переподключаются к плате;
+        # без автоподбора берем скорость, уже проверенную на этом переходнике
+        baud = "auto" if self.auto_baud_checkbox.isChecked() else remembered_baud(self.selected_port)
+        if self.session is not None and self.session.baud != baud:
+            self.session.close()
+            self.session = None
+        if self.session is None:
+            from catoshub.device import DeviceSession
+            
+            self.session = DeviceSession(self.selected_port, baud)
+        return self.session
+    
+    def set_device_buttons_enabled(self, enabled):
+        self.flash_button.setEnabled(enabled)
+        self.erase_button.setEnabled(enabled)
+        self.erase_target_combo.setEnabled(enabled)
+        self.backup_checkbox.setEnabled(enabled)
+        self.cancel_button.setEnabled(not enabled)
+    
+    def cancel_device_job(self):
+        for worker in (self.flash_thread, self.erase_thread):
+            if worker is not None and worker.isRunning():
+                self.console.append("Cancelling...")
+                worker.cancel()
+    
+    def closeEvent(self, event):
+        if self.session is not None and not self.is_device_busy():
+            self.session.close(reset=True)
+        super().closeEvent(event)
+    
+    def is_device_busy(self):
+        # занят и своими задачами, и чужими: порт может шить окно станции
+        return default_scheduler().busy(self.selected_port)
         
     def get_catos_version(self):
-        cache_dir = "fimware"
-        version_file = os.path.join(cache_dir, 'current_release.txt')
+        version_file = os.path.join(CACHE_DIR, 'current_release.txt')
         
         if os.path.exists(version_file):
             try:
@@ -482,17 +987,19 @@ class FlashWindow(QMainWindow):
         background_layout = QVBoxLayout(background_widget)
         background_layout.setContentsMargins(0, 0, 0, 0)
         
-        image_label = QLabel()
-        image_label.setAlignment(Qt.AlignCenter)
+        self.image_label = QLabel()
+        self.image_label.setAlignment(Qt.AlignCenter)
         
-        pixmap = QPixmap("main.jpg")
-        if not pixmap.isNull():
-            pixmap = pixmap.scaled(600, 600, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
-            image_label.setPixmap(pixmap)
+        # обычно main.jpg уже подгружен главным окном
+        cached_image = _image_cache.get(("main.jpg", 600, 600))
+        if cached_image is not None:
+            self.image_loaded("main.jpg", cached_image)
         else:
-            print("Error with main.jpg")
+            self.asset_thread = AssetThread(None, ["main.jpg"])
+            self.asset_thread.image_loaded.connect(self.image_loaded)
+            self.asset_thread.start()
         
-        background_layout.addWidget(image_label)
+        background_layout.addWidget(self.image_label)
 
         large_font = QFont(self.custom_font)
         large_font.setPointSize(22)
@@ -550,9 +1057,24 @@ class FlashWindow(QMainWindow):
         progress_font.setPointSize(12)
         self.progress_bar.setFont(progress_font)
         
+        self.incremental_checkbox = QCheckBox("Only changed sectors", background_widget)
+        self.incremental_checkbox.setFont(self.custom_font)
+        self.incremental_checkbox.setStyleSheet("color: white; background-color: transparent;")
+        self.incremental_checkbox.setGeometry(45, 342, 240, 20)
+        
+        self.auto_baud_checkbox = QCheckBox("Auto baud rate", background_widget)
+        self.auto_baud_checkbox.setFont(self.custom_font)
+        self.auto_baud_checkbox.setStyleSheet("color: white; background-color: transparent;")
+        self.auto_baud_checkbox.setGeometry(45, 362, 240, 20)
+        
+        self.boot_check_checkbox = QCheckBox("Check boot", background_widget)
+        self.boot_check_checkbox.setFont(self.custom_font)
+        self.boot_check_checkbox.setStyleSheet("color: white; background-color: transparent;")
+        self.boot_check_checkbox.setGeometry(45, 382, 240, 20)
+        
         self.flash_button = QPushButton("Flash", background_widget)
         self.flash_button.setFont(self.custom_font)
-        self.flash_button.setFixedSize(200, 40)
+        self.flash_button.setFixedSize(150, 40)
         self.flash_button.setStyleSheet("""
             QPushButton {
                 background-color: black;
@@ -567,9 +1089,16 @@ class FlashWindow(QMainWindow):
                 background-color: #555;
             }
         """)
-        self.flash_button.setGeometry(45, 430, 200, 40)
+        self.flash_button.setGeometry(45, 430, 150, 40)
         self.flash_button.clicked.connect(self.flash_firmware)
         
+        self.cancel_button = QPushButton("Cancel", background_widget)
+        self.cancel_button.setFont(self.custom_font)
+        self.cancel_button.setStyleSheet(self.flash_button.styleSheet())
+        self.cancel_button.setGeometry(200, 430, 100, 40)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_device_job)
+        
         self.flash_progress_bar = QProgressBar(background_widget)
         self.flash_progress_bar.setGeometry(45, 490, 200, 40)
         self.flash_progress_bar.setMinimum(0)
@@ -591,9 +1120,9 @@ class FlashWindow(QMainWindow):
         
         self.flash_progress_bar.setFont(progress_font)
         
-        self.erase_button = QPushButton("Erase ESP32", background_widget)
+        self.erase_button = QPushButton("Erase", background_widget)
         self.erase_button.setFont(self.custom_font)
-        self.erase_button.setFixedSize(200, 40)
+        self.erase_button.setFixedSize(120, 40)
         self.erase_button.setStyleSheet("""
             QPushButton {
                 background-color: black;
@@ -608,16 +1137,51 @@ class FlashWindow(QMainWindow):
                 background-color: #555;
             }
         """)
-        self.erase_button.setGeometry(45, 555, 200, 40)
+        self.erase_button.setGeometry(45, 555, 120, 40)
         self.erase_button.clicked.connect(self.erase_esp32)
         
+        # перед стиранием сохранить флеш: читаются только блоки, которых еще нет в fimware/blocks
+        self.backup_checkbox = QCheckBox("Back up before erase", background_widget)
+        self.backup_checkbox.setFont(self.custom_font)
+        self.backup_checkbox.setStyleSheet("color: white; background-color: transparent;")
+        self.backup_checkbox.setGeometry(45, 533, 240, 20)
+        
+        # что стирать: весь чип или один раздел из flash/partitions.bin
+        self.erase_target_combo = QComboBox(background_widget)
+        self.erase_target_combo.setFont(self.custom_font)
+        self.erase_target_combo.setGeometry(170, 555, 130, 40)
+        self.erase_target_combo.setStyleSheet("""
+            QComboBox {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                padding: 5px;
+            }
+            QComboBox::drop-down {
+                border: none;
+            }
+            QComboBox QAbstractItemView {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+            }
+        """)
+        self.erase_target_combo.addItem("All", None)
+        try:
+            self.partitions = load_partitions()
+        except PartitionError as e:
+            self.partitions = None
+            print(f"Partition table: {str(e)}")
+        for partition in self.partitions or []:
+            self.erase_target_combo.addItem(partition.name, partition.name)
+        
         self.catos_version_label = QLabel(background_widget)
         catos_version = self.get_catos_version()
         self.catos_version_label.setText(f"CatOs: {catos_version}")
         self.catos_version_label.setFont(version_font)
         self.catos_version_label.setStyleSheet("color: white; background-color: transparent;")
         self.catos_version_label.setAlignment(Qt.AlignLeft)
-        self.catos_version_label.setGeometry(15, 290, 350, 35)
+        self.catos_version_label.setGeometry(15, 252, 350, 35)
         
         os_label = QLabel(background_widget)
         os_name = platform.system()
@@ -625,19 +1189,33 @@ class FlashWindow(QMainWindow):
         os_label.setFont(version_font)
         os_label.setStyleSheet("color: white; background-color: transparent;")
         os_label.setAlignment(Qt.AlignLeft)
-        os_label.setGeometry(15, 320, 350, 35)
+        os_label.setGeometry(15, 277, 350, 35)
         
         flasher_version_label = QLabel(background_widget)
         flasher_version_label.setText("CatOs Flasher: v0.1")
         flasher_version_label.setFont(version_font)
         flasher_version_label.setStyleSheet("color: white; background-color: transparent;")
         flasher_version_label.setAlignment(Qt.AlignLeft)
-        flasher_version_label.setGeometry(15, 350, 350, 35)
+        flasher_version_label.setGeometry(15, 302, 350, 35)
         
-        self.console = QTextEdit(background_widget)
-        self.console.setGeometry(308, 190, 280, 400)
+        self.console_filter = QLineEdit(background_widget)
+        self.console_filter.setGeometry(308, 190, 280, 26)
+        self.console_filter.setPlaceholderText("Filter log...")
+        self.console_filter.setStyleSheet("""
+            QLineEdit {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-family: "Courier New";
+                font-size: 10px;
+            }
+        """)
+        
+        self.console = ConsoleView(background_widget, LogBuffer(prefix=self.selected_port))
+        self.console.setGeometry(308, 220, 280, 370)
+        self.console_filter.textChanged.connect(self.console.set_filter)
         self.console.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: black;
                 color: white;
                 border: 2px solid white;
@@ -645,7 +1223,6 @@ class FlashWindow(QMainWindow):
                 font-size: 10px;
             }
         """)
-        self.console.setReadOnly(True)
         self.console.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         self.console.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
 
@@ -660,10 +1237,10 @@ class FlashWindow(QMainWindow):
         
         self.console.append("Starting firmware download...")
         
-        cache_dir = "fimware"
-        self.download_thread = DownloadThread("CatDevCode", "CatOs", cache_dir)
+        self.download_thread = DownloadThread("CatDevCode", "CatOs", CACHE_DIR, mirror_url())
         self.download_thread.progress_updated.connect(self.update_progress)
         self.download_thread.download_finished.connect(self.download_complete)
+        self.download_thread.job_finished.connect(self.job_complete)
         self.download_thread.start()
     
     def update_progress(self, value):
@@ -692,42 +1269,42 @@ class FlashWindow(QMainWindow):
     
     def flash_firmware(self):
         # чекаем наличие файлов
-        flash_files = [
-            {"path": "flash/bootloader.bin", "offset": "0x1000"},
-            {"path": "flash/partitions.bin", "offset": "0x8000"},
-            {"path": "flash/boot_app0.bin", "offset": "0xE000"},
-            {"path": "fimware/firmware.bin", "offset": "0x10000"}
-        ]
+        flash_files = FLASH_FILES
 
-        missing_files = []
-        for file_info in flash_files:
-            if not os.path.exists(file_info["path"]):
-                missing_files.append(file_info["path"])
-        
-        if missing_files:
-            error_msg = f"Missing files for the firmware:\n" + "\n".join(missing_files)
+        missing_files_list = missing_files(flash_files)
+        if missing_files_list:
+            error_msg = f"Missing files for the firmware:\n" + "\n".join(missing_files_list)
             self.console.append(error_msg)
             msg_box = CustomMessageBox(self, "Error", error_msg, "error")
             msg_box.exec_()
             return
         
-        self.flash_button.setEnabled(False)
+        self.set_device_buttons_enabled(False)
         
         self.flash_progress_bar.setValue(0)
         
         self.console.append("Starting ESP32 flash process...")
         
-        self.flash_thread = FlashThread(self.selected_port, flash_files)
+        self.flash_thread = FlashThread(self.device_session(), flash_files, self.incremental_checkbox.isChecked(),
+                                        self.boot_check_checkbox.isChecked())
         self.flash_thread.progress_updated.connect(self.update_flash_progress)
+        self.flash_thread.transfer_updated.connect(self.update_flash_transfer)
         self.flash_thread.flash_finished.connect(self.flash_complete)
-        self.flash_thread.console_message.connect(self.console.append)
+        self.flash_thread.job_finished.connect(self.job_complete)
+        # DirectConnection: строка сразу ложится в буфер из потока прошивки, без события на каждую
+        self.flash_thread.console_message.connect(self.console.append, Qt.DirectConnection)
         self.flash_thread.start()
     
     def update_flash_progress(self, value):
+        self.flash_progress_bar.setFormat("%p%")
         self.flash_progress_bar.setValue(value)
     
+    def update_flash_transfer(self, state):
+        self.flash_progress_bar.setValue(state["percent"])
+        self.flash_progress_bar.setFormat(format_progress(state))
+    
     def flash_complete(self, success, message):
-        self.flash_button.setEnabled(True)
+        self.set_device_buttons_enabled(True)
         
         if success:
             self.console.append("Flash process completed successfully!")
@@ -743,34 +1320,47 @@ class FlashWindow(QMainWindow):
         msg_box.exec_()
     
     def erase_esp32(self):
-        confirm_msg = CustomMessageBox(
-            self, 
-            "Warning!", 
-            "This operation will completely clear the ESP32 flash memory.\n"
-            "All data will be permanently deleted.\n\n"
-            "Are you sure you want to continue?",
-            "warning",
-            "yesno"
-        )
+        partition_name = self.erase_target_combo.currentData()
+        if partition_name:
+            warning = (f"This operation will clear the \"{partition_name}\" partition.\n"
+                       "Its data will be permanently deleted.\n\n"
+                       "Are you sure you want to continue?")
+        else:
+            warning = ("This operation will completely clear the ESP32 flash memory.\n"
+                       "All data will be permanently deleted.\n\n"
+                       "Are you sure you want to continue?")
+        if self.backup_checkbox.isChecked():
+            warning = warning.replace("permanently deleted", "backed up and then deleted")
+        confirm_msg = CustomMessageBox(self, "Warning!", warning, "warning", "yesno")
         
         result = confirm_msg.exec_()
         if result != QDialog.Accepted:
             self.console.append("Cleaning canceled by the user")
             return
         
-        self.erase_button.setEnabled(False)
+        self.set_device_buttons_enabled(False)
         self.flash_progress_bar.setValue(0)
         
         self.console.append("Starting ESP32 flash memory erase...")
         
-        self.erase_thread = EraseThread(self.selected_port)
+        backup = self.backup_checkbox.isChecked()
+        if partition_name:
+            self.erase_thread = EraseThread(self.device_session(), [partition_name], self.partitions, backup)
+        else:
+            self.erase_thread = EraseThread(self.device_session(), backup=backup)
         self.erase_thread.progress_updated.connect(self.update_flash_progress)
         self.erase_thread.erase_finished.connect(self.erase_complete)
-        self.erase_thread.console_message.connect(self.console.append)
+        self.erase_thread.job_finished.connect(self.job_complete)
+        self.erase_thread.console_message.connect(self.console.append, Qt.DirectConnection)
         self.erase_thread.start()
     
+    def job_complete(self, record):
+        # куда ушло время: видно и в консоли, и в fimware/logs/traces.jsonl
+        if record:
+            self.console.append(format_phases(record))
+    
     def erase_complete(self, success, message):
-        self.erase_button.setEnabled(True)
+        self.set_device_buttons_enabled(True)
         
         if success:
             self.console.append("Flash memory erase completed successfully!")
@@ -785,7 +1375,403 @@ class FlashWindow(QMainWindow):
         
         msg_box.exec_()
 
+class StationWindow(QMainWindow):
+    auto_flash_requested = pyqtSignal(str)
+    
+    def __init__(self, custom_font, ports):
+        super().__init__()
+        self.custom_font = custom_font
+        self.ports = ports
+        self.port_rows = {}
+        self.port_logs = {}
+        self.station_log = LogBuffer(prefix="station")
+        self.unplugged = set()
+        self.station_thread = None
+        self.initUI()
+        
+        # плата воткнута -> через секунду (если ее не выдернули) встает в очередь станции
+        self.auto_flash_policy = AutoFlashPolicy(self.auto_flash_requested.emit)
+        self.auto_flash_policy.enabled = False
+        self.auto_flash_requested.connect(self.auto_flash_port)
+        
+        self.hotplug_thread = HotplugThread()
+        self.hotplug_thread.port_attached.connect(self.port_attached)
+        self.hotplug_thread.port_detached.connect(self.port_detached)
+        self.hotplug_thread.start()
+    
+    def initUI(self):
+        self.setWindowTitle("CatOs flasher - station")
+        self.setFixedSize(600, 600)
+        
+        central_widget = QWidget()
+        central_widget.setStyleSheet("background-color: black;")
+        self.setCentralWidget(central_widget)
+        
+        layout = QVBoxLayout(central_widget)
+        layout.setContentsMargins(15, 15, 15, 15)
+        layout.setSpacing(10)
+        
+        title_font = QFont(self.custom_font)
+        title_font.setPointSize(18)
+        
+        title_label = QLabel("CatOs station")
+        title_label.setFont(title_font)
+        title_label.setStyleSheet("color: white;")
+        
+        self.port_table = QTableWidget(0, 3)
+        self.port_table.setFont(self.custom_font)
+        self.port_table.setHorizontalHeaderLabels(["Port", "Progress", "Result"])
+        self.port_table.verticalHeader().setVisible(False)
+        self.port_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.port_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.port_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.port_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.port_table.setStyleSheet("""
+            QTableWidget {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                gridline-color: #555;
+            }
+            QHeaderView::section {
+                background-color: black;
+                color: white;
+                border: 1px solid white;
+            }
+            QTableWidget::item:selected {
+                background-color: #333;
+            }
+        """)
+        
+        for port in self.ports:
+            self.add_port_row(port)
+        
+        self.port_table.itemSelectionChanged.connect(self.show_selected_log)
+        
+        controls_layout = QHBoxLayout()
+        
+        parallel_label = QLabel("Parallel:")
+        parallel_label.setFont(self.custom_font)
+        parallel_label.setStyleSheet("color: white;")
+        
+        self.parallel_spin = QSpinBox()
+        self.parallel_spin.setFont(self.custom_font)
+        self.parallel_spin.setRange(1, 16)
+        self.parallel_spin.setValue(min(4, max(1, len(self.ports))))
+        self.parallel_spin.setStyleSheet("""
+            QSpinBox {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                padding: 3px;
+            }
+        """)
+        
+        self.start_button = QPushButton("Flash selected")
+        self.start_button.setFont(self.custom_font)
+        self.start_button.setFixedSize(180, 35)
+        self.start_button.setStyleSheet("""
+            QPushButton {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #333;
+            }
+            QPushButton:pressed {
+                background-color: #555;
+            }
+        """)
+        self.start_button.clicked.connect(lambda: self.start_station())
+        
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setFont(self.custom_font)
+        self.stop_button.setFixedSize(100, 35)
+        self.stop_button.setStyleSheet("""
+            QPushButton {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #333;
+            }
+            QPushButton:pressed {
+                background-color: #555;
+            }
+        """)
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.stop_station)
+        
+        self.incremental_checkbox = QCheckBox("Only changed sectors")
+        self.incremental_checkbox.setFont(self.custom_font)
+        self.incremental_checkbox.setStyleSheet("color: white;")
+        
+        self.auto_baud_checkbox = QCheckBox("Auto baud")
+        self.auto_baud_checkbox.setFont(self.custom_font)
+        self.auto_baud_checkbox.setStyleSheet("color: white;")
+        
+        self.boot_check_checkbox = QCheckBox("Check boot")
+        self.boot_check_checkbox.setFont(self.custom_font)
+        self.boot_check_checkbox.setStyleSheet("color: white;")
+        
+        self.auto_flash_checkbox = QCheckBox("Auto-flash on attach")
+        self.auto_flash_checkbox.setFont(self.custom_font)
+        self.auto_flash_checkbox.setStyleSheet("color: white;")
+        self.auto_flash_checkbox.toggled.connect(self.toggle_auto_flash)
+        
+        options_layout = QHBoxLayout()
+        options_layout.addWidget(self.incremental_checkbox)
+        options_layout.addWidget(self.auto_baud_checkbox)
+        options_layout.addStretch()
+        
+        station_options_layout = QHBoxLayout()
+        station_options_layout.addWidget(self.boot_check_checkbox)
+        station_options_layout.addWidget(self.auto_flash_checkbox)
+        station_options_layout.addStretch()
+        
+        controls_layout.addWidget(parallel_label)
+        controls_layout.addWidget(self.parallel_spin)
+        controls_layout.addStretch()
+        controls_layout.addWidget(self.stop_button)
+        controls_layout.addWidget(self.start_button)
+        
+        self.console_filter = QLineEdit()
+        self.console_filter.setPlaceholderText("Filter log...")
+        self.console_filter.setStyleSheet("""
+            QLineEdit {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-family: "Courier New";
+                font-size: 10px;
+            }
+        """)
+        
+        self.console = ConsoleView(buffer=self.station_log)
+        self.console.setFixedHeight(160)
+        self.console_filter.textChanged.connect(self.console.set_filter)
+        self.console.setStyleSheet("""
+            QPlainTextEdit {
+                background-color: black;
+                color: white;
+                border: 2px solid white;
+                font-family: "Courier New";
+                font-size: 10px;
+            }
+        """)
+        
+        layout.addWidget(title_label)
+        layout.addWidget(self.port_table, 1)
+        layout.addLayout(options_layout)
+        layout.addLayout(station_options_layout)
+        layout.addLayout(controls_layout)
+        layout.addWidget(self.console_filter)
+        layout.addWidget(self.console)
+        
+        if not self.ports:
+            self.station_log.append("No ports found")
+            self.start_button.setEnabled(False)
+    
+    def add_port_row(self, port):
+        row = self.port_table.rowCount()
+        self.port_table.insertRow(row)
+        port_item = QTableWidgetItem(port)
+        port_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+        port_item.setCheckState(Qt.Checked)
+        self.port_table.setItem(row, 0, port_item)
+        
+        progress_bar = QProgressBar()
+        progress_bar.setMinimum(0)
+        progress_bar.setMaximum(100)
+        progress_bar.setValue(0)
+        progress_bar.setStyleSheet("""
+            QProgressBar {
+                border: 1px solid white;
+                background-color: black;
+                text-align: center;
+                color: #888;
+            }
+            QProgressBar::chunk {
+                background-color: white;
+            }
+        """)
+        self.port_table.setCellWidget(row, 1, progress_bar)
+        self.port_table.setItem(row, 2, QTableWidgetItem("-"))
+        
+        self.port_rows[port] = row
+        self.port_logs[port] = LogBuffer(prefix=port)
+    
+    def selected_ports(self):
+        ports = []
+        for port, row in self.port_rows.items():
+            if port in self.unplugged:
+                continue
+            if self.port_table.item(row, 0).checkState() == Qt.Checked:
+                ports.append(port)
+        return ports
+    
+    def port_attached(self, info):
+        port = info["device"]
+        self.auto_flash_policy.on_attach(info)
+        if port not in self.port_rows:
+            self.add_port_row(port)
+            self.station_log.append(f"[{port}] attached")
+        elif port in self.unplugged:
+            self.unplugged.discard(port)
+            self.set_result(port, "-", "white")
+            self.station_log.append(f"[{port}] attached again")
+        self.start_button.setEnabled(self.station_thread is None)
+    
+    def port_detached(self, info):
+        port = info["device"]
+        self.auto_flash_policy.on_detach(info)
+        if port in self.port_rows and port not in self.unplugged:
+            self.unplugged.add(port)
+            self.set_result(port, "Unplugged", "#888")
+            self.station_log.append(f"[{port}] detached")
+    
+    def toggle_auto_flash(self, enabled):
+        self.auto_flash_policy.enabled = enabled
+        if enabled:
+            self.station_log.append("Auto-flash: new boards are flashed as soon as they are plugged in")
+        else:
+            self.auto_flash_policy.cancel_all()
+            if self.station_thread is not None:
+                # дошиваем то, что уже в очереди, и выходим
+                self.station_thread.finish()
+    
+    def auto_flash_port(self, port):
+        if port not in self.port_rows or port in self.unplugged:
+            return
+        if self.station_thread is None:
+            if not self.start_station([], continuous=True):
+                return
+        self.prepare_port(port)
+        self.station_thread.add_port(port)
+    
+    def prepare_port(self, port):
+        row = self.port_rows[port]
+        self.port_table.cellWidget(row, 1).setValue(0)
+        self.port_table.cellWidget(row, 1).setFormat("%p%")
+        self.set_result(port, "Queued", "white")
+        self.port_logs[port].clear()
+        if self.console.buffer is self.port_logs[port]:
+            self.console.redraw()
+    
+    def closeEvent(self, event):
+        self.auto_flash_policy.enabled = False
+        self.auto_flash_policy.cancel_all()
+        self.hotplug_thread.stop()
+        if self.station_thread is not None:
+            self.station_thread.stop()
+            self.station_thread.wait(3000)
+        super().closeEvent(event)
+    
+    def start_station(self, ports=None, continuous=False):
+        missing_files_list = missing_files(FLASH_FILES)
+        if missing_files_list:
+            error_msg = f"Missing files for the firmware:\n" + "\n".join(missing_files_list)
+            self.station_log.append(error_msg)
+            if continuous:
+                self.auto_flash_checkbox.setChecked(False)
+            else:
+                msg_box = CustomMessageBox(self, "Error", error_msg, "error")
+                msg_box.exec_()
+            return False
+        
+        if ports is None:
+            ports = self.selected_ports()
+            if not ports:
+                self.station_log.append("No ports selected")
+                return False
+        
+        for port in ports:
+            self.prepare_port(port)
+        
+        self.start_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.parallel_spin.setEnabled(False)
+        self.incremental_checkbox.setEnabled(False)
+        self.auto_baud_checkbox.setEnabled(False)
+        self.boot_check_checkbox.setEnabled(False)
+        if continuous:
+            self.station_log.append(f"Waiting for boards, {self.parallel_spin.value()} at once...")
+        else:
+            self.station_log.append(f"Flashing {len(ports)} ports, {self.parallel_spin.value()} at once...")
+        
+        baud = "auto" if self.auto_baud_checkbox.isChecked() else DEFAULT_BAUD
+        self.station_thread = StationThread(ports, FLASH_FILES, self.parallel_spin.value(),
+                                            self.incremental_checkbox.isChecked(), baud, continuous,
+                                            self.boot_check_checkbox.isChecked())
+        self.station_thread.port_started.connect(self.port_started)
+        self.station_thread.port_message.connect(self.port_message)
+        self.station_thread.port_progress.connect(self.port_progress)
+        self.station_thread.port_finished.connect(self.port_finished)
+        self.station_thread.station_finished.connect(self.station_complete)
+        self.station_thread.start()
+        return True
+    
+    def stop_station(self):
+        if self.station_thread is not None:
+            self.station_log.append("Stopping station...")
+            self.auto_flash_checkbox.setChecked(False)
+            self.station_thread.stop()
+    
+    def set_result(self, port, text, color):
+        item = self.port_table.item(self.port_rows[port], 2)
+        item.setText(text)
+        item.setForeground(QColor(color))
+    
+    def selected_log_port(self):
+        rows = self.port_table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        return self.port_table.item(rows[0].row(), 0).text()
+    
+    def show_selected_log(self):
+        # без выбора показываем журнал станции, с выбором - журнал порта
+        port = self.selected_log_port()
+        self.console.set_buffer(self.station_log if port is None else self.port_logs[port])
+    
+    def port_started(self, port):
+        self.set_result(port, "Flashing", "#ffff00")
+    
+    def port_message(self, port, line):
+        self.port_logs[port].append(line)
+    
+    def port_progress(self, port, state):
+        progress_bar = self.port_table.cellWidget(self.port_rows[port], 1)
+        progress_bar.setValue(state["percent"])
+        progress_bar.setFormat(format_progress(state))
+    
+    def port_finished(self, port, success, message):
+        self.port_logs[port].append(message)
+        if success:
+            self.port_table.cellWidget(self.port_rows[port], 1).setValue(100)
+            self.set_result(port, "PASS", "#00ff00")
+        else:
+            self.set_result(port, "FAIL", "#ff0000")
+        self.station_log.append(f"[{port}] {message}")
+    
+    def station_complete(self):
+        self.start_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+        self.parallel_spin.setEnabled(True)
+        self.incremental_checkbox.setEnabled(True)
+        self.auto_baud_checkbox.setEnabled(True)
+        self.boot_check_checkbox.setEnabled(True)
+        
+        results = self.station_thread.station.results
+        passed = sum(1 for success, _ in results.values() if success)
+        self.station_log.append(f"Station finished: {passed}/{len(results)} passed")
+        self.station_thread = None
+
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setStyleSheet("QMainWindow { background-color: black; }")
     
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+
+from esptool.cmds import flash_size_bytes
+
+from catoshub.images import CACHE_DIR
+from catoshub.partitions import BLOCK_SIZE, blank_md5, read_partitions, sector_range, select_partitions
+from catoshub.payload import Payload
+from catoshub.progress import FlashProgress
+
+BACKUP_DIR = os.path.join(CACHE_DIR, "backups")
+# блоки всех бэкапов всех плат, по MD5 содержимого: одинаковая прошивка хранится один раз
+BLOCK_DIR = os.path.join(CACHE_DIR, "blocks")
+# столько соседних блоков читаем одной командой read_flash
+MAX_READ = 0x100000
+
+
+class BackupError(Exception):
+    pass
+
+
+class BlockStore:
+    def __init__(self, path=BLOCK_DIR):
+        self.path = path
+
+    def _file(self, md5):
+        return os.path.join(self.path, md5[:2], md5 + ".z")
+
+    def has(self, md5):
+        return os.path.exists(self._file(md5))
+
+    def get(self, md5):
+        try:
+            with open(self._file(md5), 'rb') as f:
+                data = zlib.decompress(f.read())
+        except (OSError, zlib.error):
+            return None
+        # битый файл хуже отсутствующего: при восстановлении записали бы мусор
+        return data if hashlib.md5(data).hexdigest() == md5 else None
+
+    def put(self, md5, data):
+        path = self._file(md5)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(data, 6))
+        os.replace(tmp_path, path)
+
+
+def _blocks(offset, size, block_size=BLOCK_SIZE):
+    return [(start, min(block_size, offset + size - start)) for start in range(offset, offset + size, block_size)]
+
+
+def partition_regions(session, names, partitions=None):
+    # регионы разделов для бэкапа; таблица с платы, если своей нет
+    if partitions is None:
+        with session.trace.span("read_partitions"):
+            partitions = read_partitions(session.ensure_open())
+    return [sector_range(partition) for partition in select_partitions(partitions, names)]
+
+
+def _runs(blocks):
+    # соседние блоки склеиваем в одно чтение, но не больше MAX_READ
+    runs = []
+    for start, size, md5 in blocks:
+        if runs and runs[-1][0] + runs[-1][1] == start and runs[-1][1] + size <= MAX_READ:
+            runs[-1][1] += size
+            runs[-1][2].append((start, size, md5))
+        else:
+            runs.append([start, size, [(start, size, md5)]])
+    return runs
+
+
+def backup_flash(session, regions=None, store=None, on_progress=None, backup_dir=BACKUP_DIR):
+    # MD5 каждого блока считает сам чип; читаем только то, чего нет ни в стертом виде, ни в хранилище
+    store = store or BlockStore()
+    esp = session.ensure_open()
+    if regions is None:
+        regions = [(0, flash_size_bytes(session.flash_size))]
+    manifest_regions = []
+    missing = []
+    pending = set()
+    stats = {"blocks": 0, "erased": 0, "stored": 0, "read": 0, "bytes_read": 0}
+    # сначала проход по MD5 (прогресс - по просмотренным байтам), потом чтение (по прочитанным)
+    progress = FlashProgress(sum(size for _, size in regions), on_progress)
+    for offset, size in regions:
+        hashes = []
+        progress.start_region(offset, size)
+        with session.trace.span("compare", offset=offset, size=size):
+            for start, length in _blocks(offset, size):
+                md5 = esp.flash_md5sum(start, length)
+                hashes.append(md5)
+                stats["blocks"] += 1
+                if md5 == blank_md5(length):
+                    stats["erased"] += 1
+                elif md5 in pending or store.has(md5):
+                    stats["stored"] += 1
+                else:
+                    missing.append((start, length, md5))
+                    pending.add(md5)
+                progress.add(length)
+        manifest_regions.append({"offset": offset, "size": size, "blocks": hashes})
+
+    progress = FlashProgress(sum(length for _, length, _ in missing), on_progress)
+    for start, size, blocks in _runs(missing):
+        session.log(f"Reading {size} bytes at 0x{start:x}...")
+        progress.start_region(start, size)
+        done = [0]
+
+        def on_read(received, length):
+            progress.add(received - done[0])
+            done[0] = received
+
+        with session.trace.span("read", offset=start, bytes=size):
+            data = esp.read_flash(start, size, on_read)
+        for block_start, length, md5 in blocks:
+            block = data[block_start - start:block_start - start + length]
+            if hashlib.md5(block).hexdigest() != md5:
+                raise BackupError(f"Block at 0x{block_start:x} changed while reading it")
+            store.put(md5, block)
+            stats["read"] += 1
+            stats["bytes_read"] += length
+
+    fingerprint = session.fingerprint or {}
+    manifest = {
+        "mac": fingerprint.get("mac"),
+        "description": fingerprint.get("description"),
+        "flash_size": session.flash_size,
+        "block_size": BLOCK_SIZE,
+        "created": round(time.time()),
+        "regions": manifest_regions,
+        "stats": stats,
+    }
+    os.makedirs(backup_dir, exist_ok=True)
+    name = re.sub(r"[^\w.-]", "-", manifest["mac"] or session.port) + time.strftime("-%Y%m%d-%H%M%S")
+    path = os.path.join(backup_dir, name + ".json")
+    copy = 1
+    while os.path.exists(path):
+        copy += 1
+        path = os.path.join(backup_dir, f"{name}-{copy}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    session.log(f"{stats['blocks']} blocks: {stats['erased']} erased, {stats['stored']} already stored, "
+                f"{stats['read']} read")
+    return path, manifest
+
+
+def load_backup(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise BackupError(f"Can't read backup {path}: {str(e).strip()}")
+    if not isinstance(manifest, dict) or not manifest.get("regions"):
+        raise BackupError(f"{path} is not a flash backup")
+    return manifest
+
+
+def restore_flash(session, manifest, store=None, on_progress=None):
+    # пишем только блоки, которые на плате отличаются; стертые в бэкапе - стираем
+    store = store or BlockStore()
+    esp = session.ensure_open()
+    block_size = manifest.get("block_size", BLOCK_SIZE)
+    end = max(region["offset"] + region["size"] for region in manifest["regions"])
+    if end > flash_size_bytes(session.flash_size):
+        raise BackupError(f"Backup needs {end} bytes of flash, the board has {session.flash_size}")
+    mac = (session.fingerprint or {}).get("mac")
+    if manifest.get("mac") and mac and manifest["mac"] != mac:
+        # можно (клон платы), но nvs с калибровками и ключами уедет на чужую плату
+        session.log(f"Warning: the backup was made on {manifest['mac']}, this board is {mac}")
+
+    erase = []
+    writes = []
+    with session.trace.span("compare"):
+        for region in manifest["regions"]:
+            for (start, length), md5 in zip(_blocks(region["offset"], region["size"], block_size),
+                                            region["blocks"]):
+                if esp.flash_md5sum(start, length) == md5:
+                    continue
+                if md5 == blank_md5(length):
+                    erase.append((start, length))
+                else:
+                    writes.append((start, length, md5))
+    # все блоки должны найтись до первой записи, иначе плата останется наполовину восстановленной
+    blocks = {}
+    for start, length, md5 in writes:
+        data = store.get(md5)
+        if data is None:
+            raise BackupError(f"Block {md5} for 0x{start:x} is missing from {store.path}")
+        blocks[start] = data
+
+    for start, length in erase:
+        session.erase_region(start, length)
+    payloads = [Payload.from_data(start, b"".join(blocks[block_start] for block_start, _, _ in run))
+                for start, _, run in _runs(writes)]
+    if payloads:
+        session.write(payloads, on_progress)
+    return {"erased": sum(length for _, length in erase), "written": sum(length for _, length, _ in writes)}
@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+import serial.tools.list_ports
+
+from catoshub.images import CACHE_DIR
+from catoshub.jsonstore import JsonStore
+
+DEFAULT_BAUD = 460800
+BAUD_CANDIDATES = [460800, 921600, 1500000, 2000000]
+# ступени для повторов после сбоя, от скорости ROM вверх
+RETRY_BAUDS = [115200, 230400] + BAUD_CANDIDATES
+BAUD_STORE_PATH = os.path.join(CACHE_DIR, "baud_rates.json")
+CHECK_SIZE = 0x1000
+
+
+class LinkCheckError(Exception):
+    pass
+
+
+def lower_baud(baud):
+    # на ступень ниже текущей, но не ниже скорости ROM
+    slower = [rate for rate in RETRY_BAUDS if rate < baud]
+    return slower[-1] if slower else RETRY_BAUDS[0]
+
+
+def adapter_key(port):
+    for info in serial.tools.list_ports.comports():
+        if info.device == port:
+            if info.vid is None:
+                return None
+            return f"{info.vid:04X}:{info.pid:04X}:{info.serial_number or ''}"
+    return None
+
+
+class BaudStore(JsonStore):
+    def __init__(self, path=BAUD_STORE_PATH):
+        super().__init__(path)
+
+    def get(self, key):
+        if key is None:
+            return None
+        return self.load().get(key)
+
+    def set(self, key, baud):
+        if key is not None:
+            self._update(key, baud)
+
+    def forget(self, key):
+        if key is not None:
+            self._update(key, None)
+
+
+def remembered_baud(port, default=DEFAULT_BAUD):
+    return BaudStore().get(adapter_key(port)) or default
+
+
+def check_link(esp, reference_md5):
+    # короткий обмен в обе стороны: регистр, блок флеша и его MD5 с чипа
+    esp.read_reg(esp.CHIP_DETECT_MAGIC_REG_ADDR)
+    data = esp.read_flash(0, CHECK_SIZE)
+    if hashlib.md5(data).hexdigest() != reference_md5:
+        raise LinkCheckError("Checksum mismatch on flash read-back")
+    if esp.flash_md5sum(0, CHECK_SIZE) != reference_md5:
+        raise LinkCheckError("Checksum mismatch on flash MD5")
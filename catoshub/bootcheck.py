@@ -0,0 +1,93 @@
+import re
+import time
+
+import serial
+
+from catoshub.images import FLASH_FILES
+from catoshub.probe import APP_DESC, APP_DESC_OFFSET, APP_OFFSET, parse_app_desc
+
+BOOT_BAUD = 115200
+BOOT_TIMEOUT = 10.0
+# строка, которую CatOs печатает при старте, например "CatOs v1.4.2"
+BANNER = re.compile(r"CatOs\W{0,3}v?(\d+(?:\.\d+)*[\w.+-]*)", re.IGNORECASE)
+# признаки того, что образ не стартовал
+FAILURES = ("Guru Meditation", "Backtrace:", "abort() was called", "invalid header", "ets_main.c")
+# spi_flash из ESP-IDF: размер в заголовке бутлоадера не совпал с настоящим флешем
+FLASH_SIZE_MISMATCH = re.compile(r"spi_flash: Detected size\((\d+)k\) (?:larger|smaller) than the size in the "
+                                 r"binary image header\((\d+)k\)")
+
+
+class BootCheckError(Exception):
+    pass
+
+
+class FlashSizeMismatch(BootCheckError):
+    pass
+
+
+def expected_version(flash_files=FLASH_FILES):
+    # версия из esp_app_desc_t образа приложения; None, если ее не прочитать
+    for file_info in flash_files:
+        if int(file_info["offset"], 0) == APP_OFFSET:
+            try:
+                with open(file_info["path"], 'rb') as f:
+                    app = parse_app_desc(f.read(APP_DESC_OFFSET + APP_DESC.size))
+            except OSError:
+                return None
+            return app["version"] if app else None
+    return None
+
+
+def _same_version(found, expected):
+    return found.lstrip("vV") == expected.lstrip("vV")
+
+
+def check_boot(port, expected=None, timeout=BOOT_TIMEOUT, log=print, baud=BOOT_BAUD):
+    # сами дергаем EN через RTS уже с открытым портом, чтобы не пропустить первые строки
+    ser = serial.Serial()
+    ser.port = port
+    ser.baudrate = baud
+    ser.timeout = 0.1
+    ser.dtr = False
+    ser.rts = False
+    ser.open()
+    try:
+        ser.reset_input_buffer()
+        try:
+            ser.rts = True
+            time.sleep(0.1)
+            ser.rts = False
+        except OSError:
+            # у адаптера нет линии RTS: ждем, пока плату сбросят руками
+            log("Can't reset the board via RTS, press EN/RST to continue")
+
+        deadline = time.monotonic() + timeout
+        buffer = b""
+        resets = 0
+        while time.monotonic() < deadline:
+            buffer += ser.read(ser.in_waiting or 1)
+            *lines, buffer = buffer.split(b"\n")
+            for raw in lines:
+                line = raw.decode(errors="replace").strip()
+                if not line:
+                    continue
+                log(line)
+                if line.startswith("rst:"):
+                    resets += 1
+                    if resets > 1:
+                        raise BootCheckError("Boot loop: the board keeps resetting")
+                if any(marker in line for marker in FAILURES):
+                    raise BootCheckError(f"Boot failed: {line}")
+                mismatch = FLASH_SIZE_MISMATCH.search(line)
+                if mismatch:
+                    raise FlashSizeMismatch(f"Flash is {mismatch.group(1)}k, the image header says "
+                                            f"{mismatch.group(2)}k")
+                match = BANNER.search(line)
+                if match:
+                    found = match.group(1)
+                    if expected and not _same_version(found, expected):
+                        raise BootCheckError(f"Booted CatOs {found}, expected {expected}")
+                    return found
+        raise BootCheckError(f"No CatOs banner within {timeout:g} s")
+    finally:
+        ser.close()
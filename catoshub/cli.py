@@ -0,0 +1,614 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from catoshub.images import CACHE_DIR
+from catoshub.trace import TRACE_PATH
+
+# тяжелые модули (esptool, requests, serial) импортируем только внутри команд,
+# чтобы headless-станция стартовала без лишнего
+
+
+# stdout под JSON, запомненный в main до любых redirect_stdout: _quiet_stdout глушит esptool на весь процесс,
+# а события станции и hotplug печатаются из других потоков как раз в это время
+_json_out = None
+# в watch пишут и поток hotplug, и поток событий станции: строки не должны перемешиваться
+_json_lock = threading.Lock()
+
+
+def _print_json(data):
+    out = _json_out or sys.stdout
+    with _json_lock:
+        out.write(json.dumps(data) + "\n")
+        out.flush()
+
+
+def _log(args):
+    if args.verbose:
+        return lambda line: print(line, file=sys.stderr)
+    return lambda line: None
+
+
+@contextlib.contextmanager
+def _quiet_stdout(args):
+    # esptool печатает в stdout, а stdout занят под JSON
+    target = sys.stderr if args.verbose else open(os.devnull, 'w')
+    try:
+        with contextlib.redirect_stdout(target):
+            yield
+    finally:
+        if target is not sys.stderr:
+            target.close()
+
+
+def _baud(value):
+    if value == "auto":
+        return value
+    return int(value)
+
+
+def cmd_list_ports(args):
+    import serial.tools.list_ports
+
+    ports = []
+    for info in serial.tools.list_ports.comports():
+        ports.append({
+            "device": info.device,
+            "description": info.description,
+            "vid": info.vid,
+            "pid": info.pid,
+            "serial_number": info.serial_number,
+        })
+    if args.probe:
+        from catoshub.probe import probe_ports
+
+        by_device = {port["device"]: port for port in ports}
+
+        def on_result(device, result):
+            by_device[device]["probe"] = result
+
+        with _quiet_stdout(args):
+            probe_ports(ports, on_result, timeout=args.timeout)
+    _print_json({"ports": ports})
+    return 0
+
+
+def cmd_download(args):
+    from catoshub.config import mirror_url
+    from catoshub.jobs import Job, JobCancelled, run_job
+    from catoshub.release import REPO_NAME, REPO_OWNER, update_firmware
+    from catoshub.trace import JobTrace
+
+    started = time.monotonic()
+    trace = JobTrace("download")
+
+    def download(job):
+        return update_firmware(REPO_OWNER, REPO_NAME, args.cache_dir, lambda percent: job.check(),
+                               mirror=mirror_url(args.mirror), trace=trace)
+
+    try:
+        tag, status = run_job(Job("download", download, timeout=args.timeout))
+    except (Exception, JobCancelled) as e:
+        trace.finish(False, str(e).strip())
+        _print_json({"ok": False, "message": str(e).strip(), "phases": trace.phases()})
+        return 1
+    trace.finish(True, status)
+    _print_json({"ok": True, "tag": tag, "status": status, "seconds": round(time.monotonic() - started, 3),
+                 "phases": trace.phases()})
+    return 0
+
+
+def cmd_serve_mirror(args):
+    from catoshub.mirror import MirrorServer
+    from catoshub.release import REPO_NAME, REPO_OWNER, update_firmware
+
+    log = (lambda line: print(line, file=sys.stderr)) if args.verbose else None
+    try:
+        server = MirrorServer(args.cache_dir, args.host, args.port, log)
+    except OSError as e:
+        _print_json({"ok": False, "message": str(e).strip()})
+        return 1
+    stop = threading.Event()
+
+    def refresh():
+        # зеркало само следит за GitHub; условные запросы не тратят лимит
+        while not stop.is_set():
+            try:
+                tag, status = update_firmware(REPO_OWNER, REPO_NAME, args.cache_dir)
+                _print_json({"event": "release", "tag": tag, "status": status})
+            except Exception as e:
+                _print_json({"event": "release", "ok": False, "message": str(e).strip()})
+            stop.wait(args.refresh)
+
+    if args.refresh > 0:
+        threading.Thread(target=refresh, daemon=True).start()
+    _print_json({"event": "serving", "host": args.host, "port": server.server_address[1]})
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    return 0
+
+
+def cmd_metrics(args):
+    from catoshub.metrics import TraceMetrics
+
+    metrics = TraceMetrics(args.trace_file, args.window)
+    metrics.update()
+    _print_json(metrics.summary())
+    return 0
+
+
+def cmd_serve_metrics(args):
+    from catoshub.metrics import MetricsServer
+
+    try:
+        server = MetricsServer(args.trace_file, args.host, args.port, args.window)
+    except OSError as e:
+        _print_json({"ok": False, "message": str(e).strip()})
+        return 1
+    _print_json({"event": "serving", "host": args.host, "port": server.server_address[1]})
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+def cmd_fingerprints(args):
+    from catoshub.fingerprint import FingerprintStore
+
+    store = FingerprintStore()
+    if args.clear:
+        store.clear()
+        _print_json({"ok": True, "cleared": True})
+        return 0
+    if args.forget:
+        # одна плата могла побывать на нескольких переходниках
+        forgotten = [fingerprint for fingerprint in store.load().values()
+                     if fingerprint.get("mac") == args.forget.lower()]
+        for fingerprint in forgotten:
+            store.forget(fingerprint["mac"], fingerprint["serial"])
+        _print_json({"ok": bool(forgotten), "forgotten": len(forgotten)})
+        return 0 if forgotten else 1
+    _print_json({"fingerprints": list(store.load().values())})
+    return 0
+
+
+def cmd_delta(args):
+    from catoshub.delta import make_delta
+
+    try:
+        with open(args.old, 'rb') as f:
+            old = f.read()
+        with open(args.new, 'rb') as f:
+            new = f.read()
+        patch = make_delta(old, new)
+        with open(args.out, 'wb') as f:
+            f.write(patch)
+    except OSError as e:
+        _print_json({"ok": False, "message": str(e).strip()})
+        return 1
+    _print_json({"ok": True, "out": args.out, "size": len(patch), "firmware_size": len(new),
+                 "sha256": hashlib.sha256(new).hexdigest()})
+    return 0
+
+
+def cmd_build(args):
+    from catoshub.images import FLASH_FILES, missing_files
+    from catoshub.imageset import ImageSet
+    from catoshub.merge import merged_image
+    from catoshub.release import ReleaseCache
+
+    missing = missing_files(FLASH_FILES)
+    if missing:
+        _print_json({"ok": False, "message": "Missing files: " + ", ".join(missing)})
+        return 1
+
+    with _quiet_stdout(args):
+        image_set = ImageSet.from_files(FLASH_FILES, merge=False)
+        merged = merged_image(image_set.files, ReleaseCache(CACHE_DIR).current_tag())
+    if args.out:
+        # один артефакт на станцию: образ + манифест с отрезками и хешами
+        os.makedirs(args.out, exist_ok=True)
+        with open(os.path.join(args.out, "merged.bin"), 'wb') as f:
+            f.write(merged.data)
+        with open(os.path.join(args.out, "manifest.json"), 'w') as f:
+            json.dump(merged.manifest, f, indent=2)
+    _print_json({"ok": True, "manifest": merged.manifest})
+    return 0
+
+
+def cmd_flash(args):
+    from catoshub.bootcheck import expected_version
+    from catoshub.device import DeviceSession
+    from catoshub.diff import write_incremental
+    from catoshub.images import FLASH_FILES, missing_files
+    from catoshub.imageset import board_images, board_payloads
+    from catoshub.jobs import Job, JobCancelled, run_job
+    from catoshub.journal import write_resumable
+    from catoshub.trace import JobTrace
+
+    missing = missing_files(FLASH_FILES)
+    if missing:
+        _print_json({"ok": False, "port": args.port, "message": "Missing files: " + ", ".join(missing)})
+        return 1
+
+    started = time.monotonic()
+    trace = JobTrace("flash", args.port)
+    session = DeviceSession(args.port, args.baud, _log(args), trace)
+
+    def flash(job):
+        def on_progress(state):
+            # отмена и таймаут проверяются между блоками записи
+            job.check()
+
+        booted = None
+        with _quiet_stdout(args):
+            if args.erase:
+                session.erase_flash()
+            # образы собираются под флеш платы, когда станет известен ее отпечаток
+            if args.incremental:
+                written, total = write_incremental(session, board_images(FLASH_FILES), on_progress)
+            else:
+                written = total = write_resumable(session, board_payloads(FLASH_FILES), on_progress)
+            job.check()
+            if args.boot_check:
+                booted = session.boot_check(expected_version(FLASH_FILES), args.boot_timeout)
+            else:
+                session.hard_reset()
+        return written, total, booted
+
+    try:
+        written, total, booted = run_job(Job("flash", flash, args.port, timeout=args.timeout))
+    except (Exception, JobCancelled) as e:
+        session.close()
+        # у StopIteration и части ошибок esptool str() пустой
+        message = str(e).strip() or repr(e)
+        trace.finish(False, message)
+        _print_json({"ok": False, "port": args.port, "message": message, "phases": trace.phases()})
+        return 1
+    trace.finish(True)
+    result = {
+        "ok": True,
+        "port": args.port,
+        "written": written,
+        "total": total,
+        "seconds": round(time.monotonic() - started, 3),
+        "phases": trace.phases(),
+    }
+    if booted is not None:
+        result["booted"] = booted
+    _print_json(result)
+    return 0
+
+
+def cmd_erase(args):
+    from catoshub.device import DeviceSession
+    from catoshub.jobs import Job, JobCancelled, run_job
+    from catoshub.partitions import load_partitions, select_partitions
+    from catoshub.trace import JobTrace
+
+    started = time.monotonic()
+    trace = JobTrace("erase", args.port)
+    session = DeviceSession(args.port, args.baud, _log(args), trace)
+
+    def erase(job):
+        erased = None
+        with _quiet_stdout(args):
+            if args.partitions:
+                erased = session.erase_partitions(args.partitions, partitions)
+            else:
+                session.erase_flash()
+            job.check()
+            session.hard_reset()
+        return erased
+
+    try:
+        # таблицу берем из flash/partitions.bin, с --from-device - с самой платы
+        partitions = None if args.from_device or not args.partitions else load_partitions()
+        if partitions is not None:
+            select_partitions(partitions, args.partitions)
+        erased = run_job(Job("erase", erase, args.port, timeout=args.timeout))
+    except (Exception, JobCancelled) as e:
+        session.close()
+        trace.finish(False, str(e).strip())
+        _print_json({"ok": False, "port": args.port, "message": str(e).strip(), "phases": trace.phases()})
+        return 1
+    trace.finish(True)
+    result = {"ok": True, "port": args.port, "seconds": round(time.monotonic() - started, 3),
+              "phases": trace.phases()}
+    if erased is not None:
+        result["erased"] = erased
+    _print_json(result)
+    return 0
+
+
+def cmd_backup(args):
+    from catoshub.backup import backup_flash, partition_regions
+    from catoshub.device import DeviceSession
+    from catoshub.jobs import Job, JobCancelled, run_job
+    from catoshub.partitions import load_partitions
+    from catoshub.trace import JobTrace
+
+    started = time.monotonic()
+    trace = JobTrace("backup", args.port)
+    session = DeviceSession(args.port, args.baud, _log(args), trace)
+
+    def backup(job):
+        def on_progress(state):
+            job.check()
+
+        with _quiet_stdout(args):
+            regions = None
+            if args.partitions:
+                regions = partition_regions(session, args.partitions, partitions)
+            result = backup_flash(session, regions, on_progress=on_progress)
+            session.hard_reset()
+        return result
+
+    try:
+        partitions = None if args.from_device or not args.partitions else load_partitions()
+        path, manifest = run_job(Job("backup", backup, args.port, timeout=args.timeout))
+    except (Exception, JobCancelled) as e:
+        session.close()
+        trace.finish(False, str(e).strip())
+        _print_json({"ok": False, "port": args.port, "message": str(e).strip(), "phases": trace.phases()})
+        return 1
+    trace.finish(True)
+    _print_json({"ok": True, "port": args.port, "backup": path, **manifest["stats"],
+                 "seconds": round(time.monotonic() - started, 3), "phases": trace.phases()})
+    return 0
+
+
+def cmd_restore(args):
+    from catoshub.backup import load_backup, restore_flash
+    from catoshub.device import DeviceSession
+    from catoshub.jobs import Job, JobCancelled, run_job
+    from catoshub.trace import JobTrace
+
+    started = time.monotonic()
+    trace = JobTrace("restore", args.port)
+    session = DeviceSession(args.port, args.baud, _log(args), trace)
+
+    def restore(job):
+        def on_progress(state):
+            job.check()
+
+        with _quiet_stdout(args):
+            result = restore_flash(session, manifest, on_progress=on_progress)
+            job.check()
+            session.hard_reset()
+        return result
+
+    try:
+        manifest = load_backup(args.backup)
+        restored = run_job(Job("restore", restore, args.port, timeout=args.timeout))
+    except (Exception, JobCancelled) as e:
+        session.close()
+        trace.finish(False, str(e).strip())
+        _print_json({"ok": False, "port": args.port, "message": str(e).strip(), "phases": trace.phases()})
+        return 1
+    trace.finish(True)
+    _print_json({"ok": True, "port": args.port, **restored, "seconds": round(time.monotonic() - started, 3),
+                 "phases": trace.phases()})
+    return 0
+
+
+def cmd_flash_all(args):
+    from catoshub.images import FLASH_FILES
+    from catoshub.station import FlashStation
+
+    ports = args.ports
+    if not ports:
+        import serial.tools.list_ports
+
+        ports = [info.device for info in serial.tools.list_ports.comports() if info.vid is not None]
+
+    def on_event(port, kind, value):
+        if kind == "log" and args.verbose:
+            print(f"[{port}] {value}", file=sys.stderr)
+        elif kind == "done" and args.events:
+            _print_json({"event": "done", "port": port, "ok": value[0], "message": value[1]})
+        elif kind == "started" and args.events:
+            _print_json({"event": "started", "port": port})
+        elif kind == "trace" and args.events:
+            _print_json({"event": "trace", "port": port, "seconds": value["seconds"], "phases": value["phases"]})
+
+    started = time.monotonic()
+    station = FlashStation(ports, FLASH_FILES, args.parallel, args.incremental, args.baud,
+                           boot_check=args.boot_check, timeout=args.timeout)
+    # esptool печатает, пока родитель готовит образы; события идут мимо этого в _json_out
+    with _quiet_stdout(args):
+        results = station.run(on_event)
+    passed = sum(1 for ok, _ in results.values() if ok)
+    _print_json({
+        "ok": passed == len(ports),
+        "passed": passed,
+        "failed": len(ports) - passed,
+        "seconds": round(time.monotonic() - started, 3),
+        "results": {port: {"ok": ok, "message": message} for port, (ok, message) in results.items()},
+    })
+    return 0 if passed == len(ports) else 1
+
+
+def cmd_watch(args):
+    from catoshub.hotplug import AutoFlashPolicy, HotplugWatcher
+    from catoshub.images import FLASH_FILES, missing_files
+    from catoshub.station import FlashStation
+
+    station = None
+    policy = None
+    if args.auto_flash:
+        missing = missing_files(FLASH_FILES)
+        if missing:
+            _print_json({"ok": False, "message": "Missing files: " + ", ".join(missing)})
+            return 1
+
+        def on_event(port, kind, value):
+            if kind == "log" and args.verbose:
+                print(f"[{port}] {value}", file=sys.stderr)
+            elif kind == "done":
+                _print_json({"event": "done", "port": port, "ok": value[0], "message": value[1]})
+            elif kind == "started":
+                _print_json({"event": "started", "port": port})
+
+        station = FlashStation([], FLASH_FILES, args.parallel, args.incremental, args.baud, continuous=True,
+                               boot_check=args.boot_check, timeout=args.timeout)
+        policy = AutoFlashPolicy(station.add_port, args.settle)
+
+    def on_attach(info):
+        _print_json({"event": "attached", **info})
+        if policy is not None:
+            policy.on_attach(info)
+
+    def on_detach(info):
+        _print_json({"event": "detached", **info})
+        if policy is not None:
+            policy.on_detach(info)
+
+    watcher = HotplugWatcher(on_attach, on_detach)
+    watcher_thread = threading.Thread(target=watcher.run, daemon=True)
+    watcher_thread.start()
+    try:
+        if station is not None:
+            # attached/detached и события станции идут в _json_out мимо заглушенного stdout
+            with _quiet_stdout(args):
+                station.run(on_event)
+        else:
+            watcher_thread.join()
+    except KeyboardInterrupt:
+        if station is not None:
+            station.stop()
+    finally:
+        if policy is not None:
+            policy.cancel_all()
+        watcher.stop()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="catoshub", description="CatOs flasher without GUI")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log progress to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_ports = subparsers.add_parser("list-ports", help="list serial ports")
+    list_ports.add_argument("--probe", action="store_true",
+                            help="identify the chip, MAC, flash size and CatOs version on USB ports")
+    list_ports.add_argument("--timeout", type=float, default=3.0, help="probe timeout in seconds")
+    list_ports.set_defaults(func=cmd_list_ports)
+
+    download = subparsers.add_parser("download", help="download the latest CatOs firmware")
+    download.add_argument("--cache-dir", default=CACHE_DIR)
+    download.add_argument("--mirror", metavar="URL",
+                          help="try this LAN mirror before GitHub (default: \"mirror\" from catoshub.json)")
+    download.add_argument("--timeout", type=float, help="cancel the job after this many seconds")
+    download.set_defaults(func=cmd_download)
+
+    serve_mirror = subparsers.add_parser("serve-mirror", help="serve the firmware cache to other stations over HTTP")
+    serve_mirror.add_argument("--cache-dir", default=CACHE_DIR)
+    serve_mirror.add_argument("--host", default="0.0.0.0")
+    serve_mirror.add_argument("--port", type=int, default=8780)
+    serve_mirror.add_argument("--refresh", type=float, default=600.0,
+                              help="check GitHub for a new release every N seconds (0 to disable)")
+    serve_mirror.set_defaults(func=cmd_serve_mirror)
+
+    metrics = subparsers.add_parser("metrics", help="summarize phase timings, failures and throughput from traces")
+    metrics.add_argument("--trace-file", default=TRACE_PATH)
+    metrics.add_argument("--window", type=float, default=3600.0, help="seconds to count boards per hour over")
+    metrics.set_defaults(func=cmd_metrics)
+
+    serve_metrics = subparsers.add_parser("serve-metrics", help="export the traces as Prometheus metrics over HTTP")
+    serve_metrics.add_argument("--trace-file", default=TRACE_PATH)
+    serve_metrics.add_argument("--host", default="127.0.0.1")
+    serve_metrics.add_argument("--port", type=int, default=8782)
+    serve_metrics.add_argument("--window", type=float, default=3600.0, help="seconds to count boards per hour over")
+    serve_metrics.set_defaults(func=cmd_serve_metrics)
+
+    fingerprints = subparsers.add_parser("fingerprints",
+                                         help="list the remembered chip, flash and crystal of known boards")
+    fingerprints.add_argument("--forget", metavar="MAC", help="probe this board again on its next connect")
+    fingerprints.add_argument("--clear", action="store_true", help="forget all boards")
+    fingerprints.set_defaults(func=cmd_fingerprints)
+
+    delta = subparsers.add_parser("delta", help="make a patch from an old firmware.bin to a new one")
+    delta.add_argument("old")
+    delta.add_argument("new")
+    delta.add_argument("--out", required=True, help="attach it to the new release as firmware-<old tag>.delta")
+    delta.set_defaults(func=cmd_delta)
+
+    build = subparsers.add_parser("build", help="merge the flash images into one cached image with a manifest")
+    build.add_argument("--out", help="also write merged.bin and manifest.json to this directory")
+    build.set_defaults(func=cmd_build)
+
+    flash = subparsers.add_parser("flash", help="flash one board")
+    flash.add_argument("--port", required=True)
+    flash.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    flash.add_argument("--incremental", action="store_true", help="write only changed sectors")
+    flash.add_argument("--erase", action="store_true", help="erase the whole flash first")
+    flash.add_argument("--boot-check", action="store_true", help="wait for the CatOs banner after reset")
+    flash.add_argument("--boot-timeout", type=float, default=10.0, help="seconds to wait for the banner")
+    flash.add_argument("--timeout", type=float, help="cancel the job after this many seconds")
+    flash.set_defaults(func=cmd_flash)
+
+    erase = subparsers.add_parser("erase", help="erase the whole flash or some partitions of one board")
+    erase.add_argument("--port", required=True)
+    erase.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    erase.add_argument("--partitions", nargs="+", metavar="NAME", help="erase only these partitions (e.g. nvs otadata)")
+    erase.add_argument("--from-device", action="store_true", help="read the partition table from the board")
+    erase.add_argument("--timeout", type=float, help="cancel the job after this many seconds")
+    erase.set_defaults(func=cmd_erase)
+
+    backup = subparsers.add_parser("backup", help="save the flash of one board, reading only blocks not seen before")
+    backup.add_argument("--port", required=True)
+    backup.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    backup.add_argument("--partitions", nargs="+", metavar="NAME", help="back up only these partitions (e.g. nvs)")
+    backup.add_argument("--from-device", action="store_true", help="read the partition table from the board")
+    backup.add_argument("--timeout", type=float, help="cancel the job after this many seconds")
+    backup.set_defaults(func=cmd_backup)
+
+    restore = subparsers.add_parser("restore", help="write a backup back, only the blocks that differ")
+    restore.add_argument("backup", help="backup manifest from fimware/backups")
+    restore.add_argument("--port", required=True)
+    restore.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    restore.add_argument("--timeout", type=float, help="cancel the job after this many seconds")
+    restore.set_defaults(func=cmd_restore)
+
+    flash_all = subparsers.add_parser("flash-all", help="flash many boards in parallel")
+    flash_all.add_argument("--ports", nargs="*", help="ports to flash (default: all USB serial ports)")
+    flash_all.add_argument("--parallel", type=int, default=4)
+    flash_all.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    flash_all.add_argument("--incremental", action="store_true", help="write only changed sectors")
+    flash_all.add_argument("--events", action="store_true", help="print a JSON line per port event")
+    flash_all.add_argument("--boot-check", action="store_true", help="wait for the CatOs banner after reset")
+    flash_all.add_argument("--timeout", type=float, help="cancel a board's job after this many seconds")
+    flash_all.set_defaults(func=cmd_flash_all)
+
+    watch = subparsers.add_parser("watch", help="print a JSON line when a board is plugged in or out")
+    watch.add_argument("--auto-flash", action="store_true", help="flash every USB board as it is plugged in")
+    watch.add_argument("--settle", type=float, default=1.0, help="seconds to wait after attach before flashing")
+    watch.add_argument("--parallel", type=int, default=4)
+    watch.add_argument("--baud", type=_baud, default=460800, help="baud rate or 'auto'")
+    watch.add_argument("--incremental", action="store_true", help="write only changed sectors")
+    watch.add_argument("--boot-check", action="store_true", help="wait for the CatOs banner after reset")
+    watch.add_argument("--timeout", type=float, help="cancel a board's job after this many seconds")
+    watch.set_defaults(func=cmd_watch)
+
+    return parser
+
+
+def main(argv=None):
+    global _json_out
+    _json_out = sys.stdout
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,23 @@
+import json
+import os
+
+# необязательный конфиг рядом с Flasher.py, например {"mirror": "http://192.168.1.10:8780"}
+CONFIG_FILE = "catoshub.json"
+CONFIG_ENV = "CATOSHUB_CONFIG"
+
+
+def load_config(path=None):
+    path = path or os.environ.get(CONFIG_ENV) or CONFIG_FILE
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def mirror_url(override=None):
+    # --mirror из командной строки важнее конфига; "" отключает зеркало
+    if override is not None:
+        return override or None
+    return load_config().get("mirror") or None
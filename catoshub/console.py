@@ -0,0 +1,138 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from catoshub.images import CACHE_DIR
+
+MAX_LINES = 5000
+LOG_DIR = os.path.join(CACHE_DIR, "logs")
+LOG_FILE = "console.log"
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 5
+
+_file_sink = None
+_file_sink_lock = threading.Lock()
+
+
+class FileSink:
+    # пишет строки в ротируемый файл из своего потока; append только кладет в очередь
+    def __init__(self, path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="console-log", daemon=True)
+        self.thread.start()
+
+    def append(self, line):
+        self.records.put((time.time(), line))
+
+    def close(self):
+        self.records.put(None)
+        self.thread.join(2)
+
+    def _run(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        except OSError:
+            handler = None
+        while True:
+            item = self.records.get()
+            if item is None:
+                break
+            if handler is None:
+                continue
+            created, line = item
+            record = logging.makeLogRecord({"msg": line, "created": created,
+                                            "msecs": (created - int(created)) * 1000})
+            handler.handle(record)
+        if handler is not None:
+            handler.close()
+
+
+def file_sink():
+    global _file_sink
+    with _file_sink_lock:
+        if _file_sink is None:
+            _file_sink = FileSink(os.path.join(LOG_DIR, LOG_FILE))
+            atexit.register(_file_sink.close)
+        return _file_sink
+
+
+class LogBuffer:
+    # кольцо последних строк + очередь того, что еще не показано; писать можно из любого потока
+    def __init__(self, maxlen=MAX_LINES, prefix=None, to_file=True):
+        self.lines = deque(maxlen=maxlen)
+        self.pending = deque(maxlen=maxlen)
+        self.overflowed = False
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.sink = file_sink() if to_file else None
+
+    def append(self, line):
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.overflowed = True
+            self.lines.append(line)
+            self.pending.append(line)
+        if self.sink is not None:
+            self.sink.append(f"[{self.prefix}] {line}" if self.prefix else line)
+
+    def drain(self):
+        # (новые строки, overflowed): при переполнении показанное надо перерисовать целиком
+        with self.lock:
+            lines = list(self.pending)
+            self.pending.clear()
+            overflowed, self.overflowed = self.overflowed, False
+        return lines, overflowed
+
+    def redraw(self, text=""):
+        # все кольцо целиком (с фильтром); непоказанное считается показанным
+        with self.lock:
+            lines = list(self.lines)
+            self.pending.clear()
+            self.overflowed = False
+        return filter_lines(lines, text)
+
+    def clear(self):
+        with self.lock:
+            self.lines.clear()
+            self.pending.clear()
+            self.overflowed = False
+
+
+class LineWriter:
+    # файлоподобный объект для stdout: режет вывод esptool на строки
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text.replace("\r", "\n")
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            line = line.strip()
+            if line:
+                self.on_line(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def filter_lines(lines, text):
+    if not text:
+        return list(lines)
+    text = text.lower()
+    return [line for line in lines if text in line.lower()]
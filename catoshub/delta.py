@@ -0,0 +1,187 @@
+import hashlib
+import os
+import struct
+import zlib
+
+import requests
+
+from catoshub.download import CHUNK_SIZE, TIMEOUT
+
+# патч между релизами: заголовок + zlib-поток команд COPY (из старого образа) и INSERT (новые байты)
+MAGIC = b"CATDELTA1"
+HEADER = struct.Struct("<32s32sQ")
+OP_COPY = 0
+OP_INSERT = 1
+COPY = struct.Struct("<BII")
+INSERT = struct.Struct("<BI")
+# окно поиска совпадений и шаг индекса по старому образу
+WINDOW = 32
+STRIDE = 16
+COMPARE_CHUNK = 256
+
+
+class DeltaError(Exception):
+    pass
+
+
+def _match_length(source, src, target, dst):
+    # сколько байт совпадает вперед, сравниваем кусками
+    limit = min(len(source) - src, len(target) - dst)
+    length = 0
+    while length < limit:
+        step = min(COMPARE_CHUNK, limit - length)
+        if source[src + length:src + length + step] == target[dst + length:dst + length + step]:
+            length += step
+            continue
+        while length < limit and source[src + length] == target[dst + length]:
+            length += 1
+        break
+    return length
+
+
+def make_delta(source, target):
+    # для выпуска релиза: python -m catoshub delta OLD NEW --out firmware-OLD_TAG.delta
+    source = bytes(source)
+    target = bytes(target)
+    index = {}
+    for pos in range(0, len(source) - WINDOW + 1, STRIDE):
+        index.setdefault(source[pos:pos + WINDOW], pos)
+
+    body = zlib.compressobj(9)
+    out = [MAGIC, HEADER.pack(hashlib.sha256(source).digest(), hashlib.sha256(target).digest(), len(target))]
+
+    def insert(data):
+        if data:
+            out.append(body.compress(INSERT.pack(OP_INSERT, len(data)) + data))
+
+    literal = 0
+    pos = 0
+    while pos + WINDOW <= len(target):
+        src = index.get(target[pos:pos + WINDOW])
+        if src is None:
+            pos += 1
+            continue
+        # дотягиваем совпадение назад, пока не упремся в начало литерала
+        back = 0
+        while back < pos - literal and back < src and source[src - back - 1] == target[pos - back - 1]:
+            back += 1
+        length = back + WINDOW + _match_length(source, src + WINDOW, target, pos + WINDOW)
+        insert(target[literal:pos - back])
+        out.append(body.compress(COPY.pack(OP_COPY, src - back, length)))
+        pos = pos - back + length
+        literal = pos
+    insert(target[literal:])
+    out.append(body.flush())
+    return b"".join(out)
+
+
+class _Stream:
+    # разжимает патч по мере прихода кусков и отдает ровно столько байт, сколько попросили
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.inflate = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.header = b""
+
+    def _fill(self):
+        for chunk in self.chunks:
+            if len(self.header) < len(MAGIC) + HEADER.size:
+                need = len(MAGIC) + HEADER.size - len(self.header)
+                self.header += chunk[:need]
+                chunk = chunk[need:]
+            if chunk:
+                self.buffer += self.inflate.decompress(chunk)
+                return True
+        self.buffer += self.inflate.flush()
+        return False
+
+    def read_header(self):
+        while len(self.header) < len(MAGIC) + HEADER.size:
+            if not self._fill() and len(self.header) < len(MAGIC) + HEADER.size:
+                raise DeltaError("Delta is truncated")
+        if not self.header.startswith(MAGIC):
+            raise DeltaError("Not a CatOs delta")
+        return HEADER.unpack(self.header[len(MAGIC):])
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            if not self._fill() and len(self.buffer) < size:
+                raise DeltaError("Delta is truncated")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def at_end(self):
+        while not self.buffer:
+            if not self._fill():
+                return not self.buffer
+        return False
+
+
+def apply_delta(source_path, chunks, out_path, expected_sha256=None):
+    # потоково: патч целиком в память не грузим, результат пишем в out_path и сразу хешируем
+    stream = _Stream(chunks)
+    source_hash, target_hash, target_size = stream.read_header()
+    with open(source_path, 'rb') as source:
+        if hashlib.sha256(source.read()).digest() != source_hash:
+            raise DeltaError("Delta was made for a different firmware")
+        digest = hashlib.sha256()
+        written = 0
+        with open(out_path, 'wb') as out:
+            while not stream.at_end():
+                op = stream.read(1)[0]
+                if op == OP_COPY:
+                    _, offset, length = COPY.unpack(bytes([op]) + stream.read(COPY.size - 1))
+                    source.seek(offset)
+                    data = source.read(length)
+                    if len(data) != length:
+                        raise DeltaError("Delta copies past the end of the old firmware")
+                elif op == OP_INSERT:
+                    _, length = INSERT.unpack(bytes([op]) + stream.read(INSERT.size - 1))
+                    data = stream.read(length)
+                else:
+                    raise DeltaError(f"Unknown delta command {op}")
+                out.write(data)
+                digest.update(data)
+                written += len(data)
+
+    # хеш из релиза важнее хеша из самого патча
+    expected = expected_sha256 or target_hash.hex()
+    if written != target_size or digest.hexdigest() != expected:
+        raise DeltaError("Patched firmware does not match the release hash")
+    return written
+
+
+def download_delta(session, url, size, source_path, path, expected_sha256=None, on_progress=None):
+    # качаем и накладываем одновременно; в path попадает только проверенный образ
+    part_path = path + ".delta.part"
+    received = 0
+    last_percent = -1
+
+    def chunks(response):
+        nonlocal received, last_percent
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if not chunk:
+                continue
+            received += len(chunk)
+            if on_progress and size:
+                percent = min(100, received * 100 // size)
+                if percent != last_percent:
+                    last_percent = percent
+                    on_progress(percent)
+            yield chunk
+
+    try:
+        with session.get(url, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code != 200:
+                raise DeltaError(f"Delta download failed: HTTP {response.status_code}")
+            written = apply_delta(source_path, chunks(response), part_path, expected_sha256)
+    except Exception as e:
+        # недокачанный или не сошедшийся образ не оставляем
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        if isinstance(e, (requests.RequestException, zlib.error, struct.error)):
+            raise DeltaError(f"Delta download failed: {str(e)}")
+        raise
+    os.replace(part_path, path)
+    return received, written
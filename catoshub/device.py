@@ -0,0 +1,292 @@
+import zlib
+
+from esptool.cmds import detect_chip, flash_size_bytes
+from esptool.loader import DEFAULT_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB, ESPLoader, timeout_per_mb
+from esptool.util import FatalError
+
+from catoshub.baud import BAUD_CANDIDATES, CHECK_SIZE, DEFAULT_BAUD, BaudStore, adapter_key, check_link
+from catoshub.bootcheck import BOOT_TIMEOUT, FlashSizeMismatch, check_boot
+from catoshub.fingerprint import FingerprintStore, identify
+from catoshub.journal import FlashRefused, write_resumable
+from catoshub.partitions import dirty_ranges, read_partitions, sector_range, select_partitions
+from catoshub.payload import CHIP, FLASH_SIZE
+from catoshub.progress import FlashProgress
+from catoshub.trace import NULL_TRACE
+
+
+def _connect_stub(port, trace=NULL_TRACE):
+    # connect: открытие порта, сброс в загрузчик, синхронизация и опознание чипа - это один вызов esptool
+    with trace.span("connect"):
+        esp = detect_chip(port, ESPLoader.ESP_ROM_BAUD, "default_reset")
+        if esp.CHIP_NAME.lower() != CHIP:
+            esp._port.close()
+            raise FlashRefused(f"Expected {CHIP}, found {esp.CHIP_NAME}")
+    # размер флеша и прочее берем из отпечатка платы, а не из констант: на станции бывают 4, 8 и 16 МБ
+    fingerprint = identify(esp, port, trace=trace)
+    with trace.span("stub"):
+        esp = esp.run_stub()
+        esp.flash_set_parameters(flash_size_bytes(fingerprint["flash_size"]))
+    esp.fingerprint = fingerprint
+    return esp
+
+
+def connect(port, baud=DEFAULT_BAUD, log=print, trace=NULL_TRACE):
+    if baud == "auto":
+        return connect_auto(port, log=log, trace=trace)
+    esp = _connect_stub(port, trace)
+    if baud > ESPLoader.ESP_ROM_BAUD:
+        with trace.span("baud", baud=baud):
+            esp.change_baud(baud)
+    return esp
+
+
+def connect_auto(port, candidates=BAUD_CANDIDATES, log=print, trace=NULL_TRACE):
+    store = BaudStore()
+    key = adapter_key(port)
+
+    remembered = store.get(key)
+    if remembered:
+        esp = None
+        try:
+            esp = connect(port, remembered, trace=trace)
+            with trace.span("link_check", baud=remembered):
+                check_link(esp, esp.flash_md5sum(0, CHECK_SIZE))
+            log(f"Using remembered baud {remembered}")
+            return esp
+        except Exception as e:
+            log(f"Remembered baud {remembered} failed ({str(e)}), negotiating again...")
+            store.forget(key)
+            if esp is not None:
+                esp._port.close()
+
+    esp = _connect_stub(port, trace)
+    reference_md5 = esp.flash_md5sum(0, CHECK_SIZE)
+    good_baud = ESPLoader.ESP_ROM_BAUD
+    for baud in candidates:
+        if baud <= good_baud:
+            continue
+        try:
+            with trace.span("baud", baud=baud):
+                esp.change_baud(baud)
+                check_link(esp, reference_md5)
+            good_baud = baud
+        except Exception as e:
+            # после сбоя чип и хост могут стоять на разных скоростях, проще переподключиться
+            log(f"Baud {baud} is unstable ({str(e)}), falling back to {good_baud}")
+            esp._port.close()
+            esp = connect(port, good_baud, trace=trace)
+            break
+
+    log(f"Using baud {good_baud}")
+    store.set(key, good_baud)
+    return esp
+
+
+def disconnect(esp, reset=True):
+    try:
+        if reset:
+            esp.hard_reset()
+    finally:
+        esp._port.close()
+
+
+def write_payload(esp, payload, on_block=None):
+    # сжатые блоки уже готовы, esptool не пережимает образ под каждую плату
+    compressed = payload.compressed
+    blocks = esp.flash_defl_begin(payload.size, len(compressed), payload.offset)
+    decompress = zlib.decompressobj()
+    timeout = DEFAULT_TIMEOUT
+    for seq in range(blocks):
+        # compressed может лежать в общей памяти станции: в esptool отдаем копию блока
+        block = bytes(compressed[seq * esp.FLASH_WRITE_SIZE:(seq + 1) * esp.FLASH_WRITE_SIZE])
+        written = len(decompress.decompress(block))
+        esp.flash_defl_block(block, seq, timeout=timeout)
+        # стаб отвечает сразу, а пишет блок во время приема следующего
+        timeout = max(DEFAULT_TIMEOUT, timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, written))
+        if on_block is not None:
+            on_block(written)
+    esp.flash_defl_finish(reboot=False, timeout=timeout)
+
+
+def verify_payload(esp, payload):
+    actual = esp.flash_md5sum(payload.offset, payload.size)
+    if actual != payload.md5:
+        raise FlashRefused(f"MD5 mismatch at 0x{payload.offset:x}: flash {actual}, expected {payload.md5}")
+
+
+class DeviceSession:
+    # одно подключение со стабом на всю цепочку: стереть, записать, проверить, сбросить
+    def __init__(self, port, baud=DEFAULT_BAUD, log=print, trace=NULL_TRACE):
+        self.port = port
+        self.baud = baud
+        self.log = log
+        # фазы текущей задачи (JobTrace); сессия живет дольше задач, поэтому trace меняют снаружи
+        self.trace = trace
+        self.esp = None
+        # реальная скорость после подключения (при baud="auto" известна только тут)
+        self.current_baud = None
+        # отпечаток платы (fingerprint.identify): чип, флеш, кварц; тоже известен после подключения
+        self.fingerprint = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(reset=exc_type is None)
+
+    @property
+    def connected(self):
+        return self.esp is not None
+
+    def open(self):
+        if self.esp is None:
+            self.log("Connecting to ESP32...")
+            self.esp = connect(self.port, self.baud, self.log, self.trace)
+            self.current_baud = self.esp._port.baudrate
+            self.fingerprint = self.esp.fingerprint
+        return self.esp
+
+    def ensure_open(self):
+        # сессия могла протухнуть между операциями: плату сбросили или выдернули
+        if self.esp is not None:
+            try:
+                self.esp.read_reg(self.esp.CHIP_DETECT_MAGIC_REG_ADDR)
+            except Exception:
+                self.log("Device session lost, reconnecting...")
+                self.close(reset=False)
+        return self.open()
+
+    def close(self, reset=False):
+        if self.esp is None:
+            return
+        esp, self.esp = self.esp, None
+        try:
+            if reset:
+                self.log("Hard resetting via RTS pin...")
+                with self.trace.span("reset"):
+                    disconnect(esp, reset)
+            else:
+                disconnect(esp, reset)
+        except Exception:
+            pass
+
+    def hard_reset(self):
+        self.close(reset=True)
+
+    @property
+    def flash_size(self):
+        # под него собираются образы: размер флеша пишется в заголовок бутлоадера
+        return self.fingerprint["flash_size"] if self.fingerprint else FLASH_SIZE
+
+    def for_board(self, images):
+        # images - список или функция flash_size -> список (imageset.board_payloads), ее зовем после подключения
+        return images(self.flash_size) if callable(images) else images
+
+    def forget_fingerprint(self):
+        # флеш ответил не тем, что ждали: при следующем подключении опросим плату заново
+        if self.fingerprint is not None:
+            try:
+                FingerprintStore().forget(self.fingerprint["mac"], self.fingerprint["serial"])
+            except OSError:
+                pass
+
+    def boot_check(self, expected_version=None, timeout=BOOT_TIMEOUT):
+        # сброс делает check_boot сам, уже слушая порт; возвращает версию из баннера
+        self.close(reset=False)
+        self.log("Waiting for CatOs to boot...")
+        with self.trace.span("boot_check") as attrs:
+            try:
+                version = check_boot(self.port, expected_version, timeout, self.log)
+            except FlashSizeMismatch:
+                # отпечаток устарел (флеш перепаяли): следующая прошивка опросит плату и поправит заголовок
+                self.forget_fingerprint()
+                raise
+            attrs["version"] = version
+        self.log(f"CatOs {version} booted")
+        return version
+
+    def read_mac(self):
+        return ":".join(f"{byte:02x}" for byte in self.ensure_open().read_mac())
+
+    def erase_flash(self):
+        esp = self.ensure_open()
+        self.log("Erasing flash (this may take a while)...")
+        with self.trace.span("erase", bytes=flash_size_bytes(self.flash_size)):
+            esp.erase_flash()
+
+    def erase_region(self, offset, size):
+        esp = self.ensure_open()
+        with self.trace.span("erase", offset=offset, bytes=size):
+            esp.erase_region(offset, size)
+
+    def erase_partitions(self, names, partitions=None):
+        # вместо erase_flash: только выбранные разделы, и только непустые их блоки
+        esp = self.ensure_open()
+        if partitions is None:
+            self.log("Reading partition table from the device...")
+            with self.trace.span("read_partitions"):
+                partitions = read_partitions(esp)
+        # невыровненный раздел отвергаем до первого стирания
+        selected = [(partition, sector_range(partition)) for partition in select_partitions(partitions, names)]
+        erased = {}
+        for partition, (offset, size) in selected:
+            with self.trace.span("compare", partition=partition.name, offset=offset, size=size):
+                ranges = dirty_ranges(esp, offset, size)
+            if not ranges:
+                self.log(f"{partition.name} (0x{offset:x}, {size} bytes): already blank, skipped")
+            for start, length in ranges:
+                self.log(f"Erasing {partition.name}: {length} bytes at 0x{start:x}...")
+                with self.trace.span("erase", partition=partition.name, offset=start, bytes=length):
+                    esp.erase_region(start, length)
+            erased[partition.name] = sum(length for _, length in ranges)
+        return erased
+
+    def md5(self, offset, size):
+        return self.ensure_open().flash_md5sum(offset, size)
+
+    def verify(self, payloads):
+        esp = self.ensure_open()
+        for payload in payloads:
+            with self.trace.span("verify", offset=payload.offset, size=payload.size):
+                self._verify(esp, payload)
+
+    def _verify(self, esp, payload):
+        try:
+            verify_payload(esp, payload)
+        except FatalError:
+            self.forget_fingerprint()
+            raise
+
+    def write(self, payloads, on_progress=None, verify=True, journal=None):
+        esp = self.ensure_open()
+        if esp.get_secure_boot_enabled() and any(payload.offset < 0x8000 for payload in payloads):
+            raise FlashRefused("Secure Boot detected, writing to flash regions < 0x8000 is disabled")
+
+        total = sum(payload.size for payload in payloads)
+        progress = FlashProgress(total, on_progress)
+
+        for payload in payloads:
+            self.log(f"Writing {payload.size} bytes ({len(payload.compressed)} compressed) at 0x{payload.offset:x}...")
+            progress.start_region(payload.offset, payload.size)
+            on_block = progress.add if journal is None else journal.track(payload, progress.add)
+            with self.trace.span("write", offset=payload.offset, bytes=payload.size,
+                                 compressed=len(payload.compressed), baud=self.current_baud):
+                write_payload(esp, payload, on_block)
+            if verify:
+                with self.trace.span("verify", offset=payload.offset, size=payload.size):
+                    self._verify(esp, payload)
+                state = progress.snapshot()
+                self.log(f"Hash of data verified at 0x{payload.offset:x} ({state['kbps']:.1f} kbit/s effective)")
+            if journal is not None:
+                journal.complete(payload)
+        return total
+
+
+def flash_payloads(port, payloads, log=print, on_progress=None, baud=DEFAULT_BAUD, boot_check=False,
+                   expected_version=None, trace=NULL_TRACE):
+    with DeviceSession(port, baud, log, trace) as session:
+        total = write_resumable(session, payloads, on_progress)
+        if boot_check:
+            session.boot_check(expected_version)
+        return total
@@ -0,0 +1,56 @@
+from catoshub.baud import DEFAULT_BAUD
+from catoshub.device import DeviceSession
+from catoshub.partitions import BLOCK_SIZE, SECTOR_SIZE, flash_matches
+from catoshub.payload import Payload
+from catoshub.trace import NULL_TRACE
+
+
+def changed_ranges(esp, offset, data):
+    # сначала весь регион, потом блоки по 64К, и только внутри них сектора
+    if flash_matches(esp, offset, data):
+        return []
+
+    ranges = []
+    for block_start in range(0, len(data), BLOCK_SIZE):
+        block_end = min(block_start + BLOCK_SIZE, len(data))
+        if flash_matches(esp, offset + block_start, data[block_start:block_end]):
+            continue
+        for start in range(block_start, block_end, SECTOR_SIZE):
+            end = min(start + SECTOR_SIZE, block_end)
+            if flash_matches(esp, offset + start, data[start:end]):
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+
+    return [(offset + start, data[start:end]) for start, end in ranges]
+
+
+def write_incremental(session, images, on_progress=None):
+    esp = session.ensure_open()
+    images = session.for_board(images)
+    session.log("Comparing flash contents with local images...")
+    writes = []
+    for offset, data in images:
+        with session.trace.span("compare", offset=offset, size=len(data)):
+            ranges = changed_ranges(esp, offset, data)
+        changed = sum(len(chunk) for _, chunk in ranges)
+        if changed:
+            session.log(f"0x{offset:x}: {changed} of {len(data)} bytes differ")
+        else:
+            session.log(f"0x{offset:x}: up to date, skipped")
+        writes.extend(ranges)
+
+    if writes:
+        session.write([Payload.from_data(offset, chunk) for offset, chunk in writes], on_progress)
+    return sum(len(chunk) for _, chunk in writes), sum(len(data) for _, data in images)
+
+
+def flash_incremental(port, images, log=print, on_progress=None, baud=DEFAULT_BAUD, boot_check=False,
+                      expected_version=None, trace=NULL_TRACE):
+    with DeviceSession(port, baud, log, trace) as session:
+        written, total = write_incremental(session, images, on_progress)
+        if boot_check:
+            session.boot_check(expected_version)
+        return written, total
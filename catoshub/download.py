@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+SEGMENT_THRESHOLD = 4 * 1024 * 1024
+SEGMENTS = 4
+RETRIES = 5
+TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    pass
+
+
+def make_session():
+    # одна keep-alive сессия на API и на ассеты
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SEGMENTS * 2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "CatOs-Hub"
+    return session
+
+
+class _Progress:
+    def __init__(self, total, callback):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.last_percent = -1
+
+    def add(self, count):
+        with self.lock:
+            self.done += count
+            if not self.callback or not self.total:
+                return
+            percent = min(100, self.done * 100 // self.total)
+            if percent != self.last_percent:
+                self.last_percent = percent
+                self.callback(percent)
+
+
+def _probe(session, url):
+    try:
+        response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    except requests.RequestException:
+        return None, False, None
+    if response.status_code != 200:
+        return None, False, None
+    size = int(response.headers.get('content-length', 0)) or None
+    return size, response.headers.get('accept-ranges', '').lower() == 'bytes', response.headers.get('etag')
+
+
+def _backoff(attempt):
+    time.sleep(min(30, 2 ** attempt))
+
+
+def _download_stream(session, url, part_path, size, etag, progress):
+    state_path = part_path + ".json"
+    state = _load_state(state_path, url, size, etag) if os.path.exists(part_path) else None
+    if state is None or "segments" in state:
+        # .part от другого URL, размера или ETag (например, отмененная загрузка прошлого релиза) не дописываем
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        with open(state_path, 'w') as f:
+            json.dump({"url": url, "size": size, "etag": etag}, f)
+
+    for attempt in range(RETRIES):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size and offset >= size:
+            break
+        progress.add(offset - progress.done)
+
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if etag:
+                # файл на сервере сменился - придет 200 с новым целиком, а не хвост к старому началу
+                headers["If-Range"] = etag
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code not in (200, 206):
+                    raise DownloadError(f"Download failed: HTTP {response.status_code}")
+                if offset and response.status_code != 206:
+                    # сервер проигнорировал Range, начинаем заново
+                    progress.add(-offset)
+                    offset = 0
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            progress.add(len(chunk))
+            break
+        except requests.RequestException:
+            if attempt == RETRIES - 1:
+                raise
+            _backoff(attempt)
+    os.remove(state_path)
+
+
+def _load_state(state_path, url, size, etag=None):
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("url") != url or state.get("size") != size or state.get("etag") != etag:
+        return None
+    return state
+
+
+def _download_segmented(session, url, part_path, size, etag, progress, segments):
+    state_path = part_path + ".json"
+    state = _load_state(state_path, url, size, etag) if os.path.exists(part_path) else None
+    if state is None or "segments" not in state:
+        step = -(-size // segments)
+        state = {
+            "url": url,
+            "size": size,
+            "etag": etag,
+            "segments": [[start, min(start + step, size), 0] for start in range(0, size, step)],
+        }
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    progress.add(sum(segment[2] for segment in state["segments"]))
+
+    lock = threading.Lock()
+
+    def save_state():
+        with lock:
+            with open(state_path, 'w') as f:
+                json.dump(state, f)
+
+    def fetch(segment):
+        for attempt in range(RETRIES):
+            start, end, done = segment
+            if start + done >= end:
+                return
+            headers = {"Range": f"bytes={start + done}-{end - 1}"}
+            try:
+                with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code != 206:
+                        raise DownloadError(f"Range request failed: HTTP {response.status_code}")
+                    with open(part_path, 'r+b') as f:
+                        f.seek(start + done)
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                chunk = chunk[:end - start - segment[2]]
+                                f.write(chunk)
+                                segment[2] += len(chunk)
+                                progress.add(len(chunk))
+                return
+            except requests.RequestException:
+                if attempt == RETRIES - 1:
+                    raise
+                _backoff(attempt)
+            finally:
+                save_state()
+
+    with ThreadPoolExecutor(max_workers=len(state["segments"])) as pool:
+        for future in [pool.submit(fetch, segment) for segment in state["segments"]]:
+            future.result()
+
+    if any(start + done < end for start, end, done in state["segments"]):
+        raise DownloadError("Download incomplete")
+    os.remove(state_path)
+
+
+def download_file(session, url, path, on_progress=None, segments=SEGMENTS):
+    # качаем в .part рядом с целью и переименовываем только целиком скачанный файл
+    part_path = path + ".part"
+    size, ranges, etag = _probe(session, url)
+    progress = _Progress(size, on_progress)
+
+    # рядом с .part лежит .part.json с URL, размером и ETag: чужую часть не продолжаем
+    if size and ranges and segments > 1 and size >= SEGMENT_THRESHOLD:
+        _download_segmented(session, url, part_path, size, etag, progress, segments)
+    else:
+        _download_stream(session, url, part_path, size if ranges else None, etag, progress)
+
+    if size and os.path.getsize(part_path) != size:
+        raise DownloadError(f"Download size mismatch: {os.path.getsize(part_path)} of {size} bytes")
+    os.replace(part_path, path)
+    return size or os.path.getsize(path)
@@ -0,0 +1,88 @@
+import os
+import time
+
+from catoshub.baud import adapter_key
+from catoshub.images import CACHE_DIR
+from catoshub.jsonstore import JsonStore
+from catoshub.payload import FLASH_SIZE
+from catoshub.trace import NULL_TRACE
+
+FINGERPRINT_PATH = os.path.join(CACHE_DIR, "fingerprints.json")
+# на стенде с прижимными контактами каждая плата новая: старые отпечатки вытесняем
+MAX_FINGERPRINTS = 1024
+
+
+def usb_serial(port):
+    # серийник переходника; у CH340 его нет, тогда ключ - один MAC
+    key = adapter_key(port)
+    return key.split(":", 2)[2] if key else ""
+
+
+class FingerprintStore(JsonStore):
+    # что известно о плате (ревизия чипа, флеш, кварц), чтобы не спрашивать ее при каждой прошивке
+    def __init__(self, path=FINGERPRINT_PATH):
+        super().__init__(path)
+
+    @staticmethod
+    def key(mac, serial):
+        return f"{mac}/{serial or ''}"
+
+    def get(self, mac, serial):
+        return self.load().get(self.key(mac, serial))
+
+    def _prune(self, data):
+        if len(data) > MAX_FINGERPRINTS:
+            oldest = sorted(data, key=lambda name: data[name].get("seen", 0))
+            for name in oldest[:len(data) - MAX_FINGERPRINTS]:
+                del data[name]
+
+    def put(self, fingerprint):
+        self._update(self.key(fingerprint["mac"], fingerprint["serial"]), fingerprint)
+
+    def forget(self, mac, serial):
+        self._update(self.key(mac, serial), None)
+
+
+def probe_fingerprint(esp, mac, serial):
+    # полный опрос на ROM: ревизия из eFuse, JEDEC ID флеша и кварц по делителю UART
+    from esptool.cmds import DETECTED_FLASH_SIZES
+
+    esp.flash_spi_attach(0)
+    flash_id = esp.flash_id()
+    return {
+        "mac": mac,
+        "serial": serial,
+        "chip": esp.CHIP_NAME,
+        "description": esp.get_chip_description(),
+        "revision": f"v{esp.get_major_chip_version()}.{esp.get_minor_chip_version()}",
+        "flash_id": f"{flash_id & 0xFFFFFF:06x}",
+        "flash_size": DETECTED_FLASH_SIZES.get((flash_id >> 16) & 0xFF),
+        "crystal_mhz": esp.get_crystal_freq(),
+        "seen": round(time.time()),
+    }
+
+
+def identify(esp, port, store=None, trace=NULL_TRACE):
+    # сразу после detect_chip: MAC - два чтения eFuse, остальное из кэша, если плата уже знакома
+    store = store or FingerprintStore()
+    with trace.span("fingerprint") as attrs:
+        mac = ":".join(f"{byte:02x}" for byte in esp.read_mac())
+        serial = usb_serial(port)
+        cached = store.get(mac, serial)
+        if cached is not None and cached.get("chip") == esp.CHIP_NAME and cached.get("flash_size"):
+            attrs["cached"] = True
+            return cached
+        if cached is not None:
+            # под тем же MAC и серийником отвечает другой чип: запись устарела
+            store.forget(mac, serial)
+        fingerprint = probe_fingerprint(esp, mac, serial)
+        attrs["cached"] = False
+        if fingerprint["flash_size"] is None:
+            # флеш не опознан: шьем как раньше и в следующий раз спросим снова
+            fingerprint["flash_size"] = FLASH_SIZE
+        else:
+            try:
+                store.put(fingerprint)
+            except OSError:
+                pass
+        return fingerprint
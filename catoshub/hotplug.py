@@ -0,0 +1,190 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+
+import serial.tools.list_ports
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct("iIII")
+
+PORT_PREFIXES = ("ttyUSB", "ttyACM")
+POLL_INTERVAL = 1.0
+
+
+def _describe(info):
+    return {
+        "device": info.device,
+        "description": info.description,
+        "vid": info.vid,
+        "pid": info.pid,
+        "serial_number": info.serial_number,
+    }
+
+
+def _port_info(device):
+    # смотрим в sysfs только по одному устройству, а не обходим все comports()
+    try:
+        from serial.tools.list_ports_linux import SysFS
+
+        return _describe(SysFS(device))
+    except Exception:
+        return {"device": device, "description": "n/a", "vid": None, "pid": None, "serial_number": None}
+
+
+class HotplugWatcher:
+    def __init__(self, on_attach=None, on_detach=None, on_ready=None, dev_dir="/dev"):
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        self.on_ready = on_ready
+        self.dev_dir = dev_dir
+        self.ports = {}
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stop_pipe = None
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.ports)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._stop_pipe is not None:
+            try:
+                os.write(self._stop_pipe[1], b"x")
+            except OSError:
+                pass
+
+    def scan(self):
+        found = {info.device: _describe(info) for info in serial.tools.list_ports.comports()}
+        with self.lock:
+            known = set(self.ports)
+        for device in known - set(found):
+            self._detach(device)
+        for device in sorted(set(found) - known):
+            self._attach(found[device])
+
+    def run(self):
+        self.scan()
+        if self.on_ready is not None:
+            self.on_ready(self.snapshot())
+        inotify = self._open_inotify() if sys.platform.startswith("linux") else None
+        if inotify is None:
+            self._run_polling()
+            return
+
+        self._stop_pipe = os.pipe()
+        try:
+            self._run_inotify(inotify)
+        finally:
+            os.close(inotify)
+            for fd in self._stop_pipe:
+                os.close(fd)
+            self._stop_pipe = None
+
+    def _attach(self, info):
+        with self.lock:
+            if info["device"] in self.ports:
+                return
+            self.ports[info["device"]] = info
+        if self.on_attach is not None:
+            self.on_attach(info)
+
+    def _detach(self, device):
+        with self.lock:
+            info = self.ports.pop(device, None)
+        if info is not None and self.on_detach is not None:
+            self.on_detach(info)
+
+    def _open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, self.dev_dir.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _run_inotify(self, fd):
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd, self._stop_pipe[0]], [], [])
+            if self._stop_pipe[0] in readable:
+                break
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + name_len]
+                offset += EVENT_HEADER.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    # очередь ядра переполнилась, события потеряны: один полный проход
+                    self.scan()
+                    continue
+                name = name.rstrip(b"\0").decode(errors="replace")
+                if not name.startswith(PORT_PREFIXES):
+                    continue
+                device = os.path.join(self.dev_dir, name)
+                if mask & IN_DELETE:
+                    self._detach(device)
+                elif mask & (IN_CREATE | IN_ATTRIB):
+                    self._attach(_port_info(device))
+
+    def _run_polling(self):
+        # на Windows и macOS нет inotify: редкий опрос comports()
+        while not self._stop_event.wait(POLL_INTERVAL):
+            self.scan()
+
+
+class AutoFlashPolicy:
+    # запускает прошивку через settle секунд после появления платы, если ее не выдернули
+    def __init__(self, flash, settle=1.0, usb_only=True):
+        self.flash = flash
+        self.settle = settle
+        self.usb_only = usb_only
+        self.enabled = True
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def on_attach(self, info):
+        if not self.enabled or (self.usb_only and info["vid"] is None):
+            return
+        timer = threading.Timer(self.settle, self._fire, [info["device"]])
+        timer.daemon = True
+        with self.lock:
+            old = self.timers.pop(info["device"], None)
+            self.timers[info["device"]] = timer
+        if old is not None:
+            old.cancel()
+        timer.start()
+
+    def on_detach(self, info):
+        with self.lock:
+            timer = self.timers.pop(info["device"], None)
+        if timer is not None:
+            timer.cancel()
+
+    def cancel_all(self):
+        with self.lock:
+            timers, self.timers = list(self.timers.values()), {}
+        for timer in timers:
+            timer.cancel()
+
+    def _fire(self, device):
+        with self.lock:
+            self.timers.pop(device, None)
+        if self.enabled:
+            self.flash(device)
@@ -0,0 +1,15 @@
+import os
+
+CACHE_DIR = "fimware"
+FIRMWARE_PATH = os.path.join(CACHE_DIR, "firmware.bin")
+
+FLASH_FILES = [
+    {"path": "flash/bootloader.bin", "offset": "0x1000"},
+    {"path": "flash/partitions.bin", "offset": "0x8000"},
+    {"path": "flash/boot_app0.bin", "offset": "0xE000"},
+    {"path": FIRMWARE_PATH, "offset": "0x10000"}
+]
+
+
+def missing_files(flash_files):
+    return [file_info["path"] for file_info in flash_files if not os.path.exists(file_info["path"])]
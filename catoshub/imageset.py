@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+from multiprocessing import shared_memory
+
+from catoshub.merge import merged_image
+from catoshub.payload import FLASH_SIZE, Payload, payload_for, prepare_image
+
+_sets = {}
+_sets_lock = threading.Lock()
+
+
+def _read_file(path):
+    # читаем целиком, без mmap: набор живет в кэше, а открытый mmap не дает на Windows
+    # заменить firmware.bin через os.replace при следующем обновлении
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ImageSet:
+    # образы одного релиза: прочитаны, подготовлены, сжаты и захешированы один раз
+    def __init__(self, images, cache_dir=None, merge=True, flash_size=FLASH_SIZE):
+        # размер флеша меняет только заголовок бутлоадера, остальные образы берутся из кэшей как есть
+        self.flash_size = flash_size
+        self.files = [(offset, prepare_image(offset, data, flash_size)) for offset, data in images]
+        # по умолчанию шьем склеенный образ: меньше регионов, меньше begin/end
+        self.merged = merged_image(self.files, flash_size=flash_size) if merge else None
+        self.images = self.merged.segments if merge else self.files
+        if cache_dir is None:
+            self.payloads = [payload_for(offset, data) for offset, data in self.images]
+        else:
+            self.payloads = [payload_for(offset, data, cache_dir) for offset, data in self.images]
+        ident = "".join(f"{payload.offset:x}:{payload.md5};" for payload in self.payloads)
+        self.key = hashlib.sha1(ident.encode()).hexdigest()
+
+    @classmethod
+    def from_files(cls, flash_files, cache_dir=None, merge=True, flash_size=FLASH_SIZE):
+        return cls([(int(file_info["offset"], 0), _read_file(file_info["path"])) for file_info in flash_files],
+                   cache_dir, merge, flash_size)
+
+    def share(self):
+        return SharedImages.create(self.payloads, self.flash_size)
+
+
+class SharedImages:
+    # сжатые образы в общей памяти: spawn-воркеры станции не читают файлы и не копируют данные
+    def __init__(self, name, entries, flash_size=FLASH_SIZE):
+        self.name = name
+        self.entries = entries
+        self.flash_size = flash_size
+        self._shm = None
+
+    def __getstate__(self):
+        return {"name": self.name, "entries": self.entries, "flash_size": self.flash_size}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.entries = state["entries"]
+        self.flash_size = state["flash_size"]
+        self._shm = None
+
+    @classmethod
+    def create(cls, payloads, flash_size=FLASH_SIZE):
+        size = sum(len(payload.compressed) for payload in payloads)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        entries = []
+        position = 0
+        for payload in payloads:
+            zsize = len(payload.compressed)
+            shm.buf[position:position + zsize] = payload.compressed
+            entries.append((payload.offset, payload.size, payload.md5, position, zsize))
+            position += zsize
+        shared = cls(shm.name, entries, flash_size)
+        shared._shm = shm
+        return shared
+
+    def attach(self):
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        view = self._shm.buf.toreadonly()
+        return [Payload(offset, size, md5, view[start:start + zsize])
+                for offset, size, md5, start, zsize in self.entries]
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        shm = self._shm or shared_memory.SharedMemory(name=self.name)
+        shm.unlink()
+
+
+def _stamp(flash_files):
+    stamp = []
+    for file_info in flash_files:
+        st = os.stat(file_info["path"])
+        stamp.append((file_info["path"], file_info["offset"], st.st_size, st.st_mtime_ns))
+    return tuple(stamp)
+
+
+def load_image_set(flash_files, cache_dir=None, merge=True, flash_size=FLASH_SIZE):
+    # один ImageSet на релиз и размер флеша: пока файлы не поменялись, все прошивки берут готовый
+    stamp = _stamp(flash_files)
+    key = (stamp, merge, flash_size)
+    with _sets_lock:
+        image_set = _sets.get(key)
+    if image_set is None:
+        image_set = ImageSet.from_files(flash_files, cache_dir, merge, flash_size)
+        with _sets_lock:
+            # наборы старого релиза выкидываем, наборы под другие размеры флеша оставляем
+            for old in [old for old in _sets if old[0] != stamp]:
+                del _sets[old]
+            _sets[key] = image_set
+    return image_set
+
+
+def board_payloads(flash_files, shared=None, merge=True):
+    # для write_resumable: flash_size -> payloads; общая память станции подходит, если размер тот же
+    def payloads(flash_size):
+        if shared is not None and shared.flash_size == flash_size:
+            return shared.attach()
+        return load_image_set(flash_files, merge=merge, flash_size=flash_size).payloads
+    return payloads
+
+
+def board_images(flash_files, merge=True):
+    # для write_incremental: flash_size -> [(offset, data)]
+    def images(flash_size):
+        return load_image_set(flash_files, merge=merge, flash_size=flash_size).images
+    return images
@@ -0,0 +1,286 @@
+import itertools
+import threading
+import time
+from collections import Counter
+
+# очередь задач станции без Qt: у каждого порта своя очередь, общий предел одновременных задач,
+# приоритеты, отмена и таймауты. Окна и консольные команды ставят сюда download, erase и flash.
+
+# столько плат станция может шить одновременно (как у счетчика "parallel" в окне станции)
+MAX_WORKERS = 16
+
+# задачи из окна прошивки идут раньше очереди станции
+INTERACTIVE = 10
+# сколько секунд задача может идти, прежде чем ее отменят
+JOB_TIMEOUTS = {"download": 600, "erase": 600, "flash": 900, "backup": 900, "restore": 900}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed-out"
+FINISHED = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class JobCancelled(BaseException):
+    # BaseException, как KeyboardInterrupt: не застревает в "except Exception" повторов записи
+    pass
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, target, port=None, priority=0, timeout=None, group=None):
+        self.id = next(self._ids)
+        self.kind = kind
+        # target(job) делает работу и время от времени зовет job.check()
+        self.target = target
+        self.port = port
+        # больше - раньше; при равном приоритете - по очереди постановки
+        self.priority = priority
+        self.timeout = timeout
+        self.group = group
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.timed_out = False
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def lane(self):
+        # задачи одной полосы идут строго по одной: порт, а для задач без порта - их вид
+        return self.port or self.kind
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self, timed_out=False):
+        with self._lock:
+            if self._cancel.is_set():
+                return
+            self.timed_out = timed_out
+            self._cancel.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        # например, прибить процесс прошивки; если уже отменили - сразу
+        with self._lock:
+            if not self._cancel.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise JobCancelled("Timed out" if self.timed_out else "Cancelled")
+
+    def sleep(self, seconds):
+        if self._cancel.wait(seconds):
+            self.check()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.port or '-'} {self.state}>"
+
+
+class JobScheduler:
+    def __init__(self, max_workers=MAX_WORKERS, on_event=None):
+        self.max_workers = max(1, int(max_workers))
+        # on_event(job, event): "queued", "started", "finished"; зовется из рабочих потоков
+        self.on_event = on_event
+        self.limits = {}
+        self._cond = threading.Condition()
+        self._queued = []
+        self._running = set()
+        self._busy_lanes = set()
+        self._group_running = Counter()
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+
+    def set_limit(self, group, limit):
+        # предел внутри группы, например parallel у станции, поверх общего max_workers
+        with self._cond:
+            if limit is None:
+                self.limits.pop(group, None)
+            else:
+                self.limits[group] = max(1, int(limit))
+            self._cond.notify_all()
+
+    def submit(self, job):
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Job scheduler is shut down")
+            self._queued.append(job)
+            # потоки заводим по мере надобности, но не больше max_workers
+            if len(self._queued) > self._idle and len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f"job-worker-{len(self._workers) + 1}",
+                                          daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify_all()
+        self._emit(job, "queued")
+        return job
+
+    def cancel(self, job):
+        with self._cond:
+            queued = job in self._queued
+            if queued:
+                self._queued.remove(job)
+        if queued:
+            job.cancel()
+            self._finish(job, CANCELLED)
+        else:
+            job.cancel()
+
+    def cancel_port(self, port):
+        for job in self.jobs(port):
+            self.cancel(job)
+
+    def cancel_all(self):
+        for job in self.jobs():
+            self.cancel(job)
+
+    def jobs(self, port=None):
+        with self._cond:
+            jobs = self._queued + sorted(self._running, key=lambda job: job.id)
+        return [job for job in jobs if port is None or job.port == port]
+
+    def busy(self, port):
+        return bool(self.jobs(port))
+
+    def wait(self, jobs=None, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in jobs if jobs is not None else self.jobs():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not job.wait(remaining):
+                return False
+        return True
+
+    def shutdown(self, cancel=True, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if cancel:
+            self.cancel_all()
+        if wait:
+            for worker in list(self._workers):
+                worker.join()
+
+    def _runnable(self, job):
+        if job.lane in self._busy_lanes or len(self._running) >= self.max_workers:
+            return False
+        limit = self.limits.get(job.group)
+        return limit is None or self._group_running[job.group] < limit
+
+    def _next(self):
+        for job in sorted(self._queued, key=lambda job: (-job.priority, job.id)):
+            if self._runnable(job):
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+                job = self._next()
+                while job is None:
+                    if self._shutdown and not self._queued:
+                        self._idle -= 1
+                        return
+                    self._cond.wait()
+                    job = self._next()
+                self._idle -= 1
+                self._queued.remove(job)
+                self._running.add(job)
+                self._busy_lanes.add(job.lane)
+                self._group_running[job.group] += 1
+            self._run(job)
+            with self._cond:
+                self._running.discard(job)
+                self._busy_lanes.discard(job.lane)
+                self._group_running[job.group] -= 1
+                self._cond.notify_all()
+
+    def _run(self, job):
+        job.state = RUNNING
+        job.started = time.monotonic()
+        timer = None
+        if job.timeout:
+            timer = threading.Timer(job.timeout, job.cancel, kwargs={"timed_out": True})
+            timer.daemon = True
+            timer.start()
+        self._emit(job, "started")
+        try:
+            job.check()
+            job.result = job.target(job)
+            state = DONE
+        except JobCancelled as e:
+            job.error = e
+            state = TIMED_OUT if job.timed_out else CANCELLED
+        except (Exception, SystemExit) as e:
+            # esptool может позвать sys.exit: поток-работник и полоса порта от этого не умирают
+            job.error = e
+            state = FAILED
+        finally:
+            if timer is not None:
+                timer.cancel()
+        self._finish(job, state)
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = time.monotonic()
+        job._done.set()
+        self._emit(job, "finished")
+
+    def _emit(self, job, event):
+        if self.on_event is not None:
+            try:
+                self.on_event(job, event)
+            except Exception:
+                pass
+
+
+def default_scheduler():
+    # одна очередь на процесс: окна прошивки и станции не полезут в один порт одновременно
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
+
+
+def run_job(job, scheduler=None):
+    # для консоли: поставить задачу, дождаться; Ctrl+C отменяет ее, а не рвет процесс посреди записи
+    scheduler = scheduler or default_scheduler()
+    scheduler.submit(job)
+    try:
+        while not job.wait(0.2):
+            pass
+    except KeyboardInterrupt:
+        scheduler.cancel(job)
+        job.wait()
+    if job.state != DONE:
+        raise job.error if job.error is not None else JobCancelled("Cancelled")
+    return job.result
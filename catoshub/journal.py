@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+
+from esptool.util import FatalError
+
+from catoshub.baud import lower_baud
+from catoshub.images import CACHE_DIR
+from catoshub.partitions import BLOCK_SIZE, SECTOR_SIZE, flash_matches
+from catoshub.payload import Payload
+
+JOURNAL_DIR = os.path.join(CACHE_DIR, "journals")
+SAVE_EVERY = 0x10000
+RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+
+class FlashRefused(FatalError):
+    # повтор не поможет: чужой чип, Secure Boot, MD5 не сошелся после записи
+    pass
+
+
+class WriteJournal:
+    # сколько байт каждого региона стаб уже подтвердил; переживает падение процесса
+    def __init__(self, port, payloads, journal_dir=JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        self.path = os.path.join(journal_dir, re.sub(r"[^\w.-]", "_", port) + ".json")
+        # журнал от другого набора образов нам не подходит
+        ident = "".join(f"{payload.offset:x}:{payload.md5};" for payload in payloads)
+        self.key = hashlib.sha1(ident.encode()).hexdigest()
+        self.regions = {payload.offset: payload.size for payload in payloads}
+        self.acked = {}
+        self.done = set()
+        self._unsaved = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("key") != self.key:
+            return
+        self.acked = {int(offset): end for offset, end in data.get("acked", {}).items()}
+        self.done = set(data.get("done", []))
+
+    def save(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "key": self.key,
+                "acked": {str(offset): end for offset, end in self.acked.items()},
+                "done": sorted(self.done),
+            }, f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def region_for(self, address):
+        for offset, size in self.regions.items():
+            if offset <= address < offset + size:
+                return offset
+        raise ValueError(f"0x{address:x} is outside of the journaled images")
+
+    def track(self, payload, on_block=None):
+        # колбэк для write_payload: двигает отметку региона вслед за подтвержденными блоками
+        region = self.region_for(payload.offset)
+        self.acked[region] = payload.offset
+
+        def on_written(written):
+            self.acked[region] += written
+            self._unsaved += written
+            if self._unsaved >= SAVE_EVERY:
+                self.save()
+            if on_block is not None:
+                on_block(written)
+        return on_written
+
+    def complete(self, payload):
+        region = self.region_for(payload.offset)
+        self.acked[region] = region + self.regions[region]
+        self.done.add(region)
+        self.save()
+
+
+def _first_bad(esp, offset, data):
+    # первый блок по 64К, который не совпал; len(data), если все на месте
+    if flash_matches(esp, offset, data):
+        return len(data)
+    for start in range(0, len(data), BLOCK_SIZE):
+        if not flash_matches(esp, offset + start, data[start:start + BLOCK_SIZE]):
+            return start
+    return len(data)
+
+
+def resume_plan(esp, payloads, journal, log=print):
+    # что осталось дописать: целые образы или хвосты от первого несовпавшего блока
+    plan = []
+    for payload in payloads:
+        acked = journal.acked.get(payload.offset, payload.offset) - payload.offset
+        if payload.offset in journal.done and esp.flash_md5sum(payload.offset, payload.size) == payload.md5:
+            log(f"0x{payload.offset:x}: already written and verified, skipped")
+            continue
+        # последний подтвержденный блок мог не успеть записаться: проверяем до целого сектора ниже
+        acked -= acked % SECTOR_SIZE
+        if acked <= 0:
+            plan.append(payload)
+            continue
+        data = zlib.decompress(payload.compressed)
+        resume = _first_bad(esp, payload.offset, data[:acked])
+        if resume == 0:
+            plan.append(payload)
+            continue
+        log(f"0x{payload.offset:x}: {resume} of {payload.size} bytes already on flash, resuming at "
+            f"0x{payload.offset + resume:x}")
+        plan.append(Payload.from_data(payload.offset + resume, data[resume:]))
+    return plan
+
+
+def write_resumable(session, payloads, on_progress=None, retries=RETRIES, backoff=RETRY_BACKOFF):
+    # при обрыве: пауза, скорость ниже, переподключение и дозапись с места сбоя
+    journal = None
+    attempt = 0
+    while True:
+        try:
+            esp = session.ensure_open()
+            if journal is None:
+                # образы под флеш этой платы, его размер известен только после подключения
+                payloads = session.for_board(payloads)
+                journal = WriteJournal(session.port, payloads)
+                total = sum(payload.size for payload in payloads)
+            if journal.acked:
+                with session.trace.span("resume_plan"):
+                    plan = resume_plan(esp, payloads, journal, session.log)
+            else:
+                plan = payloads
+            if plan:
+                session.write(plan, on_progress, journal=journal)
+            if plan is not payloads:
+                # после дозаписи сверяем образы целиком, а не только хвосты
+                session.verify(payloads)
+            journal.clear()
+            return total
+        except FlashRefused:
+            session.close()
+            raise
+        except (FatalError, StopIteration, OSError) as e:
+            # таймауты, зависшая передача и битый SLIP в esptool - это FatalError, а иссякший
+            # читатель SLIP - StopIteration; обрыв порта - SerialException (OSError)
+            attempt += 1
+            failed_baud = session.current_baud
+            session.close()
+            if attempt > retries:
+                if isinstance(e, StopIteration):
+                    # StopIteration из write_resumable наружу не пускаем: у нее пустое сообщение
+                    raise FatalError(f"Write failed: {e!r}") from e
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            if failed_baud is not None:
+                session.baud = lower_baud(failed_baud)
+            session.log(f"Write failed ({str(e).strip() or repr(e)}), retry {attempt}/{retries} in {delay:g} s "
+                        f"at {session.baud} baud...")
+            time.sleep(delay)
@@ -0,0 +1,40 @@
+import json
+import os
+
+
+class JsonStore:
+    # словарь в JSON-файле кэша. Файл заменяется через tmp + os.replace, поэтому читатель не видит его
+    # наполовину записанным; само чтение-изменение-запись не заперто, и процессы станции, пишущие
+    # одновременно, могут потерять чужое изменение - для кэша это значит лишний опрос платы, не больше
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _prune(self, data):
+        pass
+
+    def _update(self, key, value):
+        # перечитываем перед записью, чтобы не затереть то, что другой процесс записал раньше
+        data = self.load()
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+            self._prune(data)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
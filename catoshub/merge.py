@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+
+from catoshub.images import CACHE_DIR
+from catoshub.partitions import PARTITION_TABLE_OFFSET, PartitionError, parse_partitions
+from catoshub.payload import FLASH_FREQ, FLASH_MODE, FLASH_SIZE
+
+MERGED_DIR = os.path.join(CACHE_DIR, "merged")
+# дыру больше этого не заливаем 0xFF: стирать лишнее дольше, чем лишний begin/end
+MAX_GAP = 0x10000
+# сколько последних релизов держать в кэше
+KEEP_RELEASES = 3
+# на релиз - по образу на каждый размер флеша, что встречался на станции (4, 8, 16 МБ)
+KEEP_IMAGES = KEEP_RELEASES * 3
+
+
+def _partitions(images):
+    for offset, data in images:
+        if offset == PARTITION_TABLE_OFFSET:
+            try:
+                return parse_partitions(bytes(data[:0xC00]))
+            except PartitionError:
+                return None
+    return None
+
+
+def _gap_is_free(start, end, partitions):
+    # в дыре не должно быть чужих разделов: иначе 0xFF сотрет, например, nvs
+    if partitions is None:
+        return start == end
+    return all(end <= partition.offset or start >= partition.offset + partition.size
+               for partition in partitions)
+
+
+def merge_segments(images):
+    # склеиваем соседние образы через свободные дыры; на выходе [(offset, bytes)]
+    images = sorted(images)
+    partitions = _partitions(images)
+    segments = []
+    for offset, data in images:
+        if segments:
+            last_offset, last_data = segments[-1]
+            end = last_offset + len(last_data)
+            if offset < end:
+                raise ValueError(f"Image at 0x{offset:x} overlaps the one at 0x{last_offset:x}")
+            if offset - end <= MAX_GAP and _gap_is_free(end, offset, partitions):
+                segments[-1] = (last_offset, last_data + b"\xff" * (offset - end) + bytes(data))
+                continue
+        segments.append((offset, bytes(data)))
+    return segments
+
+
+def content_key(images, flash_size=FLASH_SIZE):
+    digest = hashlib.sha256(f"{FLASH_MODE}:{FLASH_FREQ}:{flash_size};".encode())
+    for offset, data in sorted(images):
+        digest.update(f"{offset:x}:{hashlib.sha256(data).hexdigest()};".encode())
+    return digest.hexdigest()
+
+
+class MergedImage:
+    # один файл на релиз (от первого образа до конца последнего) + манифест с отрезками записи
+    def __init__(self, manifest, data):
+        self.manifest = manifest
+        self.data = data
+
+    @property
+    def segments(self):
+        base = self.manifest["base"]
+        view = memoryview(self.data)
+        return [(segment["offset"], view[segment["offset"] - base:segment["offset"] - base + segment["size"]])
+                for segment in self.manifest["segments"]]
+
+    def verify(self):
+        if hashlib.sha256(self.data).hexdigest() != self.manifest["sha256"]:
+            raise ValueError("Merged image does not match its manifest")
+
+    @classmethod
+    def build(cls, images, release=None, flash_size=FLASH_SIZE):
+        images = sorted(images)
+        segments = merge_segments(images)
+        base = segments[0][0]
+        end = segments[-1][0] + len(segments[-1][1])
+        data = bytearray(b"\xff" * (end - base))
+        for offset, chunk in segments:
+            data[offset - base:offset - base + len(chunk)] = chunk
+        data = bytes(data)
+        manifest = {
+            "key": content_key(images, flash_size),
+            "release": release,
+            "base": base,
+            "size": len(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "flash": {"mode": FLASH_MODE, "freq": FLASH_FREQ, "size": flash_size},
+            "images": [{"offset": offset, "size": len(chunk), "md5": hashlib.md5(chunk).hexdigest()}
+                       for offset, chunk in images],
+            "segments": [{"offset": offset, "size": len(chunk), "md5": hashlib.md5(chunk).hexdigest()}
+                         for offset, chunk in segments],
+        }
+        return cls(manifest, data)
+
+
+def _read_cached(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, key + ".json"), 'r') as f:
+            manifest = json.load(f)
+        with open(os.path.join(cache_dir, key + ".bin"), 'rb') as f:
+            merged = MergedImage(manifest, f.read())
+        merged.verify()
+    except (OSError, ValueError, KeyError):
+        return None
+    return merged
+
+
+def _write_cached(cache_dir, merged):
+    os.makedirs(cache_dir, exist_ok=True)
+    key = merged.manifest["key"]
+    # сначала образ, потом манифест: без манифеста кэш не считается готовым
+    for name, data, mode in ((key + ".bin", merged.data, 'wb'),
+                             (key + ".json", json.dumps(merged.manifest, indent=2), 'w')):
+        tmp_path = os.path.join(cache_dir, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(cache_dir, name))
+
+
+def _prune(cache_dir, keep=KEEP_IMAGES):
+    try:
+        manifests = [name for name in os.listdir(cache_dir) if name.endswith(".json")]
+    except OSError:
+        return
+    manifests.sort(key=lambda name: os.path.getmtime(os.path.join(cache_dir, name)), reverse=True)
+    for name in manifests[keep:]:
+        key = name[:-len(".json")]
+        for path in (key + ".json", key + ".bin"):
+            try:
+                os.remove(os.path.join(cache_dir, path))
+            except OSError:
+                pass
+
+
+def merged_image(images, release=None, cache_dir=MERGED_DIR, flash_size=FLASH_SIZE):
+    # кэш по хешу содержимого: тот же набор образов под другим тегом не собирается заново
+    key = content_key(images, flash_size)
+    merged = _read_cached(cache_dir, key)
+    if merged is not None and (release is None or merged.manifest.get("release") == release):
+        return merged
+    if merged is None:
+        merged = MergedImage.build(images, release, flash_size)
+    else:
+        merged.manifest["release"] = release
+    try:
+        _write_cached(cache_dir, merged)
+        _prune(cache_dir)
+    except OSError:
+        pass
+    return merged
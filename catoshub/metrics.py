@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from catoshub.trace import TRACE_PATH, TRANSFER_PHASES
+
+METRICS_PORT = 8782
+# окно для плат в час: считаем удачные прошивки за последний час
+WINDOW = 3600
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}" if labels else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class TraceMetrics:
+    # счетчики по traces.jsonl; файл читаем с места, где остановились, как tail -f
+    def __init__(self, path=TRACE_PATH, window=WINDOW):
+        self.path = path
+        self.window = window
+        self.lock = threading.Lock()
+        self._inode = None
+        self._offset = 0
+        self.jobs = Counter()
+        self.job_seconds = {}
+        self.phase_seconds = {}
+        self.phase_failures = Counter()
+        self.transfer_bytes = Counter()
+        self.transfer_seconds = Counter()
+        self.flashed = deque()
+
+    def update(self):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return
+        with f, self.lock:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                # файл ротировали: счетчики не сбрасываем, новый читаем с начала
+                self._inode = st.st_ino
+                self._offset = 0
+            f.seek(self._offset)
+            data = f.read()
+            # последняя строка могла быть дописана не до конца
+            end = data.rfind(b"\n") + 1
+            self._offset += end
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    self.add(record)
+
+    def add(self, record):
+        kind = record.get("kind") or "unknown"
+        if record.get("type") == "job":
+            ok = bool(record.get("ok"))
+            self.jobs[(kind, record.get("port") or "", "ok" if ok else "failed")] += 1
+            self.job_seconds.setdefault(kind, Histogram()).observe(record.get("seconds", 0.0))
+            if kind == "flash" and ok:
+                self.flashed.append(record.get("start", 0.0) + record.get("seconds", 0.0))
+        elif record.get("type") == "span":
+            phase = record.get("phase") or "unknown"
+            self.phase_seconds.setdefault((kind, phase), Histogram()).observe(record.get("seconds", 0.0))
+            if not record.get("ok", True):
+                self.phase_failures[(kind, phase)] += 1
+            elif phase in TRANSFER_PHASES and record.get("bytes"):
+                key = (kind, record.get("adapter") or "unknown")
+                self.transfer_bytes[key] += record["bytes"]
+                self.transfer_seconds[key] += record.get("seconds", 0.0)
+
+    def boards_per_hour(self, now=None):
+        now = time.time() if now is None else now
+        while self.flashed and self.flashed[0] < now - self.window:
+            self.flashed.popleft()
+        return len([end for end in self.flashed if end <= now]) * 3600 / self.window
+
+    def failure_rates(self):
+        # доля неудачных прошивок по портам
+        totals = Counter()
+        failed = Counter()
+        for (kind, port, result), count in self.jobs.items():
+            if kind != "flash":
+                continue
+            totals[port] += count
+            if result == "failed":
+                failed[port] += count
+        return {port: round(failed[port] / total, 4) for port, total in totals.items()}
+
+    def throughput(self, kind="flash"):
+        # байт/с по адаптерам: только время самих записей, без подключения и проверок
+        return {adapter: round(self.transfer_bytes[(k, adapter)] / seconds)
+                for (k, adapter), seconds in self.transfer_seconds.items() if k == kind and seconds > 0}
+
+    def summary(self, now=None):
+        with self.lock:
+            phases = []
+            for (kind, phase), histogram in self.phase_seconds.items():
+                phases.append({
+                    "kind": kind,
+                    "phase": phase,
+                    "count": histogram.count,
+                    "seconds": round(histogram.sum, 3),
+                    "mean": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+                    "failures": self.phase_failures[(kind, phase)],
+                })
+            # узкое место - фаза, на которую ушло больше всего времени
+            phases.sort(key=lambda row: row["seconds"], reverse=True)
+            jobs = Counter()
+            for (kind, _, result), count in self.jobs.items():
+                jobs[f"{kind}_{result}"] += count
+            return {
+                "jobs": dict(jobs),
+                "boards_per_hour": round(self.boards_per_hour(now), 1),
+                "failure_rate": self.failure_rates(),
+                "throughput_bytes_per_second": self.throughput(),
+                "phases": phases,
+            }
+
+    def render(self, now=None):
+        # текстовый формат Prometheus 0.0.4
+        with self.lock:
+            lines = []
+
+            def metric(name, kind, text):
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            metric("catoshub_jobs_total", "counter", "Finished download, erase and flash jobs.")
+            for (kind, port, result), count in sorted(self.jobs.items()):
+                lines.append(f"catoshub_jobs_total{_labels(kind=kind, port=port, result=result)} {count}")
+
+            metric("catoshub_job_duration_seconds", "histogram", "Wall time of a whole job.")
+            for kind, histogram in sorted(self.job_seconds.items()):
+                self._histogram(lines, "catoshub_job_duration_seconds", histogram, kind=kind)
+
+            metric("catoshub_phase_duration_seconds", "histogram", "Time spent in one phase of a job.")
+            for (kind, phase), histogram in sorted(self.phase_seconds.items()):
+                self._histogram(lines, "catoshub_phase_duration_seconds", histogram, kind=kind, phase=phase)
+
+            metric("catoshub_phase_failures_total", "counter", "Phases that ended with an error.")
+            for (kind, phase), count in sorted(self.phase_failures.items()):
+                lines.append(f"catoshub_phase_failures_total{_labels(kind=kind, phase=phase)} {count}")
+
+            metric("catoshub_transfer_bytes_total", "counter", "Bytes downloaded or written to flash.")
+            for (kind, adapter), count in sorted(self.transfer_bytes.items()):
+                lines.append(f"catoshub_transfer_bytes_total{_labels(kind=kind, adapter=adapter)} {count}")
+
+            metric("catoshub_transfer_seconds_total", "counter", "Time spent in download and write phases.")
+            for (kind, adapter), seconds in sorted(self.transfer_seconds.items()):
+                lines.append(f"catoshub_transfer_seconds_total{_labels(kind=kind, adapter=adapter)} "
+                             f"{_number(round(seconds, 4))}")
+
+            metric("catoshub_boards_per_hour", "gauge", "Boards flashed successfully in the last hour.")
+            lines.append(f"catoshub_boards_per_hour {_number(round(self.boards_per_hour(now), 1))}")
+
+            metric("catoshub_port_failure_ratio", "gauge", "Failed flash jobs divided by all flash jobs per port.")
+            for port, ratio in sorted(self.failure_rates().items()):
+                lines.append(f"catoshub_port_failure_ratio{_labels(port=port)} {_number(float(ratio))}")
+
+            metric("catoshub_adapter_throughput_bytes_per_second", "gauge",
+                   "Flash write throughput per USB adapter model.")
+            for adapter, rate in sorted(self.throughput().items()):
+                lines.append(f"catoshub_adapter_throughput_bytes_per_second{_labels(adapter=adapter)} {rate}")
+            return "\n".join(lines) + "\n"
+
+    def _histogram(self, lines, name, histogram, **labels):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f"{name}_bucket{_labels(**labels, le=_number(float(bound)))} {count}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {_number(round(histogram.sum, 4))}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server_version = "CatOs-Hub-Metrics"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        self.server.metrics.update()
+        if path == "/metrics":
+            data = self.server.metrics.render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            data = json.dumps(self.server.metrics.summary()).encode()
+            content_type = "application/json"
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    # /metrics для Prometheus и /metrics.json для людей; данные - traces.jsonl этой станции
+    daemon_threads = True
+
+    def __init__(self, path=TRACE_PATH, host="127.0.0.1", port=METRICS_PORT, window=WINDOW):
+        self.metrics = TraceMetrics(path, window)
+        super().__init__((host, port), MetricsHandler)
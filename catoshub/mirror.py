@@ -0,0 +1,191 @@
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from catoshub.download import CHUNK_SIZE
+from catoshub.release import FIRMWARE_ASSET, ReleaseCache
+
+MIRROR_PORT = 8780
+RELEASE_PATH = "/release.json"
+FIRMWARE_PATH = "/" + FIRMWARE_ASSET
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class _Snapshot:
+    # проверенный firmware.bin: хеш считаем один раз на версию файла
+    def __init__(self, tag, size, mtime, sha256):
+        self.tag = tag
+        self.size = size
+        self.mtime = mtime
+        self.sha256 = sha256
+        self.etag = f'"{sha256}"'
+        self.last_modified = email.utils.formatdate(mtime, usegmt=True)
+
+
+class MirrorState:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, FIRMWARE_ASSET)
+        self.lock = threading.Lock()
+        self._key = None
+        self._snapshot = None
+
+    def snapshot(self, f):
+        # по открытому файлу: если образ подменили через os.replace, отдаем тот, что уже открыт
+        st = os.fstat(f.fileno())
+        cache = ReleaseCache(self.cache_dir)
+        tag = cache.current_tag()
+        key = (st.st_ino, st.st_size, st.st_mtime_ns, tag)
+        with self.lock:
+            if key == self._key:
+                return self._snapshot
+        digest = hashlib.sha256()
+        f.seek(0)
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+        f.seek(0)
+        sha256 = digest.hexdigest()
+        release = cache.load().get("release") or {}
+        if tag is None or (release.get("tag") == tag and release.get("firmware_sha256") not in (None, sha256)):
+            # не тот образ, что в релизе: лучше отправить станции на GitHub
+            snapshot = None
+        else:
+            snapshot = _Snapshot(tag, st.st_size, int(st.st_mtime), sha256)
+        with self.lock:
+            self._key = key
+            self._snapshot = snapshot
+        return snapshot
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    server_version = "CatOs-Hub-Mirror"
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def log_message(self, format, *args):
+        if self.server.log is not None:
+            self.server.log(f"{self.client_address[0]} {format % args}")
+
+    def _serve(self, body):
+        path = self.path.split("?", 1)[0]
+        if path not in (RELEASE_PATH, FIRMWARE_PATH):
+            return self._empty(404)
+        try:
+            f = open(self.server.state.path, 'rb')
+        except OSError:
+            return self._empty(404)
+        with f:
+            snapshot = self.server.state.snapshot(f)
+            if snapshot is None:
+                return self._empty(404)
+            if self._not_modified(snapshot):
+                return self._empty(304, snapshot)
+            if path == RELEASE_PATH:
+                data = json.dumps({
+                    "tag": snapshot.tag,
+                    "firmware_url": FIRMWARE_ASSET,
+                    "firmware_size": snapshot.size,
+                    "firmware_sha256": snapshot.sha256,
+                }).encode()
+                self._headers(200, snapshot, len(data), "application/json")
+                if body:
+                    self.wfile.write(data)
+                return
+            self._send_file(f, snapshot, body)
+
+    def _not_modified(self, snapshot):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or snapshot.etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return snapshot.mtime <= since
+        return False
+
+    def _byte_range(self, snapshot):
+        # один диапазон; несколько или If-Range от другой версии - отдаем файл целиком
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range.strip() not in (snapshot.etag, snapshot.last_modified):
+            return None
+        match = RANGE.match(header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), snapshot.size - 1) if match.group(2) else snapshot.size - 1
+        else:
+            start = max(0, snapshot.size - int(match.group(2)))
+            end = snapshot.size - 1
+        return start, end
+
+    def _send_file(self, f, snapshot, body):
+        byte_range = self._byte_range(snapshot)
+        if byte_range is None:
+            start, end, status = 0, snapshot.size - 1, 200
+        else:
+            start, end = byte_range
+            if start >= snapshot.size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{snapshot.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        length = end - start + 1
+        self._headers(status, snapshot, length, "application/octet-stream",
+                      f"bytes {start}-{end}/{snapshot.size}" if status == 206 else None)
+        if not body:
+            return
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            length -= len(chunk)
+
+    def _headers(self, status, snapshot, length, content_type, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", snapshot.etag)
+        self.send_header("Last-Modified", snapshot.last_modified)
+        self.send_header("Cache-Control", "no-cache")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def _empty(self, status, snapshot=None):
+        self.send_response(status)
+        if snapshot is not None:
+            self.send_header("ETag", snapshot.etag)
+            self.send_header("Last-Modified", snapshot.last_modified)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class MirrorServer(ThreadingHTTPServer):
+    # раздает проверенный кэш прошивки остальным станциям в сети
+    daemon_threads = True
+
+    def __init__(self, cache_dir, host="0.0.0.0", port=MIRROR_PORT, log=None):
+        self.state = MirrorState(cache_dir)
+        self.log = log
+        super().__init__((host, port), MirrorHandler)
@@ -0,0 +1,104 @@
+import hashlib
+import struct
+from collections import namedtuple
+
+from catoshub.images import FLASH_FILES
+
+PARTITION_TABLE_OFFSET = 0x8000
+PARTITION_TABLE_SIZE = 0xC00
+ENTRY = struct.Struct("<2sBBII16sI")
+ENTRY_MAGIC = b"\xaa\x50"
+MD5_MAGIC = b"\xeb\xeb"
+SECTOR_SIZE = 0x1000
+BLOCK_SIZE = 0x10000
+
+Partition = namedtuple("Partition", ["name", "type", "subtype", "offset", "size"])
+
+
+class PartitionError(Exception):
+    pass
+
+
+def parse_partitions(data):
+    partitions = []
+    for pos in range(0, len(data) - ENTRY.size + 1, ENTRY.size):
+        entry = data[pos:pos + ENTRY.size]
+        if entry[:2] != ENTRY_MAGIC:
+            # дальше идет MD5 таблицы или 0xFF
+            if entry[:2] not in (MD5_MAGIC, b"\xff\xff"):
+                raise PartitionError(f"Bad partition table entry at +0x{pos:x}")
+            break
+        _, ptype, subtype, offset, size, name, _ = ENTRY.unpack(entry)
+        partitions.append(Partition(name.split(b"\0", 1)[0].decode(errors="replace"), ptype, subtype, offset, size))
+    if not partitions:
+        raise PartitionError("Partition table is empty")
+    return partitions
+
+
+def table_path(flash_files=FLASH_FILES):
+    for file_info in flash_files:
+        if int(file_info["offset"], 0) == PARTITION_TABLE_OFFSET:
+            return file_info["path"]
+    return None
+
+
+def load_partitions(path=None):
+    path = path or table_path()
+    if path is None:
+        raise PartitionError("No partition table in the flash file list")
+    try:
+        with open(path, 'rb') as f:
+            return parse_partitions(f.read(PARTITION_TABLE_SIZE))
+    except OSError as e:
+        raise PartitionError(f"Can't read {path}: {e.strerror}")
+
+
+def read_partitions(esp):
+    return parse_partitions(esp.read_flash(PARTITION_TABLE_OFFSET, PARTITION_TABLE_SIZE))
+
+
+def select_partitions(partitions, names):
+    by_name = {partition.name: partition for partition in partitions}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise PartitionError(f"Unknown partitions: {', '.join(unknown)} (have: {', '.join(by_name)})")
+    return [by_name[name] for name in names]
+
+
+def sector_range(partition):
+    # erase_region принимает только целые сектора, а расширять раздел нельзя: заденем соседний
+    if partition.offset % SECTOR_SIZE or partition.size % SECTOR_SIZE:
+        raise PartitionError(f"{partition.name} (0x{partition.offset:x}, {partition.size} bytes) "
+                             f"is not aligned to 0x{SECTOR_SIZE:x}-byte sectors")
+    return partition.offset, partition.size
+
+
+_blank_md5 = {}
+
+
+def blank_md5(size):
+    if size not in _blank_md5:
+        _blank_md5[size] = hashlib.md5(b"\xff" * size).hexdigest()
+    return _blank_md5[size]
+
+
+def flash_matches(esp, offset, data):
+    # MD5 считает чип: сравнение без чтения флеша по UART
+    return esp.flash_md5sum(offset, len(data)) == hashlib.md5(data).hexdigest()
+
+
+def dirty_ranges(esp, offset, size):
+    # как в diff.changed_ranges: сначала весь диапазон, потом блоки по 64К, соседние склеиваем
+    if esp.flash_md5sum(offset, size) == blank_md5(size):
+        return []
+
+    ranges = []
+    for start in range(offset, offset + size, BLOCK_SIZE):
+        length = min(BLOCK_SIZE, offset + size - start)
+        if esp.flash_md5sum(start, length) == blank_md5(length):
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == start:
+            ranges[-1][1] += length
+        else:
+            ranges.append([start, length])
+    return [tuple(r) for r in ranges]
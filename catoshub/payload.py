@@ -0,0 +1,109 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+from esptool.cmds import _update_image_flash_params
+from esptool.targets import ESP32ROM
+
+from catoshub.images import CACHE_DIR
+
+ZCACHE_DIR = os.path.join(CACHE_DIR, "zcache")
+
+CHIP = "esp32"
+FLASH_MODE = "dio"
+FLASH_FREQ = "80m"
+# размер по умолчанию; у конкретной платы он берется из ее отпечатка (fingerprint.py)
+FLASH_SIZE = "4MB"
+# сжатых образов на диске: файлы и склеенные отрезки нескольких релизов под 4, 8 и 16 МБ
+KEEP_PAYLOADS = 64
+# в памяти процесса меньше: каждый держит сжатый образ целиком
+MAX_MEMO = 16
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+class Payload:
+    def __init__(self, offset, size, md5, compressed):
+        self.offset = offset
+        self.size = size
+        self.md5 = md5
+        self.compressed = compressed
+
+    @classmethod
+    def from_data(cls, offset, data):
+        return cls(offset, len(data), hashlib.md5(data).hexdigest(), zlib.compress(data, 9))
+
+
+def prepare_image(offset, data, flash_size=FLASH_SIZE):
+    # то же, что делает write_flash: выравнивание и параметры флеша в заголовке бутлоадера;
+    # копия появляется только если образ надо менять
+    if len(data) % 4:
+        data = bytes(data) + b"\xff" * (4 - len(data) % 4)
+    args = argparse.Namespace(chip=CHIP, flash_mode=FLASH_MODE, flash_freq=FLASH_FREQ, flash_size=flash_size)
+    return _update_image_flash_params(ESP32ROM, offset, args, data)
+
+
+def _load_cached(cache_dir, key, offset):
+    try:
+        with open(os.path.join(cache_dir, key + ".json"), 'r') as f:
+            meta = json.load(f)
+        with open(os.path.join(cache_dir, key + ".z"), 'rb') as f:
+            compressed = f.read()
+    except (OSError, ValueError):
+        return None
+    if len(compressed) != meta.get("zsize"):
+        return None
+    return Payload(offset, meta["size"], meta["md5"], compressed)
+
+
+def _store(cache_dir, key, payload):
+    os.makedirs(cache_dir, exist_ok=True)
+    # сначала данные, потом мета: без меты кэш не считается готовым
+    for name, data, mode in ((key + ".z", payload.compressed, 'wb'),
+                             (key + ".json", json.dumps({"size": payload.size, "md5": payload.md5,
+                                                         "zsize": len(payload.compressed)}), 'w')):
+        tmp_path = os.path.join(cache_dir, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, mode) as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(cache_dir, name))
+
+
+def _prune(cache_dir, keep=KEEP_PAYLOADS):
+    # как merge._prune: оставляем самые свежие, старые релизы уходят сами
+    try:
+        metas = [name for name in os.listdir(cache_dir) if name.endswith(".json")]
+    except OSError:
+        return
+    metas.sort(key=lambda name: os.path.getmtime(os.path.join(cache_dir, name)), reverse=True)
+    for name in metas[keep:]:
+        key = name[:-len(".json")]
+        for path in (key + ".json", key + ".z"):
+            try:
+                os.remove(os.path.join(cache_dir, path))
+            except OSError:
+                pass
+
+
+def payload_for(offset, data, cache_dir=ZCACHE_DIR):
+    key = hashlib.sha256(data).hexdigest()
+    with _memo_lock:
+        payload = _memo.get(key)
+    if payload is None:
+        payload = _load_cached(cache_dir, key, offset)
+        if payload is None:
+            payload = Payload.from_data(offset, data)
+            _store(cache_dir, key, payload)
+            _prune(cache_dir)
+        with _memo_lock:
+            _memo[key] = payload
+            while len(_memo) > MAX_MEMO:
+                # словарь помнит порядок вставки: выкидываем самый старый
+                del _memo[next(iter(_memo))]
+    if payload.offset != offset:
+        payload = Payload(offset, payload.size, payload.md5, payload.compressed)
+    return payload
+
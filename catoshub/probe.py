@@ -0,0 +1,168 @@
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+PROBE_TIMEOUT = 3.0
+MAX_PROBES = 16
+APP_OFFSET = 0x10000
+# заголовок образа (24 байта) + заголовок первого сегмента (8), дальше esp_app_desc_t
+APP_DESC_OFFSET = 0x20
+APP_DESC_MAGIC = 0xABCD5432
+APP_DESC = struct.Struct("<II8x32s32s")
+
+
+def parse_app_desc(data):
+    # data - начало образа приложения (во флеше с 0x10000 или firmware.bin)
+    if len(data) < APP_DESC_OFFSET + APP_DESC.size:
+        return None
+    magic, _, version, project = APP_DESC.unpack_from(data, APP_DESC_OFFSET)
+    if magic != APP_DESC_MAGIC:
+        return None
+    return {
+        "version": version.split(b"\0", 1)[0].decode(errors="replace"),
+        "project": project.split(b"\0", 1)[0].decode(errors="replace"),
+    }
+
+
+def _app_version(esp):
+    return parse_app_desc(esp.read_flash_slow(APP_OFFSET, APP_DESC_OFFSET + APP_DESC.size, None))
+
+
+def _open_port(port):
+    import serial
+
+    # порт открываем сами, как это делает esptool: сторожу нужен объект, который можно закрыть
+    link = serial.serial_for_url(port, exclusive=True, do_not_open=True)
+    if sys.platform == "win32":
+        link.rts = False
+        link.dtr = False
+    link.open()
+    return link
+
+
+def probe_port(port, timeout=PROBE_TIMEOUT):
+    # esptool тянем только когда реально пробуем порт, GUI стартует без него
+    from esptool.cmds import detect_chip
+    from esptool.loader import ESPLoader
+
+    from catoshub.fingerprint import identify
+
+    link = _open_port(port)
+    expired = threading.Event()
+
+    def expire():
+        # срок вышел: будим зависшее чтение и закрываем порт, esptool падает вместо долгих ретраев
+        expired.set()
+        link.cancel_read()
+        link.close()
+
+    watchdog = threading.Timer(timeout, expire)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        # одна попытка синхронизации с загрузчиком, только ROM: стаб заливать долго
+        esp = detect_chip(link, ESPLoader.ESP_ROM_BAUD, "default_reset", connect_attempts=1)
+        # знакомую плату не опрашиваем: чип, флеш и MAC берем из ее отпечатка, он же нужен прошивке
+        fingerprint = identify(esp, port)
+        result = {
+            "chip": esp.CHIP_NAME,
+            "description": fingerprint["description"],
+            "mac": fingerprint["mac"],
+            "flash_size": fingerprint["flash_size"],
+            "version": None,
+        }
+        esp.flash_spi_attach(0)
+        app = _app_version(esp)
+        if app is not None:
+            result["version"] = app["version"]
+        esp.hard_reset()
+        return result
+    except Exception:
+        if expired.is_set():
+            raise TimeoutError("Timed out")
+        raise
+    finally:
+        watchdog.cancel()
+        link.close()
+
+
+class ProbeCache:
+    # результат живет, пока плату не выдернули: ключ - порт и серийник USB
+    def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(info):
+        return info["device"], info.get("serial_number")
+
+    def get(self, info):
+        with self.lock:
+            return self.results.get(self.key(info))
+
+    def put(self, info, result):
+        with self.lock:
+            self.results[self.key(info)] = result
+
+    def invalidate(self, device):
+        with self.lock:
+            for key in [key for key in self.results if key[0] == device]:
+                del self.results[key]
+
+
+def probe_ports(infos, on_result, cache=None, timeout=PROBE_TIMEOUT, usb_only=True):
+    # on_result(device, result) зовется из рабочих потоков по мере готовности
+    todo = []
+    for info in infos:
+        if usb_only and info.get("vid") is None:
+            continue
+        cached = cache.get(info) if cache is not None else None
+        if cached is not None:
+            on_result(info["device"], cached)
+        else:
+            todo.append(info)
+    if not todo:
+        return
+
+    # о каждом порте сообщаем один раз: либо проба, либо "Timed out" по общему сроку
+    reported = set()
+    lock = threading.Lock()
+
+    def report(device, result):
+        with lock:
+            if device in reported:
+                return
+            reported.add(device)
+        on_result(device, result)
+
+    def run(info):
+        try:
+            result = probe_port(info["device"], timeout)
+        except Exception as e:
+            result = {"error": str(e).strip() or type(e).__name__}
+        else:
+            if cache is not None:
+                cache.put(info, result)
+        report(info["device"], result)
+
+    executor = ThreadPoolExecutor(max_workers=min(len(todo), MAX_PROBES))
+    futures = {executor.submit(run, info): info for info in todo}
+    _, not_done = wait(futures, timeout)
+    for future in not_done:
+        future.cancel()
+        report(futures[future]["device"], {"error": "Timed out"})
+    # "Timed out" уже сообщили, но порт (открыт с exclusive) отдаем только после того, как сторож пробы
+    # его закроет - иначе окно прошивки может не открыть порт, который еще держит проба
+    executor.shutdown(wait=True)
+
+
+def describe_probe(result):
+    if not result or "error" in result:
+        return ""
+    parts = [result["chip"]]
+    if result.get("flash_size"):
+        parts.append(result["flash_size"])
+    if result.get("version"):
+        parts.append(f"CatOs {result['version']}")
+    return " ".join(parts)
@@ -0,0 +1,55 @@
+import time
+
+
+class FlashProgress:
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+        self.region = None
+        self.region_size = 0
+        self.region_done = 0
+        self.started = None
+
+    def start_region(self, offset, size):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.region = offset
+        self.region_size = size
+        self.region_done = 0
+        self._notify()
+
+    def add(self, written):
+        self.done += written
+        self.region_done += written
+        self._notify()
+
+    def snapshot(self):
+        # скорость считаем по несжатым байтам, как "effective" у esptool
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        kbps = self.done * 8 / elapsed / 1000 if elapsed > 0 else 0.0
+        eta = (self.total - self.done) * 8 / 1000 / kbps if kbps else None
+        return {
+            "region": self.region,
+            "region_done": self.region_done,
+            "region_size": self.region_size,
+            "done": self.done,
+            "total": self.total,
+            "percent": min(100, self.done * 100 // self.total) if self.total else 0,
+            "elapsed": elapsed,
+            "kbps": kbps,
+            "eta": eta,
+        }
+
+    def _notify(self):
+        if self.callback is not None:
+            self.callback(self.snapshot())
+
+
+def format_progress(state):
+    text = f"{state['percent']}%"
+    if state['kbps']:
+        text += f" {state['kbps']:.0f} kbit/s"
+    if state['eta'] is not None and state['percent'] < 100:
+        text += f" ETA {state['eta']:.0f}s"
+    return text
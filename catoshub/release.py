@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+from urllib.parse import urljoin
+
+import requests
+
+from catoshub.delta import DeltaError, download_delta
+from catoshub.download import CHUNK_SIZE, DownloadError, download_file, make_session
+from catoshub.trace import NULL_TRACE
+
+REPO_OWNER = "CatDevCode"
+REPO_NAME = "CatOs"
+# CATOSHUB_API_URL подменяет GitHub, например на tools/fake_github.py
+API_URL = os.environ.get("CATOSHUB_API_URL", "https://api.github.com")
+# зеркало в той же сети отвечает быстро; долго ждать его незачем
+MIRROR_TIMEOUT = 5
+FIRMWARE_ASSET = "firmware.bin"
+# патч от релиза TAG к этому: firmware-TAG.delta
+DELTA_PREFIX = "firmware-"
+DELTA_SUFFIX = ".delta"
+RELEASE_CACHE_FILE = "release_cache.json"
+RELEASE_TAG_FILE = "current_release.txt"
+
+
+class ReleaseError(Exception):
+    pass
+
+
+class ReleaseCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, RELEASE_CACHE_FILE)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, data):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def current_tag(self):
+        try:
+            with open(os.path.join(self.cache_dir, RELEASE_TAG_FILE), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def set_current_tag(self, tag):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, RELEASE_TAG_FILE), 'w') as f:
+            f.write(tag)
+
+
+def _release_info(release_data):
+    info = {"tag": release_data['tag_name'], "firmware_url": None, "firmware_size": None,
+            "firmware_sha256": None, "deltas": {}}
+    for asset in release_data.get('assets', []):
+        name = asset['name']
+        if name == FIRMWARE_ASSET:
+            info["firmware_url"] = asset['browser_download_url']
+            info["firmware_size"] = asset.get('size')
+            # GitHub отдает "sha256:<hex>" для каждого ассета
+            digest = asset.get('digest') or ""
+            if digest.startswith("sha256:"):
+                info["firmware_sha256"] = digest[len("sha256:"):]
+        elif name.startswith(DELTA_PREFIX) and name.endswith(DELTA_SUFFIX):
+            info["deltas"][name[len(DELTA_PREFIX):-len(DELTA_SUFFIX)]] = {
+                "url": asset['browser_download_url'],
+                "size": asset.get('size'),
+            }
+    return info
+
+
+def _rate_limited(response):
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and response.headers.get('X-RateLimit-Remaining') == '0'
+
+
+def latest_release(repo_owner, repo_name, cache_dir, session=None):
+    # возвращает (info, source): source = "github", "not-modified" или "cache"
+    cache = ReleaseCache(cache_dir)
+    cached = cache.load()
+    http = session or requests
+
+    headers = {"Accept": "application/vnd.github+json"}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    url = f"{API_URL}/repos/{repo_owner}/{repo_name}/releases/latest"
+    try:
+        response = http.get(url, headers=headers, timeout=15)
+    except requests.RequestException as e:
+        if cached.get("release"):
+            return cached["release"], "cache"
+        raise ReleaseError(f"GitHub is unreachable: {str(e)}")
+
+    # 304 не тратит лимит запросов
+    if response.status_code == 304 and cached.get("release"):
+        return cached["release"], "not-modified"
+
+    if response.status_code != 200:
+        if cached.get("release") and (_rate_limited(response) or response.status_code >= 500):
+            return cached["release"], "cache"
+        raise ReleaseError(f"Ошибка при получении информации о релизе: {response.status_code}")
+
+    info = _release_info(response.json())
+    cache.save({
+        "etag": response.headers.get('ETag'),
+        "last_modified": response.headers.get('Last-Modified'),
+        "release": info,
+    })
+    return info, "github"
+
+
+def _patch_firmware(session, release, current_tag, firmware_path, on_progress):
+    # True, если прошивку удалось собрать из старой и патча; иначе качаем целиком
+    delta = release.get("deltas", {}).get(current_tag) if current_tag else None
+    if delta is None or not os.path.exists(firmware_path):
+        return False
+    try:
+        download_delta(session, delta["url"], delta.get("size"), firmware_path, firmware_path,
+                       release.get("firmware_sha256"), on_progress)
+    except (DeltaError, OSError):
+        return False
+    return True
+
+
+def mirror_release(mirror, session=None):
+    # релиз, который раздает зеркало в локальной сети (python -m catoshub serve-mirror)
+    http = session or requests
+    url = mirror.rstrip("/") + "/release.json"
+    response = http.get(url, timeout=MIRROR_TIMEOUT)
+    if response.status_code != 200:
+        raise ReleaseError(f"Mirror has no firmware: HTTP {response.status_code}")
+    info = response.json()
+    info["firmware_url"] = urljoin(url, info["firmware_url"])
+    info.setdefault("deltas", {})
+    return info
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _install(session, release, source, cache_dir, on_progress, trace=NULL_TRACE):
+    release_tag = release['tag']
+    firmware_url = release['firmware_url']
+    if not firmware_url:
+        raise ReleaseError("Файл firmware.bin не найден в релизе")
+
+    cache = ReleaseCache(cache_dir)
+    firmware_path = os.path.join(cache_dir, FIRMWARE_ASSET)
+
+    # тот же тег и файл на месте - качать нечего
+    if cache.current_tag() == release_tag and os.path.exists(firmware_path):
+        return release_tag, "cached" if source == "cache" else "up-to-date"
+    if source == "cache" and cache.current_tag() and os.path.exists(firmware_path):
+        # GitHub не ответил, а в кэше другой тег: свежее он или старее, не знаем - стоящую прошивку не трогаем
+        return cache.current_tag(), "cached"
+
+    patched = False
+    delta = release.get("deltas", {}).get(cache.current_tag())
+    if delta is not None:
+        with trace.span("delta", source=source) as attrs:
+            patched = _patch_firmware(session, release, cache.current_tag(), firmware_path, on_progress)
+            attrs["patched"] = patched
+            attrs["bytes"] = (delta.get("size") or 0) if patched else 0
+    if patched:
+        cache.set_current_tag(release_tag)
+        return release_tag, "patched"
+
+    os.makedirs(cache_dir, exist_ok=True)
+    new_path = firmware_path + ".new"
+    with trace.span("download", source=source) as attrs:
+        download_file(session, firmware_url, new_path, on_progress)
+        attrs["bytes"] = os.path.getsize(new_path)
+    if release.get("firmware_sha256"):
+        with trace.span("verify"):
+            if _sha256(new_path) != release["firmware_sha256"]:
+                os.remove(new_path)
+                raise DownloadError("Downloaded firmware does not match the release hash")
+    os.replace(new_path, firmware_path)
+
+    # сохраняем инфу только после удачной загрузки
+    cache.set_current_tag(release_tag)
+    return release_tag, "mirrored" if source == "mirror" else "downloaded"
+
+
+def _remember_release(cache_dir, release):
+    # релиз с зеркала записываем и в кэш релизов, иначе при лимите GitHub кэш вернет старый тег.
+    # ETag GitHub относится к прежнему релизу: сбрасываем, чтобы следующий запрос пришел целиком
+    cache = ReleaseCache(cache_dir)
+    if cache.load().get("release", {}).get("tag") != release["tag"]:
+        cache.save({"etag": None, "last_modified": None, "release": release})
+
+
+def update_firmware(repo_owner, repo_name, cache_dir, on_progress=None, session=None, mirror=None,
+                    trace=NULL_TRACE):
+    # возвращает (tag, status): status = "downloaded", "mirrored", "patched", "up-to-date" или "cached"
+    session = session or make_session()
+    if mirror:
+        # сначала зеркало в локальной сети; нет его или образа - идем на GitHub
+        try:
+            with trace.span("release", source="mirror"):
+                release = mirror_release(mirror, session)
+            tag, status = _install(session, release, "mirror", cache_dir, on_progress, trace)
+            _remember_release(cache_dir, release)
+            return tag, status
+        except (ReleaseError, DownloadError, requests.RequestException, OSError, ValueError, KeyError):
+            # недокачанное с зеркала не докачиваем с GitHub: там может быть другой образ
+            part_path = os.path.join(cache_dir, FIRMWARE_ASSET) + ".new.part"
+            for path in (part_path, part_path + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+    with trace.span("release", source="github") as attrs:
+        release, source = latest_release(repo_owner, repo_name, cache_dir, session)
+        attrs["source"] = source
+    return _install(session, release, source, cache_dir, on_progress, trace)
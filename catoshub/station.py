@@ -0,0 +1,197 @@
+import multiprocessing
+import queue
+import sys
+import zlib
+
+from catoshub.baud import DEFAULT_BAUD
+from catoshub.bootcheck import BootCheckError, expected_version
+from catoshub.console import LineWriter
+from catoshub.images import missing_files
+from catoshub.imageset import board_payloads, load_image_set
+from catoshub.jobs import CANCELLED, DONE, FAILED, TIMED_OUT, Job, JobScheduler
+from catoshub.trace import JobTrace
+
+
+def _flash_worker(port, shared, events, incremental=False, baud=DEFAULT_BAUD, boot_check=False,
+                  boot_version=None, flash_files=None):
+    # отдельный процесс на порт: esptool держит глобальное состояние и зовет sys.exit
+    writer = LineWriter(lambda line: events.put((port, "log", line)))
+    sys.stdout = writer
+    sys.stderr = writer
+
+    def on_progress(state):
+        events.put((port, "progress", state))
+
+    trace = JobTrace("flash", port)
+    try:
+        # образы под флеш по умолчанию уже сжаты родителем и лежат в общей памяти;
+        # плата с другим размером флеша (по отпечатку) получает свой набор из файлов и zcache
+        payloads = board_payloads(flash_files, shared)
+        if incremental:
+            from catoshub.diff import flash_incremental
+
+            def images(flash_size):
+                return [(payload.offset, zlib.decompress(payload.compressed)) for payload in payloads(flash_size)]
+
+            written, total = flash_incremental(port, images, print, on_progress, baud, boot_check, boot_version,
+                                               trace)
+            result = (True, f"ESP32 has been successfully stitched! ({written} of {total} bytes rewritten)")
+        else:
+            from catoshub.device import flash_payloads
+
+            flash_payloads(port, payloads, print, on_progress, baud, boot_check, boot_version, trace)
+            result = (True, "ESP32 has been successfully stitched!")
+        if boot_check:
+            result = (True, result[1] + " CatOs booted.")
+    except BootCheckError as e:
+        result = (False, f"Boot check failed: {str(e)}")
+    except SystemExit as e:
+        result = (False, f"Firmware error ({e.code})")
+    except Exception as e:
+        result = (False, f"Error when calling esptool: {str(e)}")
+    writer.write("\n")
+    events.put((port, "trace", trace.finish(*result)))
+    events.put((port, "done", result))
+
+
+class FlashStation:
+    def __init__(self, ports, flash_files, max_parallel=4, incremental=False, baud=DEFAULT_BAUD,
+                 continuous=False, boot_check=False, scheduler=None, timeout=None, priority=0):
+        self.ports = list(ports)
+        self.flash_files = flash_files
+        self.max_parallel = max(1, int(max_parallel))
+        self.incremental = incremental
+        self.baud = baud
+        # continuous: не выходить, когда очередь пуста, а ждать новых плат через add_port
+        self.continuous = continuous
+        # boot_check: после прошивки дождаться баннера CatOs нужной версии
+        self.boot_check = boot_check
+        # задачи идут через общую очередь: порт, занятый окном прошивки, станция подождет
+        self.scheduler = scheduler or JobScheduler(self.max_parallel)
+        self.group = f"station-{id(self)}"
+        self.scheduler.set_limit(self.group, self.max_parallel)
+        # timeout на одну плату, секунды; None - без ограничения
+        self.timeout = timeout
+        self.priority = priority
+        self.results = {}
+        self.jobs = {}
+        self._incoming = queue.Queue()
+        self._stopped = False
+
+    def add_port(self, port):
+        self._incoming.put(port)
+
+    def finish(self):
+        self.continuous = False
+
+    def stop(self):
+        self._stopped = True
+        for job in list(self.jobs.values()):
+            self.scheduler.cancel(job)
+
+    def cancel(self, port):
+        job = self.jobs.get(port)
+        if job is not None:
+            self.scheduler.cancel(job)
+
+    def run(self, on_event):
+        missing = missing_files(self.flash_files)
+        if missing:
+            message = "Missing files for the firmware:\n" + "\n".join(missing)
+            for port in self.ports:
+                self.results[port] = (False, message)
+                on_event(port, "done", (False, message))
+            return self.results
+
+        # читаем и сжимаем образы один раз, воркеры получают их через общую память
+        shared = load_image_set(self.flash_files).share()
+        version = expected_version(self.flash_files) if self.boot_check else None
+        try:
+            return self._run(on_event, shared, version)
+        finally:
+            self.scheduler.set_limit(self.group, None)
+            shared.close()
+            shared.unlink()
+
+    def _job(self, ctx, events, shared, version):
+        # задача очереди: отдельный процесс на плату, события идут в общий events
+        def flash(job):
+            port = job.port
+            proc = ctx.Process(target=_flash_worker,
+                               args=(port, shared, events, self.incremental, self.baud, self.boot_check, version,
+                                     self.flash_files),
+                               daemon=True)
+            job.check()
+            proc.start()
+            job.on_cancel(proc.terminate)
+            events.put((port, "started", None))
+            proc.join()
+            if proc.exitcode != 0:
+                # процесс прибили по отмене или таймауту, а не он сам упал
+                job.check()
+            return proc.exitcode
+        return flash
+
+    def _submit(self, port, target):
+        job = Job("flash", target, port, self.priority, self.timeout, self.group)
+        self.jobs[port] = job
+        self.results.pop(port, None)
+        self.scheduler.submit(job)
+
+    def _run(self, on_event, shared, version):
+        # spawn, а не fork: родитель может держать Qt и потоки
+        ctx = multiprocessing.get_context("spawn")
+        events = ctx.Queue()
+        target = self._job(ctx, events, shared, version)
+        for port in self.ports:
+            self._submit(port, target)
+
+        while True:
+            while True:
+                try:
+                    port = self._incoming.get_nowait()
+                except queue.Empty:
+                    break
+                job = self.jobs.get(port)
+                if self._stopped or (job is not None and not job.done):
+                    continue
+                if port not in self.ports:
+                    self.ports.append(port)
+                self._submit(port, target)
+
+            try:
+                port, kind, value = events.get(timeout=0.2)
+            except queue.Empty:
+                self._reap(on_event)
+                if not self._pending() and not (self.continuous and not self._stopped):
+                    break
+                continue
+
+            if kind == "done":
+                self.results[port] = value
+            on_event(port, kind, value)
+
+        # процессы еще выходят: общую память отпускаем после них
+        self.scheduler.wait(list(self.jobs.values()))
+        return self.results
+
+    def _pending(self):
+        return any(port not in self.results for port in self.jobs)
+
+    def _reap(self, on_event):
+        for port, job in list(self.jobs.items()):
+            if port in self.results or not job.done:
+                continue
+            # нормальный воркер всегда кладет "done" и выходит с кодом 0, и оно уже в очереди
+            if job.state == DONE and job.result == 0:
+                continue
+            if job.state == TIMED_OUT:
+                message = "Timed out"
+            elif job.state == CANCELLED:
+                message = "Cancelled"
+            elif job.state == FAILED:
+                message = f"Critical error: {str(job.error)}"
+            else:
+                message = f"Worker crashed (exit code {job.result})"
+            self.results[port] = (False, message)
+            on_event(port, "done", (False, message))
@@ -0,0 +1,134 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from catoshub.images import CACHE_DIR
+
+TRACE_DIR = os.path.join(CACHE_DIR, "logs")
+TRACE_FILE = "traces.jsonl"
+TRACE_PATH = os.path.join(TRACE_DIR, TRACE_FILE)
+TRACE_MAX_BYTES = 16 * 1024 * 1024
+# фазы, чьи bytes идут в итог задачи и в пропускную способность
+TRANSFER_PHASES = ("download", "delta", "write", "read")
+
+_write_lock = threading.Lock()
+
+
+def adapter_of(port):
+    # VID:PID без серийника: скорость зависит от модели переходника, а не от экземпляра
+    from catoshub.baud import adapter_key
+
+    key = adapter_key(port)
+    return ":".join(key.split(":")[:2]) if key else None
+
+
+def append_record(record, path=TRACE_PATH):
+    # одна строка - один write в O_APPEND: воркеры станции пишут в тот же файл
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    with _write_lock:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_BYTES:
+                os.replace(path, path + ".1")
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
+class JobTrace:
+    # одна задача (download, erase, flash): строка JSON на каждую фазу и итоговая на задачу
+    def __init__(self, kind, port=None, adapter=None, path=TRACE_PATH):
+        self.kind = kind
+        self.port = port
+        self.adapter = adapter if adapter is not None or port is None else adapter_of(port)
+        self.path = path
+        self.job = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self._started = time.monotonic()
+        self.spans = []
+        self.record = None
+
+    def _base(self, record_type):
+        return {"type": record_type, "job": self.job, "kind": self.kind, "port": self.port,
+                "adapter": self.adapter}
+
+    @contextlib.contextmanager
+    def span(self, phase, **attrs):
+        # attrs можно дополнить внутри блока: with trace.span("write") as attrs: attrs["bytes"] = n
+        started = time.time()
+        start = time.monotonic()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = str(e).strip() or type(e).__name__
+            raise
+        finally:
+            span = self._base("span")
+            span.update(attrs)
+            span.update({
+                "phase": phase,
+                "start": round(started, 3),
+                "seconds": round(time.monotonic() - start, 4),
+                "ok": error is None,
+            })
+            if error is not None:
+                span["error"] = error
+            self.spans.append(span)
+            if self.path is not None:
+                append_record(span, self.path)
+
+    def phases(self):
+        totals = {}
+        for span in self.spans:
+            totals[span["phase"]] = round(totals.get(span["phase"], 0.0) + span["seconds"], 4)
+        return totals
+
+    def finish(self, ok, message=""):
+        # повторный вызов ничего не пишет: итог у задачи один
+        if self.record is not None:
+            return self.record
+        record = self._base("job")
+        record.update({
+            "start": round(self.started, 3),
+            "seconds": round(time.monotonic() - self._started, 4),
+            "ok": bool(ok),
+            "message": message,
+            "bytes": sum(span.get("bytes", 0) for span in self.spans
+                         if span["phase"] in TRANSFER_PHASES and span["ok"]),
+            "phases": self.phases(),
+        })
+        self.record = record
+        if self.path is not None:
+            append_record(record, self.path)
+        return record
+
+
+def format_phases(record):
+    # "Flash took 6.2s: write 4.1s, connect 1.1s, ..." - самые долгие фазы первыми
+    phases = sorted(record["phases"].items(), key=lambda item: item[1], reverse=True)
+    text = ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in phases)
+    return f"{record['kind'].capitalize()} took {record['seconds']:.1f}s" + (f": {text}" if text else "")
+
+
+class NullTrace:
+    # для вызовов вне задачи: фазы не записываются
+    @contextlib.contextmanager
+    def span(self, phase, **attrs):
+        yield attrs
+
+    def phases(self):
+        return {}
+
+    def finish(self, ok, message=""):
+        return None
+
+
+NULL_TRACE = NullTrace()
@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = os.path.join(ROOT, "tools")
+
+FIRMWARE_SIZE = 1200 * 1024
+# сколько вставок по 64 байта отличает следующий релиз от предыдущего
+RELEASE_CHANGES = 20
+
+# задачи окна прошивки гоняем в отдельном процессе через общую очередь, как по кнопкам
+SMOKE = r"""
+import json
+import os
+import sys
+sys.path.insert(0, os.environ["CATOSHUB_ROOT"])
+import Flasher
+from catoshub.device import DeviceSession
+from catoshub.images import CACHE_DIR, FLASH_FILES
+from catoshub.partitions import load_partitions
+from PyQt5.QtWidgets import QApplication
+
+app = QApplication(sys.argv)
+port = sys.argv[1]
+results = {}
+
+def finished(name):
+    return lambda ok, message: results.__setitem__(name, {"ok": ok, "message": message})
+
+def run(worker):
+    # сигналы из потока очереди доходят через цикл событий
+    worker.start()
+    worker.job.wait()
+    app.processEvents()
+
+download = Flasher.DownloadThread("CatDevCode", "CatOs", CACHE_DIR)
+download.download_finished.connect(finished("download"))
+run(download)
+
+session = DeviceSession(port, 921600, print)
+flash = Flasher.FlashThread(session, FLASH_FILES, boot_check=True)
+flash.flash_finished.connect(finished("flash"))
+run(flash)
+
+session = DeviceSession(port, 921600, print)
+erase = Flasher.EraseThread(session, ["nvs", "otadata"], load_partitions(), backup=True)
+erase.erase_finished.connect(finished("erase"))
+run(erase)
+session.close()
+
+print("SMOKE " + json.dumps(results))
+"""
+
+
+def make_firmware(version, size=FIRMWARE_SIZE, changes=0):
+    # образ приложения с esp_app_desc_t: версию видят и probe, и проверка загрузки
+    header = bytes([0xE9, 1, 2, 0x2F]) + struct.pack("<I", 0x400D0000) + bytes(16)
+    segment = struct.pack("<II", 0x3F400020, 0x100)
+    app_desc = struct.pack("<II8x32s32s", 0xABCD5432, 0, version.encode(), b"CatOs")
+    rng = random.Random(0)
+    # повторяющиеся слова сжимаются примерно как настоящий код
+    words = [rng.randbytes(8) for _ in range(512)]
+    body = bytearray(b"".join(rng.choice(words) for _ in range(size // 8)))
+    edits = random.Random(version)
+    for _ in range(changes):
+        position = edits.randrange(len(body))
+        body[position:position] = edits.randbytes(64)
+    return header + segment + app_desc + bytes(body)
+
+
+def make_workspace():
+    workspace = tempfile.mkdtemp(prefix="catoshub-bench-")
+    shutil.copytree(os.path.join(ROOT, "flash"), os.path.join(workspace, "flash"))
+    os.makedirs(os.path.join(workspace, "fimware"))
+    with open(os.path.join(workspace, "fimware", "firmware.bin"), 'wb') as f:
+        f.write(make_firmware("1.0.0"))
+    with open(os.path.join(workspace, "fimware", "current_release.txt"), 'w') as f:
+        f.write("v1.0.0")
+    return workspace
+
+
+def _env(extra=None):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["CATOSHUB_ROOT"] = ROOT
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env.update(extra or {})
+    return env
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Service:
+    # фоновый процесс из tools/, первая строка stdout - JSON с адресом или портами
+    def __init__(self, args, cwd=None, env=None):
+        self.process = subprocess.Popen([sys.executable] + args, cwd=cwd, env=env or _env(),
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"{args[0]} exited before it was ready")
+        self.info = json.loads(line)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def catoshub(workspace, args, env=None):
+    started = time.monotonic()
+    output = subprocess.run([sys.executable, "-m", "catoshub"] + args, cwd=workspace, env=env or _env(),
+                            capture_output=True, text=True).stdout
+    elapsed = time.monotonic() - started
+    lines = [line for line in output.splitlines() if line.startswith("{")]
+    if not lines:
+        raise RuntimeError(f"catoshub {args[0]} printed no result")
+    return json.loads(lines[-1]), elapsed
+
+
+def image_bytes(workspace):
+    from catoshub.images import FLASH_FILES
+    return sum(os.path.getsize(os.path.join(workspace, file_info["path"])) for file_info in FLASH_FILES)
+
+
+def bench_flash(workspace, boards, baud, runs, latency):
+    emulator = Service([os.path.join(TOOLS, "esp32_emulator.py"), "--count", str(max(boards)),
+                        "--latency", str(latency), "--seed", "1"])
+    ports = emulator.info["ports"]
+    size = image_bytes(workspace)
+    rows = []
+    try:
+        for count in boards:
+            times = []
+            for _ in range(runs):
+                result, elapsed = catoshub(workspace, ["flash-all", "--ports", *ports[:count],
+                                                       "--parallel", str(count), "--baud", str(baud)])
+                if not result.get("ok"):
+                    raise RuntimeError(f"flash-all on {count} boards failed: {result}")
+                times.append(elapsed)
+            wall = statistics.median(times)
+            rows.append({
+                "boards": count,
+                "seconds": round(wall, 3),
+                "seconds_per_board": round(wall / count, 3),
+                "boards_per_minute": round(count * 60 / wall, 1),
+                "throughput_kib_s": round(count * size / wall / 1024, 1),
+            })
+    finally:
+        emulator.stop()
+    single = rows[0]["seconds"] * rows[0]["boards"]
+    for row in rows:
+        # 1.0 - N плат шьются так же быстро, как одна
+        row["scaling"] = round(single / row["seconds"], 2)
+    return rows
+
+
+def bench_download(workspace, bandwidth):
+    releases = os.path.join(workspace, "releases")
+    os.makedirs(releases)
+    old = make_firmware("1.0.0")
+    new = make_firmware("1.1.0", changes=RELEASE_CHANGES)
+    old_path = os.path.join(workspace, "old.bin")
+    with open(old_path, 'wb') as f:
+        f.write(old)
+    with open(os.path.join(releases, "firmware.bin"), 'wb') as f:
+        f.write(new)
+    catoshub(workspace, ["delta", old_path, os.path.join(releases, "firmware.bin"),
+                         "--out", os.path.join(releases, "firmware-v1.0.0.delta")])
+
+    args = [os.path.join(TOOLS, "fake_github.py"), releases, "--tag", "v1.1.0"]
+    if bandwidth:
+        args += ["--bandwidth", str(bandwidth)]
+    github = Service(args)
+    env = _env({"CATOSHUB_API_URL": github.info["url"]})
+    rows = []
+    mirror = None
+    try:
+        def run(name, mirror_url="", seed_old=False):
+            cache_dir = os.path.join(workspace, "cache-" + name)
+            if seed_old:
+                os.makedirs(cache_dir)
+                shutil.copy(old_path, os.path.join(cache_dir, "firmware.bin"))
+                with open(os.path.join(cache_dir, "current_release.txt"), 'w') as f:
+                    f.write("v1.0.0")
+            # "" - без зеркала, даже если оно прописано в catoshub.json
+            result, elapsed = catoshub(workspace, ["download", "--cache-dir", cache_dir, "--mirror", mirror_url], env)
+            if not result.get("ok"):
+                raise RuntimeError(f"download ({name}) failed: {result}")
+            rows.append({"scenario": name, "status": result["status"], "seconds": round(elapsed, 3)})
+            return cache_dir
+
+        full_cache = run("full")
+        run("delta", seed_old=True)
+        port = _free_port()
+        mirror = Service(["-m", "catoshub", "serve-mirror", "--cache-dir", full_cache, "--host", "127.0.0.1",
+                          "--port", str(port), "--refresh", "0"], cwd=workspace, env=env)
+        run("mirror", f"http://127.0.0.1:{port}")
+    finally:
+        if mirror is not None:
+            mirror.stop()
+        github.stop()
+    return rows
+
+
+def smoke(workspace):
+    releases = os.path.join(workspace, "smoke-release")
+    os.makedirs(releases)
+    with open(os.path.join(releases, "firmware.bin"), 'wb') as f:
+        f.write(make_firmware("1.2.0"))
+    github = Service([os.path.join(TOOLS, "fake_github.py"), releases, "--tag", "v1.2.0"])
+    emulator = Service([os.path.join(TOOLS, "esp32_emulator.py"), "--no-timing"])
+    try:
+        output = subprocess.run([sys.executable, "-c", SMOKE, emulator.info["ports"][0]], cwd=workspace,
+                                env=_env({"CATOSHUB_API_URL": github.info["url"]}),
+                                capture_output=True, text=True).stdout
+    finally:
+        emulator.stop()
+        github.stop()
+    for line in output.splitlines():
+        if line.startswith("SMOKE "):
+            results = json.loads(line[6:])
+            results["resume"] = check_resume(workspace)
+            return results
+    raise RuntimeError("smoke child produced no result")
+
+
+def check_resume(workspace, stall_after=300000):
+    # плата замолкает посреди записи: flash должен переподключиться и дописать с места сбоя по журналу
+    emulator = Service([os.path.join(TOOLS, "esp32_emulator.py"), "--no-timing", "--stall-after", str(stall_after)])
+    try:
+        process = subprocess.run([sys.executable, "-m", "catoshub", "-v", "flash", "--port", emulator.info["ports"][0]],
+                                 cwd=workspace, env=_env(), capture_output=True, text=True)
+    finally:
+        emulator.stop()
+    lines = [line for line in process.stdout.splitlines() if line.startswith("{")]
+    result = json.loads(lines[-1]) if lines else {"ok": False, "message": "flash printed no result"}
+    retried = "retry 1/" in process.stderr
+    resumed = "resuming at" in process.stderr or "already written" in process.stderr
+    if result.get("ok") and not (retried and resumed):
+        return {"ok": False, "message": "flash passed without resuming the stalled write"}
+    return {"ok": bool(result.get("ok")), "message": result.get("message", "resumed after a stall")}
+
+
+def _print_table(rows):
+    keys = list(rows[0])
+    print("  ".join(f"{key:>18}" for key in keys))
+    for row in rows:
+        print("  ".join(f"{str(row[key]):>18}" for key in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure flashing and download speed on emulated boards")
+    parser.add_argument("--boards", type=int, nargs="+", default=[1, 2, 4], help="board counts to flash at once")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="emulated USB adapter latency per reply, s")
+    parser.add_argument("--download", action="store_true", help="also time full, delta and mirror downloads")
+    parser.add_argument("--bandwidth", type=float, default=2 * 1024 * 1024, help="fake GitHub bytes/s")
+    parser.add_argument("--smoke", action="store_true",
+                        help="also run DownloadThread, FlashThread, EraseThread with a backup "
+                             "and a flash that stalls and resumes")
+    parser.add_argument("--max-seconds-per-board", type=float, help="fail if one board takes longer than this")
+    parser.add_argument("--min-scaling", type=float, help="fail if scaling at the most boards drops below this")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    workspace = make_workspace()
+    summary = {}
+    try:
+        summary["flash"] = bench_flash(workspace, sorted(set(args.boards)), args.baud, args.runs, args.latency)
+        if args.download:
+            summary["download"] = bench_download(workspace, args.bandwidth)
+        if args.smoke:
+            summary["smoke"] = smoke(workspace)
+    finally:
+        if args.keep:
+            print(f"Workspace: {workspace}", file=sys.stderr)
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for name in ("flash", "download"):
+            if name in summary:
+                _print_table(summary[name])
+                print()
+        for name, result in summary.get("smoke", {}).items():
+            print(f"{name:>10}: {'ok' if result['ok'] else 'FAILED'} - {result['message']}")
+
+    failed = False
+    single = summary["flash"][0]
+    if args.max_seconds_per_board is not None and single["boards"] == 1 \
+            and single["seconds"] > args.max_seconds_per_board:
+        print(f"Regression: one board took {single['seconds']} s > {args.max_seconds_per_board} s", file=sys.stderr)
+        failed = True
+    widest = summary["flash"][-1]
+    if args.min_scaling is not None and widest["scaling"] < args.min_scaling:
+        print(f"Regression: scaling at {widest['boards']} boards is {widest['scaling']} < {args.min_scaling}",
+              file=sys.stderr)
+        failed = True
+    smoke_results = summary.get("smoke", {})
+    if smoke_results and not all(result["ok"] for result in smoke_results.values()):
+        print("Smoke test failed", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# выполняется в отдельном процессе, чтобы каждый замер был холодным стартом
+CHILD = r"""
+import time
+started = time.perf_counter()
+import json
+import sys
+sys.path.insert(0, ".")
+import Flasher
+from PyQt5.QtWidgets import QApplication
+imported = time.perf_counter()
+app = QApplication(sys.argv)
+window = Flasher.MainWindow()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+result = {}
+def finished():
+    result["ready"] = time.perf_counter()
+    app.quit()
+window.startup_finished.connect(finished)
+if not window.pending_startup:
+    finished()
+else:
+    app.exec_()
+print("BENCH " + json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "shown_ms": (shown - started) * 1000,
+    "ready_ms": (result["ready"] - started) * 1000,
+}))
+"""
+
+
+def run_once(env):
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    for line in output.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[6:])
+    raise RuntimeError("benchmark child produced no result")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI cold start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-shown-ms", type=float, help="fail if median time to first window exceeds this")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    runs = [run_once(env) for _ in range(args.runs)]
+    summary = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>10}: {value:8.1f} ms (median of {args.runs})")
+
+    if args.max_shown_ms is not None and summary["shown_ms"] > args.max_shown_ms:
+        print(f"Regression: window shown after {summary['shown_ms']} ms > {args.max_shown_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,612 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import pty
+import random
+import select
+import signal
+import struct
+import sys
+import termios
+import threading
+import time
+import tty
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catoshub.probe import APP_DESC, APP_DESC_OFFSET, APP_OFFSET, parse_app_desc  # noqa: E402
+
+# ESP32 в режиме загрузки на pty: ROM-загрузчик, стаб esptool и флеш в памяти.
+# Порт выглядит для esptool как обычный /dev/pts/N, RTS/DTR на pty не работают,
+# поэтому "сброс" платы - это каждое новое открытие порта.
+
+ROM_BAUD = 115200
+# скорость, которую хост выставил на slave, видна через termios мастера
+SPEEDS = {getattr(termios, name): int(name[1:]) for name in dir(termios)
+          if name[0] == "B" and name[1:].isdigit()}
+SECTOR_SIZE = 0x1000
+FLASH_SIZES = {"4MB": 0x16, "8MB": 0x17, "16MB": 0x18}
+# размер флеша в заголовке бутлоадера: старшие 4 бита байта 3
+HEADER_FLASH_SIZES = {0: "1MB", 1: "2MB", 2: "4MB", 3: "8MB", 4: "16MB"}
+FLASH_MANUFACTURER = 0xEF
+FLASH_DEVICE = 0x40
+
+# примерные скорости стаба на настоящей плате, байт в секунду
+WRITE_SPEED = 400 * 1024
+MD5_SPEED = 8 * 1024 * 1024
+ERASE_SPEED = 300 * 1024
+# через сколько после открытия порта без команд плата печатает лог загрузки
+BOOT_DELAY = 0.3
+
+OP_FLASH_BEGIN = 0x02
+OP_FLASH_DATA = 0x03
+OP_FLASH_END = 0x04
+OP_MEM_BEGIN = 0x05
+OP_MEM_END = 0x06
+OP_MEM_DATA = 0x07
+OP_SYNC = 0x08
+OP_WRITE_REG = 0x09
+OP_READ_REG = 0x0A
+OP_SPI_SET_PARAMS = 0x0B
+OP_SPI_ATTACH = 0x0D
+OP_READ_FLASH_SLOW = 0x0E
+OP_CHANGE_BAUDRATE = 0x0F
+OP_FLASH_DEFL_BEGIN = 0x10
+OP_FLASH_DEFL_DATA = 0x11
+OP_FLASH_DEFL_END = 0x12
+OP_SPI_FLASH_MD5 = 0x13
+OP_GET_SECURITY_INFO = 0x14
+OP_ERASE_FLASH = 0xD0
+OP_ERASE_REGION = 0xD1
+OP_READ_FLASH = 0xD2
+OP_RUN_USER_CODE = 0xD3
+
+ERR_INVALID_MESSAGE = 0x05
+ERR_FAILED = 0x06
+ERR_BAD_CHECKSUM = 0x07
+ERR_BAD_SEQUENCE = 0x08
+
+SYNC_DATA = b"\x07\x07\x12\x20" + 32 * b"\x55"
+CHECKSUM_MAGIC = 0xEF
+
+# регистры ESP32, которые esptool читает при подключении
+CHIP_MAGIC_REG = 0x40001000
+CHIP_MAGIC = 0x00F01D83
+EFUSE_BASE = 0x3FF5A000
+# делитель UART0 в ROM: по нему esptool считает частоту кварца (40 МГц)
+UART_CLKDIV_REG = 0x3FF40014
+XTAL_FREQ = 40_000_000
+APB_CTL_DATE_REG = 0x3FF66000 + 0x7C
+RTCCALICFG1_REG = 0x3FF5F06C
+SPI_BASE = 0x3FF42000
+SPI_CMD_REG = SPI_BASE
+SPI_USR2_REG = SPI_BASE + 0x24
+SPI_W0_REG = SPI_BASE + 0x80
+SPI_CMD_USR = 1 << 18
+SPIFLASH_RDID = 0x9F
+
+
+def slip_encode(data):
+    return b"\xc0" + data.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc") + b"\xc0"
+
+
+class SlipDecoder:
+    def __init__(self):
+        self.frame = None
+        self.escape = False
+
+    def feed(self, data):
+        frames = []
+        for byte in data:
+            if self.frame is None:
+                # мусор между кадрами пропускаем
+                if byte == 0xC0:
+                    self.frame = bytearray()
+                continue
+            if self.escape:
+                self.escape = False
+                self.frame.append({0xDC: 0xC0, 0xDD: 0xDB}.get(byte, byte))
+            elif byte == 0xDB:
+                self.escape = True
+            elif byte == 0xC0:
+                if self.frame:
+                    frames.append(bytes(self.frame))
+                    self.frame = None
+                # пустой кадр - это начало следующего
+                else:
+                    self.frame = bytearray()
+            else:
+                self.frame.append(byte)
+        return frames
+
+
+def _checksum(data):
+    state = CHECKSUM_MAGIC
+    for byte in data:
+        state ^= byte
+    return state
+
+
+def _mac_efuses(mac):
+    # read_mac собирает MAC из двух слов eFuse: [2] = crc:mac0:mac1, [1] = mac2..mac5
+    return (struct.unpack(">I", bytes(mac[2:6]))[0],
+            (0x5A << 16) | (mac[0] << 8) | mac[1])
+
+
+class Esp32Emulator:
+    def __init__(self, flash_size="4MB", mac=None, timing=True, latency=0.0, write_speed=WRITE_SPEED,
+                 md5_speed=MD5_SPEED, erase_speed=ERASE_SPEED, drop_rate=0.0, corrupt_rate=0.0,
+                 stall_after=None, boot_log=True, seed=None, log=None):
+        self.flash_size = flash_size
+        self.flash = bytearray(b"\xff" * (int(flash_size[:-2]) * 1024 * 1024))
+        self.random = random.Random(seed)
+        self.mac = mac or bytes([0x24, 0x0A, 0xC4] + [self.random.randrange(256) for _ in range(3)])
+        self.timing = timing
+        self.latency = latency
+        self.write_speed = write_speed
+        self.md5_speed = md5_speed
+        self.erase_speed = erase_speed
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        # после стольких записанных байт связь пропадает до переоткрытия порта
+        self.stall_after = stall_after
+        self.boot_log = boot_log
+        self.log = log
+        self.stats = collections.Counter()
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.path = os.ttyname(slave)
+        # slave не держим: по POLLHUP видно, когда хост закрыл порт
+        os.close(slave)
+
+        self.frames = collections.deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._handlers = {
+            OP_SYNC: self._sync,
+            OP_READ_REG: self._read_reg,
+            OP_WRITE_REG: self._write_reg,
+            OP_MEM_BEGIN: self._mem_begin,
+            OP_MEM_DATA: self._mem_data,
+            OP_MEM_END: self._mem_end,
+            OP_SPI_SET_PARAMS: self._ok,
+            OP_SPI_ATTACH: self._ok,
+            OP_CHANGE_BAUDRATE: self._change_baud,
+            OP_FLASH_BEGIN: self._flash_begin,
+            OP_FLASH_DATA: self._flash_data,
+            OP_FLASH_END: self._flash_end,
+            OP_FLASH_DEFL_BEGIN: self._flash_begin,
+            OP_FLASH_DEFL_DATA: self._flash_data,
+            OP_FLASH_DEFL_END: self._flash_end,
+            OP_SPI_FLASH_MD5: self._md5,
+            OP_READ_FLASH_SLOW: self._read_flash_slow,
+            OP_ERASE_FLASH: self._erase_flash,
+            OP_ERASE_REGION: self._erase_region,
+            OP_READ_FLASH: self._read_flash,
+            OP_RUN_USER_CODE: self._run_user_code,
+        }
+        self._stalled = False
+        self._stall_used = False
+        self.host_speed = None
+        self._reset()
+
+    def _reset(self):
+        # как после EN: снова ROM на 115200, стаб и незаконченные записи пропали
+        self.stub = False
+        self.baud = ROM_BAUD
+        self.decoder = SlipDecoder()
+        self.frames.clear()
+        self.writing = None
+        self.rx_free = 0.0
+        self.tx_free = 0.0
+        self.busy_until = 0.0
+        self._stalled = False
+        efuse_mac_low, efuse_mac_high = _mac_efuses(self.mac)
+        self.registers = {
+            CHIP_MAGIC_REG: CHIP_MAGIC,
+            # ESP32-D0WD-V3, ревизия v3.0
+            EFUSE_BASE + 4 * 1: efuse_mac_low,
+            EFUSE_BASE + 4 * 2: efuse_mac_high,
+            EFUSE_BASE + 4 * 3: (1 << 9) | (1 << 15),
+            # CK8M = 128 и калибровка 800 дают ровно 40 МГц для обхода в change_baud
+            EFUSE_BASE + 4 * 4: 128,
+            EFUSE_BASE + 4 * 5: 1 << 20,
+            APB_CTL_DATE_REG: 1 << 31,
+            UART_CLKDIV_REG: XTAL_FREQ // ROM_BAUD,
+            RTCCALICFG1_REG: 800 << 7,
+        }
+
+    # --- поток обслуживания ---
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+
+    def serve(self):
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+        connected = False
+        boot_at = None
+        while not self._stop.is_set():
+            events = poller.poll(20)
+            mask = events[0][1] if events else 0
+            if not connected and not mask & select.POLLHUP:
+                connected = True
+                self.stats["sessions"] += 1
+                self._reset()
+                boot_at = time.monotonic() + BOOT_DELAY if self.boot_log else None
+            elif connected and self._reopened():
+                # закрыли и сразу открыли между двумя poll: POLLHUP не поймали
+                self.stats["sessions"] += 1
+                self._reset()
+                boot_at = time.monotonic() + BOOT_DELAY if self.boot_log else None
+            if mask & select.POLLIN:
+                try:
+                    data = os.read(self.master, 65536)
+                except OSError:
+                    data = b""
+                if data:
+                    boot_at = None
+                    self.stats["bytes_in"] += len(data)
+                    self.frames.extend(self.decoder.feed(data))
+                    while self.frames:
+                        self._handle(self.frames.popleft())
+            if mask & select.POLLHUP:
+                connected = False
+                boot_at = None
+                time.sleep(0.01)
+                continue
+            if boot_at is not None and time.monotonic() >= boot_at:
+                boot_at = None
+                self._boot()
+
+    def _reopened(self):
+        # после change_baud хост переходит на self.baud; смена на любую другую скорость - новое открытие
+        try:
+            speed = SPEEDS.get(termios.tcgetattr(self.master)[4])
+        except termios.error:
+            return False
+        changed = speed != self.host_speed
+        self.host_speed = speed
+        return changed and speed is not None and speed != self.baud
+
+    def _next_frame(self, timeout):
+        # для read_flash: ждем подтверждения хоста посреди команды
+        deadline = time.monotonic() + timeout
+        while not self.frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.master], [], [], remaining)[0]:
+                return None
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                return None
+            self.stats["bytes_in"] += len(data)
+            self.frames.extend(self.decoder.feed(data))
+        return self.frames.popleft()
+
+    # --- линия ---
+
+    def _line(self, attr, size):
+        # UART: 10 бит на байт при текущей скорости; прием и передача идут параллельно
+        if not self.timing:
+            return
+        now = time.monotonic()
+        free = max(getattr(self, attr), now) + size * 10 / self.baud
+        setattr(self, attr, free)
+        if free > now:
+            time.sleep(free - now)
+
+    def _wait(self, until):
+        if self.timing:
+            delay = until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _send_raw(self, payload):
+        frame = slip_encode(payload)
+        if self.timing and self.latency:
+            time.sleep(self.latency)
+        self._line("tx_free", len(frame))
+        try:
+            os.write(self.master, frame)
+        except OSError:
+            return
+        self.stats["bytes_out"] += len(frame)
+
+    def _reply(self, op, value=0, data=b"", error=0):
+        # стаб шлет 2 байта статуса, ROM ESP32 - 4
+        status = bytes([1 if error else 0, error]) + (b"" if self.stub else b"\0\0")
+        body = data + status
+        self._send_raw(struct.pack("<BBHI", 1, op, len(body), value) + body)
+
+    def _handle(self, frame):
+        self._line("rx_free", len(frame) + 2)
+        if self._stalled or len(frame) < 8 or frame[0] != 0:
+            return
+        _, op, size, checksum = struct.unpack("<BBHI", frame[:8])
+        data = frame[8:8 + size]
+        self.stats["frames_in"] += 1
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.stats["dropped"] += 1
+            return
+        handler = self._handlers.get(op)
+        if handler is None:
+            self._reply(op, error=ERR_INVALID_MESSAGE)
+            return
+        handler(op, data, checksum)
+
+    # --- команды ---
+
+    def _ok(self, op, data, checksum):
+        self._reply(op)
+
+    def _sync(self, op, data, checksum):
+        if data != SYNC_DATA:
+            return
+        if self.stub:
+            # хост синхронизируется только после сброса в загрузчик
+            self._reset()
+        for _ in range(8):
+            self._reply(op, value=0x20120707)
+
+    def _read_reg(self, op, data, checksum):
+        address, = struct.unpack("<I", data[:4])
+        self._reply(op, value=self.registers.get(address, 0))
+
+    def _write_reg(self, op, data, checksum):
+        for pos in range(0, len(data) - 15, 16):
+            address, value, mask, _ = struct.unpack("<IIII", data[pos:pos + 16])
+            self.registers[address] = (self.registers.get(address, 0) & ~mask) | (value & mask)
+            if address == SPI_CMD_REG and value & SPI_CMD_USR:
+                self._spi_command()
+        self._reply(op)
+
+    def _spi_command(self):
+        command = self.registers.get(SPI_USR2_REG, 0) & 0xFF
+        if command == SPIFLASH_RDID:
+            self.registers[SPI_W0_REG] = (FLASH_MANUFACTURER | (FLASH_DEVICE << 8)
+                                          | (FLASH_SIZES[self.flash_size] << 16))
+        else:
+            self.registers[SPI_W0_REG] = 0
+        self.registers[SPI_CMD_REG] &= ~SPI_CMD_USR
+
+    def _mem_begin(self, op, data, checksum):
+        self._reply(op)
+
+    def _mem_data(self, op, data, checksum):
+        self._reply(op, error=ERR_BAD_CHECKSUM if _checksum(data[16:]) != checksum else 0)
+
+    def _mem_end(self, op, data, checksum):
+        no_entry, entry = struct.unpack("<II", data[:8])
+        self._reply(op)
+        if not no_entry and not self.stub:
+            self.stub = True
+            self._send_raw(b"OHAI")
+
+    def _change_baud(self, op, data, checksum):
+        baud, _ = struct.unpack("<II", data[:8])
+        self._reply(op)
+        self.baud = baud
+        self.rx_free = self.tx_free = 0.0
+
+    def _flash_begin(self, op, data, checksum):
+        size, _, _, offset = struct.unpack("<IIII", data[:16])
+        if offset + size > len(self.flash):
+            self._reply(op, error=ERR_FAILED)
+            return
+        if not self.stub:
+            # ROM стирает все сразу, стаб - по ходу записи
+            self._wait(time.monotonic() + size / self.erase_speed)
+        self.writing = {
+            "offset": offset,
+            "written": 0,
+            "seq": 0,
+            "inflate": zlib.decompressobj() if op == OP_FLASH_DEFL_BEGIN else None,
+        }
+        self._reply(op)
+
+    def _flash_data(self, op, data, checksum):
+        length, seq, _, _ = struct.unpack("<IIII", data[:16])
+        block = data[16:16 + length]
+        writing = self.writing
+        if writing is None or len(block) != length or _checksum(block) != checksum:
+            self._reply(op, error=ERR_BAD_CHECKSUM)
+            return
+        if self.corrupt_rate and self.random.random() < self.corrupt_rate:
+            # как помеха на линии: блок не принят, хост повторит его
+            self.stats["corrupted"] += 1
+            self._reply(op, error=ERR_BAD_CHECKSUM)
+            return
+        if seq == writing["seq"] - 1:
+            # ответ на прошлый блок потерялся, хост прислал его еще раз
+            self._reply(op)
+            return
+        if seq != writing["seq"]:
+            self._reply(op, error=ERR_BAD_SEQUENCE)
+            return
+        chunk = writing["inflate"].decompress(block) if writing["inflate"] is not None else block
+        start = writing["offset"] + writing["written"]
+        if start + len(chunk) > len(self.flash):
+            self._reply(op, error=ERR_FAILED)
+            return
+        if (self.stall_after is not None and not self._stall_used
+                and self.stats["written"] + len(chunk) >= self.stall_after):
+            # связь пропала посреди записи: до переоткрытия порта плата молчит
+            self._stall_used = True
+            self._stalled = True
+            self.stats["stalls"] += 1
+            return
+        # стаб пишет блок во время приема следующего: ждем только предыдущий
+        self._wait(self.busy_until)
+        self.flash[start:start + len(chunk)] = chunk
+        writing["written"] += len(chunk)
+        writing["seq"] += 1
+        self.stats["written"] += len(chunk)
+        self.busy_until = time.monotonic() + len(chunk) / self.write_speed
+        self._reply(op)
+
+    def _flash_end(self, op, data, checksum):
+        self._wait(self.busy_until)
+        self.writing = None
+        self._reply(op)
+
+    def _md5(self, op, data, checksum):
+        address, size = struct.unpack("<II", data[:8])
+        if address + size > len(self.flash):
+            self._reply(op, error=ERR_FAILED)
+            return
+        self._wait(self.busy_until)
+        digest = hashlib.md5(self.flash[address:address + size])
+        self._wait(time.monotonic() + size / self.md5_speed)
+        self._reply(op, data=digest.digest() if self.stub else digest.hexdigest().encode())
+
+    def _read_flash_slow(self, op, data, checksum):
+        address, size = struct.unpack("<II", data[:8])
+        block = bytes(self.flash[address:address + min(size, 64)])
+        self._reply(op, data=block.ljust(64, b"\0"))
+
+    def _erase_flash(self, op, data, checksum):
+        if not self.stub:
+            self._reply(op, error=ERR_INVALID_MESSAGE)
+            return
+        self.flash[:] = b"\xff" * len(self.flash)
+        self._wait(time.monotonic() + len(self.flash) / self.erase_speed)
+        self._reply(op)
+
+    def _erase_region(self, op, data, checksum):
+        offset, size = struct.unpack("<II", data[:8])
+        if not self.stub or offset % SECTOR_SIZE or size % SECTOR_SIZE or offset + size > len(self.flash):
+            self._reply(op, error=ERR_FAILED if self.stub else ERR_INVALID_MESSAGE)
+            return
+        self.flash[offset:offset + size] = b"\xff" * size
+        self._wait(time.monotonic() + size / self.erase_speed)
+        self._reply(op)
+
+    def _read_flash(self, op, data, checksum):
+        offset, length, block_size, in_flight = struct.unpack("<IIII", data[:16])
+        if not self.stub or offset + length > len(self.flash):
+            self._reply(op, error=ERR_FAILED if self.stub else ERR_INVALID_MESSAGE)
+            return
+        self._reply(op)
+        sent = 0
+        acked = 0
+        while acked < length:
+            while sent < length and sent - acked < block_size * in_flight:
+                chunk = bytes(self.flash[offset + sent:offset + min(sent + block_size, length)])
+                self._send_raw(chunk)
+                sent += len(chunk)
+            frame = self._next_frame(3.0)
+            if frame is None:
+                return
+            acked, = struct.unpack("<I", frame[:4])
+        self._send_raw(hashlib.md5(self.flash[offset:offset + length]).digest())
+
+    def _run_user_code(self, op, data, checksum):
+        self._reset()
+        self._boot()
+
+    # --- загрузка приложения ---
+
+    def _boot(self):
+        # короткий лог ROM и баннер CatOs, если во флеше есть приложение
+        lines = ["ets Jun  8 2016 00:22:57", "", "rst:0x1 (POWERON_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)"]
+        if self.flash[0x1000] != 0xE9:
+            lines.append("invalid header: 0xffffffff")
+        else:
+            app = parse_app_desc(bytes(self.flash[APP_OFFSET:APP_OFFSET + APP_DESC_OFFSET + APP_DESC.size]))
+            if app is None:
+                lines.append("E (52) esp_image: image at 0x10000 has invalid magic byte")
+            else:
+                header_size = HEADER_FLASH_SIZES.get(self.flash[0x1003] >> 4, "unknown")
+                lines += [f"I (27) boot.esp32: SPI Flash Size : {header_size}",
+                          f"I (29) boot: Loaded app from partition at offset 0x{APP_OFFSET:x}",
+                          f"I (312) app_init: Project name:     {app['project']}"]
+                header_kb = int(header_size[:-2]) * 1024 if header_size[:-2].isdigit() else 0
+                flash_kb = int(self.flash_size[:-2]) * 1024
+                if header_kb != flash_kb:
+                    # как spi_flash в ESP-IDF: приложение видит только то, что написано в заголовке
+                    relation = "larger" if flash_kb > header_kb else "smaller"
+                    lines.append(f"W (320) spi_flash: Detected size({flash_kb}k) {relation} than the size in the "
+                                 f"binary image header({header_kb}k). Using the size in the binary image header.")
+                lines.append(f"CatOs {app['version']}")
+        self.baud = ROM_BAUD
+        for line in lines:
+            payload = (line + "\r\n").encode()
+            self._line("tx_free", len(payload))
+            try:
+                os.write(self.master, payload)
+            except OSError:
+                return
+
+
+def _mac(value):
+    return bytes(int(part, 16) for part in value.split(":"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate ESP32 boards in download mode on ptys")
+    parser.add_argument("--count", type=int, default=1, help="number of boards")
+    parser.add_argument("--flash-size", choices=sorted(FLASH_SIZES), nargs="+", default=["4MB"],
+                        help="flash size of the boards, several values go round the boards: 4MB 8MB 16MB")
+    parser.add_argument("--mac", type=_mac, help="MAC of the first board, the rest get +1, +2...")
+    parser.add_argument("--no-timing", action="store_true", help="answer instantly, no UART or flash delays")
+    parser.add_argument("--latency", type=float, default=0.0, help="extra seconds before every reply")
+    parser.add_argument("--write-speed", type=float, default=WRITE_SPEED, help="flash write bytes/s")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of commands left unanswered")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0, help="share of data blocks rejected")
+    parser.add_argument("--stall-after", type=int, help="go silent once after writing this many bytes")
+    parser.add_argument("--no-boot-log", action="store_true", help="don't print the boot log on port open")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--link-dir", help="also create ttyEMU<N> symlinks in this directory")
+    args = parser.parse_args()
+
+    emulators = []
+    for index in range(args.count):
+        mac = None
+        if args.mac is not None:
+            mac = (int.from_bytes(args.mac, "big") + index).to_bytes(6, "big")
+        flash_size = args.flash_size[index % len(args.flash_size)]
+        emulators.append(Esp32Emulator(flash_size, mac, not args.no_timing, args.latency, args.write_speed,
+                                       drop_rate=args.drop_rate, corrupt_rate=args.corrupt_rate,
+                                       stall_after=args.stall_after, boot_log=not args.no_boot_log,
+                                       seed=None if args.seed is None else args.seed + index).start())
+    ports = [emulator.path for emulator in emulators]
+    if args.link_dir:
+        os.makedirs(args.link_dir, exist_ok=True)
+        ports = []
+        for index, emulator in enumerate(emulators):
+            link = os.path.join(args.link_dir, f"ttyEMU{index}")
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(emulator.path, link)
+            ports.append(link)
+    print(json.dumps({"ports": ports}), flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    for emulator in emulators:
+        emulator.stop()
+    print(json.dumps({"stats": [dict(emulator.stats) for emulator in emulators]}), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# локальная замена api.github.com для замеров и проверок без сети:
+# CATOSHUB_API_URL=http://127.0.0.1:8781 python -m catoshub download
+# Ассеты релиза - все файлы из --release-dir (firmware.bin, firmware-<tag>.delta).
+
+CHUNK_SIZE = 64 * 1024
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, release_dir, tag, host="127.0.0.1", port=0, bandwidth=None, latency=0.0,
+                 rate_limited=False):
+        self.release_dir = release_dir
+        self.tag = tag
+        # байт в секунду на одно соединение; None - без ограничения
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.stats = {"api": 0, "not_modified": 0, "assets": 0, "bytes": 0}
+        self.lock = threading.Lock()
+        super().__init__((host, port), FakeGitHubHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def release(self):
+        assets = []
+        for name in sorted(os.listdir(self.release_dir)):
+            path = os.path.join(self.release_dir, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            assets.append({
+                "name": name,
+                "size": os.path.getsize(path),
+                "digest": f"sha256:{digest}",
+                "browser_download_url": f"{self.url}/download/{self.tag}/{name}",
+            })
+        return {"tag_name": self.tag, "assets": assets}
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _serve(self, body):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path = self.path.split("?", 1)[0]
+        if re.fullmatch(r"/repos/[^/]+/[^/]+/releases/latest", path):
+            return self._release(body)
+        match = re.fullmatch(r"/download/[^/]+/([^/]+)", path)
+        if match:
+            return self._asset(match.group(1), body)
+        self._empty(404)
+
+    def _release(self, body):
+        self.server.count("api")
+        if self.server.rate_limited:
+            self.send_response(403)
+            self.send_header("X-RateLimit-Remaining", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = json.dumps(self.server.release()).encode()
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.count("not_modified")
+            self._empty(304, {"ETag": etag})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def _asset(self, name, body):
+        path = os.path.join(self.server.release_dir, os.path.basename(name))
+        if not os.path.isfile(path):
+            return self._empty(404)
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        match = RANGE.match(self.headers.get("Range", "").strip())
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                return self._empty(416, {"Content-Range": f"bytes */{size}"})
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not body:
+            return
+        self.server.count("assets")
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            started = time.monotonic()
+            sent = 0
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except OSError:
+                    return
+                remaining -= len(chunk)
+                sent += len(chunk)
+                self.server.count("bytes", len(chunk))
+                if self.server.bandwidth:
+                    delay = started + sent / self.server.bandwidth - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+    def _empty(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake GitHub release API for CatOs-Hub")
+    parser.add_argument("release_dir", help="directory with the release assets")
+    parser.add_argument("--tag", default="v1.0.0")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--bandwidth", type=float, help="bytes per second per download")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--rate-limited", action="store_true", help="answer the API with 403 rate limit")
+    args = parser.parse_args()
+
+    server = FakeGitHub(args.release_dir, args.tag, args.host, args.port, args.bandwidth, args.latency,
+                        args.rate_limited)
+    print(json.dumps({"url": server.url}), flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print(json.dumps({"stats": server.stats}), flush=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())